@@ -0,0 +1,71 @@
+"""
+Wall time of reading the root_idx_mapping and spans of a layer(STAM): the bulk
+read through the root_idx_mapping key data (utils.iter_root_idx_anns) against
+the per-annotation loop over every data of every annotation, on the synthetic
+pecha sets (see synthetic.py).
+
+    PYTHONPATH=src pytest benchmarks/bench_extract.py
+
+The layer is loaded once per size, only the extraction is timed.
+"""
+import os
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+import pytest
+from stam import AnnotationStore
+from synthetic import make_pecha_set
+
+from alignment_ann_transfer.utils import iter_root_idx_anns
+
+SIZES = [
+    int(size)
+    for size in os.environ.get("BENCHMARK_SIZES", "1000,10000,100000").split(",")
+]
+ROUNDS = int(os.environ.get("BENCHMARK_ROUNDS", "5"))
+
+
+def extract_per_annotation(layer: AnnotationStore) -> List[Tuple[int, int, str]]:
+    spans = []
+    for ann in layer.annotations():
+        start, end = ann.offset().begin().value(), ann.offset().end().value()
+        ann_metadata = {}
+        for data in ann:
+            ann_metadata[data.key().id()] = str(data.value())
+        spans.append((start, end, ann_metadata["root_idx_mapping"]))
+    return spans
+
+
+def extract_bulk(layer: AnnotationStore) -> List[Tuple[int, int, str]]:
+    spans = []
+    for ann, root_idx_mapping in iter_root_idx_anns(layer):
+        offset = ann.offset()
+        spans.append((offset.begin().value(), offset.end().value(), root_idx_mapping))
+    return spans
+
+
+EXTRACTIONS: Dict[str, Callable] = {
+    "per_annotation": extract_per_annotation,
+    "bulk": extract_bulk,
+}
+
+
+@pytest.fixture(scope="session", params=SIZES, ids=lambda size: f"{size}_segments")
+def layers(request, tmp_path_factory) -> Dict[str, AnnotationStore]:
+    output_dir = tmp_path_factory.mktemp(f"layers_{request.param}")
+    pecha_paths = make_pecha_set(output_dir, segments=request.param)
+    return {
+        name: AnnotationStore(file=str(next((Path(path) / "layers").rglob("*.json"))))
+        for name, path in pecha_paths.items()
+        if name in ["root", "commentary"]
+    }
+
+
+@pytest.mark.parametrize("extraction", EXTRACTIONS)
+@pytest.mark.parametrize("layer", ["root", "commentary"])
+def test_extract(benchmark, layers, layer, extraction):
+    benchmark.group = f"extract_{layer}"
+    spans = benchmark.pedantic(
+        EXTRACTIONS[extraction], args=(layers[layer],), rounds=ROUNDS, iterations=1
+    )
+    assert spans == extract_per_annotation(layers[layer])
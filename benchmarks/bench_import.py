@@ -0,0 +1,78 @@
+"""
+Cold start import time of the package modules, paid by every short lived
+worker process before it transfers anything.
+
+    PYTHONPATH=src pytest benchmarks/bench_import.py
+
+Every module is imported in a new interpreter with -X importtime, and the best
+of IMPORT_ROUNDS runs must stay under IMPORT_BUDGET_MS (100ms by default), not
+counting the interpreter startup. The times assume the bytecode of the
+package is written on the first import (not with PYTHONDONTWRITEBYTECODE).
+openpecha, stam and numpy must not be imported at all: they are only imported
+on first use.
+"""
+import os
+import subprocess
+import sys
+from typing import List, Tuple
+
+import pytest
+
+MODULES = [
+    "alignment_ann_transfer",
+    "alignment_ann_transfer.translation",
+    "alignment_ann_transfer.commentary",
+    "alignment_ann_transfer.session",
+    "alignment_ann_transfer.batch",
+]
+HEAVY_MODULES = ["openpecha", "stam", "numpy"]
+BUDGET_MS = float(os.environ.get("IMPORT_BUDGET_MS", "100"))
+ROUNDS = int(os.environ.get("IMPORT_ROUNDS", "5"))
+
+
+def get_top_level_imports(code: str) -> List[Tuple[int, str]]:
+    """
+    Get the (cumulative microseconds, module) of the top level imports made by
+    a new interpreter running code
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line.split("|")
+        if cumulative.strip().isdigit() and not name.startswith("  "):
+            imports.append((int(cumulative), name.strip()))
+    return imports
+
+
+def get_import_time_ms(module: str) -> float:
+    startup_modules = {name for _, name in get_top_level_imports("pass")}
+    import_time_us = sum(
+        cumulative
+        for cumulative, name in get_top_level_imports(f"import {module}")
+        if name not in startup_modules
+    )
+    return import_time_us / 1000
+
+
+@pytest.mark.parametrize("module", MODULES)
+def test_import_time(module):
+    import_time_ms = min(get_import_time_ms(module) for _ in range(ROUNDS))
+    print(f"{module}: {import_time_ms:.1f}ms")
+    assert import_time_ms < BUDGET_MS
+
+
+@pytest.mark.parametrize("module", MODULES)
+def test_no_heavy_imports(module):
+    code = f"import sys, {module}; print(' '.join(sys.modules))"
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    imported = {name.split(".")[0] for name in result.stdout.split()}
+    assert not imported & set(HEAVY_MODULES)
@@ -0,0 +1,128 @@
+"""
+Wall time and peak memory of the alignment transfer methods on synthetic pecha
+sets (see synthetic.py), at 1k/10k/100k segments by default.
+
+    pip install .[dev]
+    PYTHONPATH=src pytest benchmarks/bench_transfer.py
+
+    # Only some sizes, and compare against a saved run
+    BENCHMARK_SIZES=1000,10000 PYTHONPATH=src pytest benchmarks/bench_transfer.py \
+        --benchmark-autosave --benchmark-compare
+
+Every round runs the method on a new transfer, so nothing is cached between
+rounds. The peak memory (extra_info.peak_memory_mb) is measured with
+tracemalloc in a separate run: it covers the python and numpy allocations,
+not the ones made inside stam.
+"""
+import os
+import tracemalloc
+from typing import Callable, Dict, List
+
+import pytest
+from openpecha.pecha import Pecha
+from synthetic import make_pecha_set
+
+from alignment_ann_transfer.commentary import CommentaryAlignmentTransfer
+from alignment_ann_transfer.projection import AnchoredProjection
+from alignment_ann_transfer.translation import TranslationAlignmentTransfer
+
+SIZES = [
+    int(size)
+    for size in os.environ.get("BENCHMARK_SIZES", "1000,10000,100000").split(",")
+]
+ROUNDS = int(os.environ.get("BENCHMARK_ROUNDS", "3"))
+
+# Base update in memory, by merging layers into the pechas, with the anchored
+# offset projection, or window by window with it
+TRANSFER_OPTIONS: Dict[str, Dict] = {
+    "in_memory": {"in_memory": True},
+    "merge": {"in_memory": False},
+    "anchored": {"projection": AnchoredProjection()},
+    "windowed": {"projection": AnchoredProjection(), "window_size": 100_000},
+}
+
+# method -> pechas it takes
+TRANSLATION_METHODS: Dict[str, List[str]] = {
+    "get_layer_anns": ["root"],
+    "base_update_anns": ["root", "root_display"],
+    "get_root_pechas_mapping": ["root", "root_display"],
+    "get_translation_pechas_mapping": ["translation", "translation_display"],
+    "get_serialized_translation": ["root", "root_display", "translation"],
+    "get_serialized_translation_display": [
+        "root",
+        "root_display",
+        "translation",
+        "translation_display",
+    ],
+    "get_aligned_translation": ["root", "root_display", "translation"],
+}
+COMMENTARY_METHODS: Dict[str, List[str]] = {
+    "get_commentary_layer_anns": ["commentary"],
+    "get_commentary_pechas_mapping": ["commentary", "commentary_display"],
+    "get_serialized_commentary": ["root", "root_display", "commentary"],
+    "get_serialized_commentary_display": [
+        "root",
+        "root_display",
+        "commentary",
+        "commentary_display",
+    ],
+    "get_aligned_display_commentary": ["root", "root_display", "commentary"],
+}
+
+
+@pytest.fixture(scope="session", params=SIZES, ids=lambda size: f"{size}_segments")
+def pechas(request, tmp_path_factory) -> Dict[str, Pecha]:
+    output_dir = tmp_path_factory.mktemp(f"pechas_{request.param}")
+    pecha_paths = make_pecha_set(output_dir, segments=request.param)
+    return {name: Pecha.from_path(path) for name, path in pecha_paths.items()}
+
+
+def get_peak_memory(func: Callable) -> float:
+    """
+    Peak memory allocated while running func, in MB
+    """
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / 2**20
+
+
+def run_benchmark(benchmark, transfer_class, method, pechas, options):
+    def setup():
+        return (transfer_class(**options),), {}
+
+    def run(transfer):
+        return getattr(transfer, method)(*pechas)
+
+    benchmark.group = method
+    benchmark.pedantic(run, setup=setup, rounds=ROUNDS, iterations=1)
+    benchmark.extra_info["peak_memory_mb"] = get_peak_memory(
+        lambda: run(transfer_class(**options))
+    )
+
+
+@pytest.mark.parametrize("options", TRANSFER_OPTIONS)
+@pytest.mark.parametrize("method", TRANSLATION_METHODS)
+def test_translation_transfer(benchmark, pechas, method, options):
+    run_benchmark(
+        benchmark,
+        TranslationAlignmentTransfer,
+        method,
+        [pechas[name] for name in TRANSLATION_METHODS[method]],
+        TRANSFER_OPTIONS[options],
+    )
+
+
+@pytest.mark.parametrize("options", TRANSFER_OPTIONS)
+@pytest.mark.parametrize("method", COMMENTARY_METHODS)
+def test_commentary_transfer(benchmark, pechas, method, options):
+    run_benchmark(
+        benchmark,
+        CommentaryAlignmentTransfer,
+        method,
+        [pechas[name] for name in COMMENTARY_METHODS[method]],
+        TRANSFER_OPTIONS[options],
+    )
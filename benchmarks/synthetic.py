@@ -0,0 +1,345 @@
+"""
+Generate synthetic pecha sets to benchmark the alignment transfer at scale.
+
+A pecha set is a root, root display, translation, translation display,
+commentary and commentary display pecha, written in the same layout as the
+test fixtures (metadata.json, base/<base>.txt and a single STAM layer).
+
+    python benchmarks/synthetic.py <output_dir> --segments 10000
+"""
+import argparse
+import json
+import random
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+TIBETAN_LETTERS = "ཀཁགངཅཆཇཉཏཐདནཔཕབམཙཚཛཝཞཟའཡརལཤསཧཨ"
+TIBETAN_VOWELS = ["", "ི", "ུ", "ེ", "ོ"]
+ENGLISH_WORDS = (
+    "the mind of awakening is the wish to attain buddhahood for the sake of all "
+    "beings and the practice of generosity ethics patience diligence meditation "
+    "and wisdom which are the six perfections of the bodhisattva path"
+).split()
+
+# pecha name -> (segment type, annotation set, type key) of its layer
+LAYER_TYPES = {
+    "root": ("Tibetan_Segment", "Translation", "Translation_Segment"),
+    "root_display": ("Tibetan_Segment", "Translation", "Translation_Segment"),
+    "translation": ("English_Segment", "Translation", "Translation_Segment"),
+    "translation_display": ("English_Segment", "Translation", "Translation_Segment"),
+    "commentary": ("Meaning_Segment", "Structure_Annotation", "Structure_Type"),
+    "commentary_display": ("Meaning_Segment", "Structure_Annotation", "Structure_Type"),
+}
+
+
+def get_id(rng: random.Random, length: int = 8) -> str:
+    return "".join(rng.choice("0123456789ABCDEF") for _ in range(length))
+
+
+def get_tibetan_text(rng: random.Random, length: int) -> str:
+    syllables: List[str] = []
+    text_length = 0
+    while text_length < length:
+        syllable = rng.choice(TIBETAN_LETTERS) + rng.choice(TIBETAN_VOWELS)
+        syllables.append(syllable)
+        text_length += len(syllable) + 1
+    return "་".join(syllables) + "།"
+
+
+def get_english_text(rng: random.Random, length: int) -> str:
+    words: List[str] = []
+    text_length = 0
+    while text_length < length:
+        word = rng.choice(ENGLISH_WORDS)
+        words.append(word)
+        text_length += len(word) + 1
+    return " ".join(words) + "."
+
+
+def edit_text(rng: random.Random, text: str, edit_rate: float) -> str:
+    """
+    Apply about edit_rate * len(text) random character substitutions,
+    insertions and deletions, as between two editions of a text
+    """
+    expected_edits = len(text) * edit_rate
+    edit_count = int(expected_edits) + (rng.random() < expected_edits % 1)
+    if not edit_count:
+        return text
+
+    chars = list(text)
+    for _ in range(edit_count):
+        pos = rng.randrange(len(chars))
+        edit = rng.random()
+        if edit < 1 / 3:
+            chars[pos] = rng.choice(text)
+        elif edit < 2 / 3 or len(chars) < 2:
+            chars.insert(pos, rng.choice(text))
+        else:
+            del chars[pos]
+    return "".join(chars)
+
+
+def resegment(
+    rng: random.Random, segments: List[str], resegment_rate: float
+) -> List[str]:
+    """
+    Change the segmentation of a text: merge a segment with the next one or
+    split it in two, each with a probability of resegment_rate / 2
+    """
+    new_segments: List[str] = []
+    for segment in segments:
+        if new_segments and rng.random() < resegment_rate / 2:
+            new_segments[-1] += "\n" + segment
+        elif len(segment) > 1 and rng.random() < resegment_rate / 2:
+            split_pos = len(segment) // 2
+            new_segments.extend([segment[:split_pos], segment[split_pos:]])
+        else:
+            new_segments.append(segment)
+    return new_segments
+
+
+def get_commentary_mappings(
+    rng: random.Random, segment_count: int, range_density: float, max_range: int
+) -> List[str]:
+    """
+    Map the commentary segments to the root segments in order. With a
+    probability of range_density a segment maps to a range of root segments
+    ("3-5"), or to a range and the next root segment ("3-5,6").
+    """
+    mappings = []
+    root_idx = 1
+    for _ in range(segment_count):
+        root_idx = min(root_idx, segment_count)
+        if rng.random() >= range_density:
+            mappings.append(str(root_idx))
+            root_idx += 1
+            continue
+
+        end_idx = min(root_idx + rng.randint(1, max(max_range - 1, 1)), segment_count)
+        mapping = f"{root_idx}-{end_idx}" if end_idx > root_idx else str(root_idx)
+        if end_idx < segment_count and rng.random() < 0.5:
+            end_idx += 1
+            mapping += f",{end_idx}"
+        mappings.append(mapping)
+        root_idx = end_idx
+    return mappings
+
+
+def write_pecha(
+    rng: random.Random,
+    pecha_dir: Path,
+    name: str,
+    segments: List[str],
+    root_idx_mappings: Optional[List[str]] = None,
+    language: str = "bo",
+) -> Path:
+    """
+    Write a pecha with a single base made of the segments (one per line) and a
+    single layer annotating them, with root_idx_mappings (default: 1..n).
+    """
+    segment_type, set_id, type_key = LAYER_TYPES[name]
+    pecha_id = f"I{get_id(rng)}"
+    base_name = get_id(rng, 4)
+    pecha_path = pecha_dir / pecha_id
+    (pecha_path / "base").mkdir(parents=True)
+    (pecha_path / "layers" / base_name).mkdir(parents=True)
+
+    if root_idx_mappings is None:
+        root_idx_mappings = [str(idx) for idx in range(1, len(segments) + 1)]
+
+    spans: List[Tuple[int, int]] = []
+    start = 0
+    for segment in segments:
+        spans.append((start, start + len(segment)))
+        start += len(segment) + 1
+    base = "\n".join(segments)
+    (pecha_path / "base" / f"{base_name}.txt").write_text(base, encoding="utf-8")
+
+    type_data_id = get_id(rng)
+    data = [
+        {
+            "@type": "AnnotationData",
+            "@id": type_data_id,
+            "key": type_key,
+            "value": {"@type": "String", "value": segment_type},
+        }
+    ]
+    mapping_data_ids: Dict[str, str] = {}
+    annotations = []
+    for (start, end), mapping in zip(spans, root_idx_mappings):
+        if mapping not in mapping_data_ids:
+            mapping_data_ids[mapping] = f"M{len(mapping_data_ids)}"
+            data.append(
+                {
+                    "@type": "AnnotationData",
+                    "@id": mapping_data_ids[mapping],
+                    "key": "root_idx_mapping",
+                    "value": {"@type": "String", "value": mapping},
+                }
+            )
+        annotations.append(
+            {
+                "@type": "Annotation",
+                "@id": f"A{len(annotations)}",
+                "target": {
+                    "@type": "TextSelector",
+                    "resource": base_name,
+                    "offset": {
+                        "@type": "Offset",
+                        "begin": {"@type": "BeginAlignedCursor", "value": start},
+                        "end": {"@type": "BeginAlignedCursor", "value": end},
+                    },
+                },
+                "data": [
+                    {
+                        "@type": "AnnotationData",
+                        "@id": mapping_data_ids[mapping],
+                        "set": set_id,
+                    },
+                    {"@type": "AnnotationData", "@id": type_data_id, "set": set_id},
+                ],
+            }
+        )
+
+    layer = {
+        "@type": "AnnotationStore",
+        "@id": pecha_id,
+        "resources": [
+            {
+                "@type": "TextResource",
+                "@id": base_name,
+                "@include": f"../../base/{base_name}.txt",
+            }
+        ],
+        "annotationsets": [
+            {
+                "@type": "AnnotationDataSet",
+                "@id": set_id,
+                "keys": [
+                    {"@type": "DataKey", "@id": "root_idx_mapping"},
+                    {"@type": "DataKey", "@id": type_key},
+                ],
+                "data": data,
+            }
+        ],
+        "annotations": annotations,
+    }
+    layer_path = (
+        pecha_path / "layers" / base_name / f"{segment_type}-{get_id(rng, 4)}.json"
+    )
+    layer_path.write_text(json.dumps(layer, ensure_ascii=False), encoding="utf-8")
+
+    metadata = {
+        "id": pecha_id,
+        "title": {"EN": f"Synthetic {name} pecha"},
+        "author": {"EN": "Synthetic"},
+        "imported": "2025-01-01T00:00:00",
+        "source": "synthetic",
+        "toolkit_version": "0.0.1",
+        "parser": "GoogleDocTranslationParser",
+        "initial_creation_type": "google_docx",
+        "language": language,
+        "source_metadata": {},
+        "bases": [
+            {
+                base_name: {
+                    "source_metadata": {"total_segments": len(segments)},
+                    "base_file": f"{base_name}.txt",
+                }
+            }
+        ],
+        "copyright": {"status": "Unknown", "notice": "", "info_url": None},
+        "licence": "Unknown",
+    }
+    (pecha_path / "metadata.json").write_text(
+        json.dumps(metadata, ensure_ascii=False, indent=2), encoding="utf-8"
+    )
+    return pecha_path
+
+
+def make_pecha_set(
+    output_dir: Path,
+    segments: int = 1000,
+    segment_length: int = 60,
+    edit_rate: float = 0.01,
+    resegment_rate: float = 0.1,
+    range_density: float = 0.2,
+    max_range: int = 3,
+    seed: int = 0,
+) -> Dict[str, Path]:
+    """
+    Write a synthetic pecha set to output_dir and return the pecha paths by name
+    (root, root_display, translation, translation_display, commentary,
+    commentary_display).
+
+    segments: Number of root, translation and commentary segments
+    segment_length: Length of a segment in characters (base length / segments)
+    edit_rate: Rate of edited characters between a pecha and its display pecha
+    resegment_rate: Rate of segments merged or split in the display pechas
+    range_density: Rate of commentary segments mapped to a range of root segments
+    max_range: Maximum number of root segments in a range
+    """
+    rng = random.Random(seed)
+    output_dir = Path(output_dir)
+
+    root_segments = [get_tibetan_text(rng, segment_length) for _ in range(segments)]
+    translation_segments = [
+        get_english_text(rng, segment_length) for _ in range(segments)
+    ]
+    commentary_segments = [
+        get_tibetan_text(rng, segment_length) for _ in range(segments)
+    ]
+
+    def get_display_segments(texts: List[str]) -> List[str]:
+        edited_texts = [edit_text(rng, text, edit_rate) for text in texts]
+        return resegment(rng, edited_texts, resegment_rate)
+
+    pecha_segments = {
+        "root": (root_segments, None, "bo"),
+        "root_display": (get_display_segments(root_segments), None, "bo"),
+        "translation": (translation_segments, None, "en"),
+        "translation_display": (get_display_segments(translation_segments), None, "en"),
+        "commentary": (
+            commentary_segments,
+            get_commentary_mappings(rng, segments, range_density, max_range),
+            "bo",
+        ),
+        "commentary_display": (get_display_segments(commentary_segments), None, "bo"),
+    }
+
+    pecha_paths = {}
+    for name, (texts, root_idx_mappings, language) in pecha_segments.items():
+        pecha_paths[name] = write_pecha(
+            rng, output_dir / name, name, texts, root_idx_mappings, language
+        )
+    return pecha_paths
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic pecha set")
+    parser.add_argument("output_dir", type=Path)
+    parser.add_argument("--segments", type=int, default=1000)
+    parser.add_argument("--segment-length", type=int, default=60)
+    parser.add_argument("--edit-rate", type=float, default=0.01)
+    parser.add_argument("--resegment-rate", type=float, default=0.1)
+    parser.add_argument("--range-density", type=float, default=0.2)
+    parser.add_argument("--max-range", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    pecha_paths = make_pecha_set(
+        args.output_dir,
+        segments=args.segments,
+        segment_length=args.segment_length,
+        edit_rate=args.edit_rate,
+        resegment_rate=args.resegment_rate,
+        range_density=args.range_density,
+        max_range=args.max_range,
+        seed=args.seed,
+    )
+    for name, pecha_path in pecha_paths.items():
+        print(f"{name}: {pecha_path}")
+
+
+if __name__ == "__main__":
+    main()
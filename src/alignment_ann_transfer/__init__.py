@@ -1,13 +1,299 @@
+from __future__ import annotations
+
+from contextlib import nullcontext
+from functools import partial
 from pathlib import Path
-from typing import Dict, List
+from typing import (
+    TYPE_CHECKING,
+    Callable,
+    ContextManager,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Type,
+    Union,
+)
+
+from alignment_ann_transfer.cache import LayerCache
+from alignment_ann_transfer.spans import (
+    LayerAnns,
+    SpanArray,
+    SpanIndex,
+    get_span_overlaps,
+    get_windowed_span_overlaps,
+)
+from alignment_ann_transfer.stats import TransferStats
+from alignment_ann_transfer.utils import Span, iter_root_idx_anns, parse_root_indices
+
+# openpecha, stam and numpy are imported where they are first used, so
+# importing the package stays cheap for short lived processes
+if TYPE_CHECKING:
+    import numpy as np
+    from openpecha.pecha import Pecha
+    from stam import AnnotationStore
 
-from openpecha.pecha import Pecha
-from stam import AnnotationStore
+    from alignment_ann_transfer.mapping_store import MappingStore
+    from alignment_ann_transfer.projection import DiffProjection, OffsetTable
+    from alignment_ann_transfer.session import PechaSetSession
+    from alignment_ann_transfer.snapshot import LayerSnapshot, LayerSnapshotStore
+    from alignment_ann_transfer.windowed import Window
 
 
 class AlignmentTransfer:
+    def __init__(
+        self,
+        in_memory: bool = False,
+        cache_size: int = 128,
+        mapping_store: Optional[MappingStore] = None,
+        stats: Optional[TransferStats] = None,
+        projection: Optional[DiffProjection] = None,
+        snapshot_store: Optional[LayerSnapshotStore] = None,
+        window_size: Optional[int] = None,
+        window_processes: int = 1,
+    ):
+        """
+        in_memory: Project the layers with base update in memory instead of
+        merging them into the target pecha and reloading them from disk.
+        cache_size: Number of extracted layers and pechas mappings to keep in
+        memory, they are recomputed when their pecha files change on disk.
+        mapping_store: Persistent store to load the pechas mappings computed
+        by any process from, keyed by the content of the pecha files and the
+        base update backend (see get_base_update_key).
+        stats: Record the duration of every stage and the annotation, bytes and
+        overlap counts into it. Nothing is recorded without it.
+        projection: Offset projection backend (eg: AnchoredProjection) moving
+        the layers to another base instead of the openpecha base update. The
+        layers are then always projected in memory.
+        snapshot_store: Store of binary layer snapshots to read the pecha
+        layers from (memory mapped) instead of parsing their STAM files.
+        window_size: Transfer and map the layers window by window, windows of
+        about window_size base characters (see windowed.py): the diffs, span
+        overlaps and mapping pairs are computed per window. The bases and the
+        layer span arrays are still read whole (memory mapped with a
+        snapshot_store). The layers are then always projected in memory, with
+        the projection backend or a diff of every window.
+        window_processes: Number of processes projecting the windows.
+        """
+        self.in_memory = in_memory
+        self.cache = LayerCache(cache_size)
+        self.mapping_store = mapping_store
+        self.stats = stats
+        self.projection = projection
+        self.snapshot_store = snapshot_store
+        self.window_size = window_size
+        self.window_processes = window_processes
+        self.layer_paths: Dict[Path, Path] = {}
+
+    def stage(self, name: str) -> ContextManager:
+        """
+        Time the block as the stage name, if stats are recorded
+        """
+        if self.stats is None:
+            return nullcontext()
+        return self.stats.stage(name)
+
+    def count(self, name: str, value: int):
+        if self.stats is not None:
+            self.stats.add(name, value)
+
+    def load_layer(self, layer_path: Path) -> AnnotationStore:
+        from stam import AnnotationStore
+
+        with self.stage("load_layer"):
+            layer = AnnotationStore(file=str(layer_path))
+        if self.stats is not None:
+            self.stats.add("bytes_read", Path(layer_path).stat().st_size)
+        return layer
+
+    def get_first_base_name(self, pecha: Pecha) -> str:
+        """
+        Get the base of a single base pecha (or pecha chapter): the other bases
+        of a multi-base pecha would be left out of the transfer
+        """
+        if len(pecha.bases) > 1:
+            raise ValueError(
+                f"Pecha {pecha.pecha_path} has {len(pecha.bases)} bases, transfer it "
+                "chapter by chapter (see chapters.get_chapter_sessions)"
+            )
+        return next(iter(pecha.bases))
+
+    def has_chapters(self, *pechas: Optional[Pecha]) -> bool:
+        """
+        Check if any of the pechas has several bases (chapters or volumes)
+        """
+        return any(pecha is not None and len(pecha.bases) > 1 for pecha in pechas)
+
+    def iter_chapter_outputs(
+        self,
+        session_class: Type[PechaSetSession],
+        method: str,
+        pechas: Dict[str, Optional[Pecha]],
+    ) -> Iterator:
+        """
+        Yield the output of a session method (eg: iter_serialized_translation)
+        for every chapter of a multi-base pecha set, in chapter order
+        """
+        from alignment_ann_transfer.chapters import get_chapter_sessions
+
+        for session in get_chapter_sessions(session_class, pechas, self):
+            yield from getattr(session, method)()
+
     def get_first_layer_path(self, pecha: Pecha) -> Path:
-        return next(pecha.layer_path.rglob("*.json"))
+        """
+        Get the first layer of the pecha first base
+        """
+        layer_dir = pecha.layer_path / self.get_first_base_name(pecha)
+        layer_path = self.layer_paths.get(layer_dir)
+        if layer_path is None or not layer_path.exists():
+            layer_path = next(layer_dir.rglob("*.json"))
+            self.layer_paths[layer_dir] = layer_path
+        return layer_path
+
+    def get_first_base_path(self, pecha: Pecha) -> Path:
+        return pecha.base_path / f"{self.get_first_base_name(pecha)}.txt"
+
+    def get_pecha_files(self, pecha: Pecha) -> List[Path]:
+        """
+        Get the files a pechas mapping depends on: first base and first layer
+        """
+        return [self.get_first_base_path(pecha), self.get_first_layer_path(pecha)]
+
+    def get_layer(self, pecha: Pecha) -> AnnotationStore:
+        """
+        Get the loaded first layer of the pecha (cached), so the annotations,
+        the spans and the base update of a layer parse its file only once
+        """
+        layer_path = self.get_first_layer_path(pecha)
+        return self.cache.get_or_compute(
+            "layer", [layer_path], partial(self.load_layer, layer_path)
+        )
+
+    def get_layer_snapshot(self, pecha: Pecha) -> LayerSnapshot:
+        """
+        Get the snapshot of the pecha first layer from the snapshot store,
+        exported first if missing or stale (cached)
+        """
+        assert self.snapshot_store is not None
+        snapshot_store = self.snapshot_store
+        layer_path = self.get_first_layer_path(pecha)
+        base_path = self.get_first_base_path(pecha)
+
+        def load_snapshot() -> LayerSnapshot:
+            with self.stage("load_snapshot"):
+                snapshot = snapshot_store.get(layer_path, base_path)
+            self.count("bytes_read", snapshot.path.stat().st_size)
+            return snapshot
+
+        return self.cache.get_or_compute(
+            "snapshot", [layer_path, base_path], load_snapshot
+        )
+
+    def get_layer_anns(self, pecha: Pecha) -> Dict:
+        """
+        Get the extracted annotations of the pecha first layer (cached)
+        """
+        layer_path = self.get_first_layer_path(pecha)
+
+        def extract() -> Dict:
+            if self.snapshot_store is None:
+                return self.extract_anns(self.get_layer(pecha))
+            with self.stage("extract_anns"):
+                anns = self.get_layer_snapshot(pecha).get_anns()
+            self.count("annotations", len(anns))
+            return anns
+
+        return self.cache.get_or_compute("anns", [layer_path], extract)
+
+    def get_layer_spans(self, pecha: Pecha, unique: bool = True) -> SpanArray:
+        """
+        Get the span array of the pecha first layer (cached)
+        """
+        layer_path = self.get_first_layer_path(pecha)
+
+        def extract() -> SpanArray:
+            if self.snapshot_store is None:
+                return self.extract_spans(
+                    self.get_layer(pecha),
+                    unique,
+                    base=self.get_first_base_path(pecha),
+                )
+            with self.stage("extract_spans"):
+                spans = self.get_layer_snapshot(pecha).get_spans(unique)
+            self.count("annotations", len(spans))
+            return spans
+
+        return self.cache.get_or_compute(
+            "spans" if unique else "all_spans", [layer_path], extract
+        )
+
+    def get_base_spans(self, pecha: Pecha) -> SpanArray:
+        """
+        Get the span array of all the annotations of the pecha first layer,
+        slicing their text from the pecha base (held by the pecha, not cached)
+        """
+        spans = self.get_layer_spans(pecha, unique=False)
+        base = pecha.bases[self.get_first_base_name(pecha)]
+        return SpanArray(spans.starts, spans.ends, spans.root_idx, base)
+
+    def get_lazy_layer_anns(self, pecha: Pecha) -> LayerAnns:
+        """
+        Get the annotations of the pecha first layer as get_layer_anns, their
+        text being sliced from the base when looked up: only their spans are
+        cached, for outputs streamed segment by segment
+        """
+        if self.snapshot_store is None:
+            return LayerAnns(self.get_base_spans(pecha))
+        return LayerAnns(
+            self.get_layer_spans(pecha, unique=False),
+            self.get_layer_snapshot(pecha).get_text,
+        )
+
+    def invalidate_cache(self, pecha: Optional[Pecha] = None):
+        """
+        Drop the cached layers and mappings computed from pecha, or
+        everything cached if no pecha is given.
+        """
+        if pecha is None:
+            self.cache.invalidate()
+            self.layer_paths.clear()
+        else:
+            self.cache.invalidate(pecha.pecha_path)
+            for layer_dir in list(self.layer_paths):
+                if pecha.pecha_path in layer_dir.parents:
+                    del self.layer_paths[layer_dir]
+
+    def get_base_update_key(self) -> str:
+        """
+        Identify how the layers are moved to another base: the backends give
+        slightly different offsets, so their mappings are stored apart
+        """
+        from alignment_ann_transfer.projection import DiffProjection
+
+        if self.window_size is not None:
+            projection = self.projection or DiffProjection()
+            return f"windowed({self.window_size}, {projection!r})"
+        if self.projection is not None:
+            return repr(self.projection)
+        return "base_update"
+
+    def get_cached_mapping(
+        self, name: str, paths: List[Path], compute: Callable[[], Dict[int, List]]
+    ) -> Dict[int, List]:
+        """
+        Get a pechas mapping from the memory cache, then from the mapping store
+        (keyed by the base update backend too), computing it only if it is in
+        neither.
+        """
+        if self.mapping_store is not None:
+            compute = partial(
+                self.mapping_store.get_or_compute,
+                f"{name}:{self.get_base_update_key()}",
+                paths,
+                compute,
+            )
+        return self.cache.get_or_compute(name, paths, compute)
 
     def get_root_pechas_mapping(
         self, root_pecha: Pecha, root_display_pecha: Pecha
@@ -15,48 +301,436 @@ class AlignmentTransfer:
         """
         Get segmentation mapping from root_pecha -> root_display_pecha
         """
-        display_layer_path = self.get_first_layer_path(root_display_pecha)
-        new_tgt_layer = self.base_update(root_pecha, root_display_pecha)
+        return self.get_cached_mapping(
+            "root_pechas_mapping",
+            self.get_pecha_files(root_pecha) + self.get_pecha_files(root_display_pecha),
+            lambda: self.compute_pechas_mapping(root_pecha, root_display_pecha),
+        )
+
+    def get_inverse_root_pechas_mapping(
+        self, root_pecha: Pecha, root_display_pecha: Pecha
+    ) -> Dict[int, List]:
+        """
+        Get segmentation mapping from root_display_pecha -> root_pecha, derived
+        from the root_pecha -> root_display_pecha mapping instead of base
+        updating the root display layer.
+        """
+        return self.get_cached_mapping(
+            "inverse_root_pechas_mapping",
+            self.get_pecha_files(root_pecha) + self.get_pecha_files(root_display_pecha),
+            lambda: self.invert_mapping(
+                self.get_root_pechas_mapping(root_pecha, root_display_pecha),
+                self.get_layer_spans(root_pecha),
+                self.get_layer_spans(root_display_pecha),
+            ),
+        )
+
+    def invert_mapping(
+        self, mapping: Dict[int, List], src_spans: SpanArray, tgt_spans: SpanArray
+    ) -> Dict[int, List]:
+        """
+        Invert a src -> tgt mapping into tgt -> src, in the format of
+        map_span_arrays: every tgt annotation is mapped to the src annotations
+        (in layer order) with their spans.
+        """
+        src_idxs = src_spans.root_idx.tolist()
+        src_starts = src_spans.starts.tolist()
+        src_ends = src_spans.ends.tolist()
+        src_positions = {idx: pos for pos, idx in enumerate(src_idxs)}
+
+        inverse: Dict[int, List] = {
+            idx: [] for idx in sorted(tgt_spans.root_idx.tolist())
+        }
+        for src_idx in sorted(mapping, key=src_positions.__getitem__):
+            pos = src_positions[src_idx]
+            for tgt_idx, _ in mapping[src_idx]:
+                inverse.setdefault(tgt_idx, []).append(
+                    [src_idx, [src_starts[pos], src_ends[pos]]]
+                )
+        return inverse
+
+    def compose_mappings(
+        self, src_mapping: Dict[int, List], tgt_mapping: Dict[int, List]
+    ) -> Dict[int, int]:
+        """
+        Compose src -> mid and mid -> tgt mappings into src idx -> tgt idx,
+        taking the first idx of every relation (Sefaria map limitation)
+        """
+        return {
+            src_idx: tgt_mapping[mid_map[0][0]][0][0]
+            for src_idx, mid_map in src_mapping.items()
+        }
+
+    def compute_pechas_mapping(
+        self, src_pecha: Pecha, tgt_pecha: Pecha
+    ) -> Dict[int, List]:
+        """
+        1. Transfer the src pecha layer to tgt pecha base
+        2. Map the transferred layer -> tgt pecha layer
+        """
+        with self.stage("pechas_mapping"):
+            display_spans = self.get_layer_spans(tgt_pecha)
+            transfer_spans = self.get_transfer_spans(src_pecha, tgt_pecha)
+            if self.window_size is not None:
+                return self.map_windowed_span_arrays(
+                    transfer_spans,
+                    display_spans,
+                    self.get_windows(src_pecha, tgt_pecha),
+                )
+            return self.map_span_arrays(transfer_spans, display_spans)
 
-        display_layer = AnnotationStore(file=str(display_layer_path))
-        transfer_layer = AnnotationStore(file=str(new_tgt_layer))
+    def get_transfer_spans(
+        self, src_pecha: Pecha, tgt_pecha: Pecha, unique: bool = True
+    ) -> SpanArray:
+        """
+        Get the span array of the src pecha layer transferred to the tgt pecha
+        base (cached). It does not depend on the tgt pecha layer, so it is
+        reused as long as only the tgt segmentation changes.
+        """
+        return self.cache.get_or_compute(
+            "transfer_spans" if unique else "all_transfer_spans",
+            self.get_pecha_files(src_pecha) + [self.get_first_base_path(tgt_pecha)],
+            lambda: self.compute_transfer_spans(src_pecha, tgt_pecha, unique),
+        )
 
-        map = self.map_layer_to_layer(transfer_layer, display_layer)
+    def get_transfer_span_index(self, src_pecha: Pecha, tgt_pecha: Pecha) -> SpanIndex:
+        """
+        Get the span index of get_transfer_spans (cached along with it), to
+        look up the transferred spans overlapping a few tgt spans
+        """
+        return self.cache.get_or_compute(
+            "transfer_span_index",
+            self.get_pecha_files(src_pecha) + [self.get_first_base_path(tgt_pecha)],
+            lambda: SpanIndex(self.get_transfer_spans(src_pecha, tgt_pecha)),
+        )
+
+    def compute_transfer_spans(
+        self, src_pecha: Pecha, tgt_pecha: Pecha, unique: bool = True
+    ) -> SpanArray:
+        """
+        Transfer the src pecha layer to tgt pecha base, in memory (or with the
+        projection backend), window by window or by merging it into the tgt pecha
+        """
+        if self.window_size is not None:
+            return self.compute_windowed_transfer_spans(src_pecha, tgt_pecha, unique)
+        if self.in_memory or self.projection is not None:
+            transfer_anns = self.base_update_anns(src_pecha, tgt_pecha)
+            if unique:
+                return SpanArray.from_anns(self.index_anns(transfer_anns).values())
+            return SpanArray.from_anns(transfer_anns)
+
+        new_tgt_layer = self.base_update(src_pecha, tgt_pecha)
+        transfer_spans = self.extract_spans(self.load_layer(new_tgt_layer), unique)
 
         # Clean up the layer
         new_tgt_layer.unlink()
-        return map
+        return transfer_spans
+
+    def get_windows(self, src_pecha: Pecha, tgt_pecha: Pecha) -> List[Window]:
+        """
+        Get the windows the src and tgt pecha bases are cut into (cached), see
+        windowed.py
+        """
+        from alignment_ann_transfer.windowed import get_windows
+
+        assert self.window_size is not None
+        window_size = self.window_size
+
+        def compute_windows() -> List[Window]:
+            with self.stage("windows"):
+                return get_windows(
+                    src_pecha.bases[self.get_first_base_name(src_pecha)],
+                    tgt_pecha.bases[self.get_first_base_name(tgt_pecha)],
+                    window_size,
+                )
+
+        return self.cache.get_or_compute(
+            "windows",
+            [self.get_first_base_path(src_pecha), self.get_first_base_path(tgt_pecha)],
+            compute_windows,
+        )
+
+    def compute_windowed_transfer_spans(
+        self, src_pecha: Pecha, tgt_pecha: Pecha, unique: bool = True
+    ) -> SpanArray:
+        """
+        Transfer the src pecha layer spans to tgt pecha base window by window
+        (see windowed.py), without extracting its annotations
+        """
+        import numpy as np
+
+        from alignment_ann_transfer.projection import DiffProjection
+        from alignment_ann_transfer.windowed import project_windows
+
+        src_spans = self.get_layer_spans(src_pecha, unique)
+        src_base = src_pecha.bases[self.get_first_base_name(src_pecha)]
+        tgt_base = tgt_pecha.bases[self.get_first_base_name(tgt_pecha)]
+        windows = self.get_windows(src_pecha, tgt_pecha)
+
+        with self.stage("base_update_anns"):
+            projected = project_windows(
+                self.projection or DiffProjection(),
+                src_base,
+                tgt_base,
+                windows,
+                np.concatenate((src_spans.starts, src_spans.ends)),
+                self.window_processes,
+            )
+        self.count("windows", len(windows))
+        self.count("annotations", len(src_spans))
+        count = len(src_spans)
+        return SpanArray(projected[:count], projected[count:], src_spans.root_idx)
+
+    def update_root_pechas_mapping(
+        self,
+        root_pecha: Pecha,
+        root_display_pecha: Pecha,
+        mapping: Dict[int, List],
+        changes: Dict[int, Tuple[Optional[Span], Optional[Span]]],
+    ) -> Dict[int, List]:
+        """
+        Get the entries of the root_pecha -> root_display_pecha mapping changed
+        by an edit of the root display segmentation (see update_mapping),
+        without base updating the root layer again when its transferred spans
+        are cached: the updated mapping is mapping.update(changed entries).
+        Nothing is cached nor written to the mapping store: the entries are
+        only right if changes match the edit, which may not be saved yet.
+        """
+        return self.update_mapping(
+            mapping,
+            self.get_transfer_span_index(root_pecha, root_display_pecha),
+            changes,
+        )
+
+    def update_mapping(
+        self,
+        mapping: Dict[int, List],
+        transfer_index: SpanIndex,
+        changes: Dict[int, Tuple[Optional[Span], Optional[Span]]],
+    ) -> Dict[int, List]:
+        """
+        Get the entries of a src -> tgt mapping changed after some tgt
+        annotations were added, removed or resized: changes maps their tgt idx
+        to their (old span, new span), old span being None for added and new
+        span None for removed annotations.
+        Only the src annotations whose transferred span (looked up in
+        transfer_index) overlaps an old or new span are remapped, the others
+        keep their tgt annotations and are not returned.
+        """
+        transfer_spans = transfer_index.spans
+
+        # Affected src position -> changed tgt idx it overlaps
+        affected: Dict[int, Dict[int, None]] = {}
+        new_spans: Dict[int, Span] = {}
+        for tgt_idx, (old_span, new_span) in changes.items():
+            for span in (old_span, new_span):
+                if span is not None:
+                    for pos in transfer_index.get_overlaps(*span):
+                        affected.setdefault(pos, {})[tgt_idx] = None
+            if new_span is not None:
+                new_spans[tgt_idx] = new_span
+        self.count("candidate_pairs", sum(len(idxs) for idxs in affected.values()))
+
+        changed: Dict[int, List] = {}
+        for pos in sorted(affected):
+            src_idx = int(transfer_spans.root_idx[pos])
+            tgt_map = [m for m in mapping.get(src_idx, []) if m[0] not in changes]
+            src_start, src_end = transfer_spans.starts[pos], transfer_spans.ends[pos]
+            for tgt_idx in affected[pos]:
+                span = new_spans.get(tgt_idx)
+                # The src may only overlap the old span of the tgt
+                if span is not None and span[0] < src_end and span[1] > src_start:
+                    tgt_map.append([tgt_idx, [span[0], span[1]]])
+            # Keep the tgt annotations in layer (span) order
+            tgt_map.sort(key=lambda m: m[1])
+            changed[src_idx] = tgt_map
+        return changed
 
     def base_update(self, src_pecha: Pecha, tgt_pecha: Pecha) -> Path:
         """
         1. Take the layer from src pecha
         2. Migrate the layer to tgt pecha using base update
         """
-        src_base_name = list(src_pecha.bases.keys())[0]
-        tgt_base_name = list(tgt_pecha.bases.keys())[0]
-        tgt_pecha.merge_pecha(src_pecha, src_base_name, tgt_base_name)
+        src_base_name = self.get_first_base_name(src_pecha)
+        tgt_base_name = self.get_first_base_name(tgt_pecha)
+        with self.stage("base_update"):
+            tgt_pecha.merge_pecha(src_pecha, src_base_name, tgt_base_name)
 
-        src_layer_name = next(src_pecha.layer_path.rglob("*.json")).name
+        src_layer_name = self.get_first_layer_path(src_pecha).name
         new_layer_path = tgt_pecha.layer_path / tgt_base_name / src_layer_name
         return new_layer_path
 
-    def extract_anns(self, layer: AnnotationStore) -> Dict:
+    def base_update_anns(
+        self, src_pecha: Pecha, tgt_pecha: Pecha, with_text: bool = False
+    ) -> List[Dict]:
+        """
+        1. Take the layer from src pecha
+        2. Project its annotations to tgt pecha base using base update, or the
+        projection backend if any
+        Nothing is written to tgt pecha, the annotations are returned in the
+        layer order as they would be extracted from the migrated layer
+        (span only unless with_text).
+        """
+        tgt_base = tgt_pecha.bases[self.get_first_base_name(tgt_pecha)]
+        updated_spans = self.get_updated_spans(src_pecha, tgt_pecha)
+
+        anns = []
+        with self.stage("base_update_anns"):
+            for start, end, root_idx_mapping in updated_spans:
+                curr_ann: Dict = {
+                    "Span": {"start": start, "end": end},
+                    "root_idx_mapping": root_idx_mapping,
+                }
+                if with_text:
+                    curr_ann["text"] = tgt_base[start:end]
+                anns.append(curr_ann)
+        self.count("annotations", len(anns))
+        return anns
+
+    def get_updated_spans(
+        self, src_pecha: Pecha, tgt_pecha: Pecha
+    ) -> Iterator[Tuple[int, int, str]]:
+        """
+        Get the (start, end, root_idx_mapping) of the src pecha layer
+        annotations projected to the tgt pecha base, in layer order. The layer
+        is read from its snapshot with both a projection backend and a
+        snapshot store.
+        """
+        offset_table = None
+        if self.projection is not None:
+            offset_table = self.get_offset_table(src_pecha, tgt_pecha)
+        if offset_table is not None and self.snapshot_store is not None:
+            snapshot = self.get_layer_snapshot(src_pecha)
+            return zip(
+                offset_table.project(snapshot.starts).tolist(),
+                offset_table.project(snapshot.ends).tolist(),
+                map(snapshot.get_root_idx_mapping, range(len(snapshot))),
+            )
+
+        src_layer = self.get_layer(src_pecha)
+        if offset_table is not None:
+            updated_anns = self.project_layer_anns(offset_table, src_layer)
+        else:
+            from openpecha.pecha.blupdate import get_updated_layer_anns
+
+            updated_anns = get_updated_layer_anns(
+                src_pecha.bases[self.get_first_base_name(src_pecha)],
+                tgt_pecha.bases[self.get_first_base_name(tgt_pecha)],
+                src_layer,
+            )
+        return (
+            (*ann["span"], self.get_ann_metadata(ann["ann_data"])["root_idx_mapping"])
+            for ann in updated_anns
+        )
+
+    def get_ann_metadata(self, ann) -> Dict[str, str]:
+        return {data.key().id(): str(data.value()) for data in ann}
+
+    def get_offset_table(self, src_pecha: Pecha, tgt_pecha: Pecha) -> OffsetTable:
+        """
+        Get the src pecha base -> tgt pecha base offset table of the projection
+        backend (cached)
+        """
+        assert self.projection is not None
+        projection = self.projection
+        src_base_name = self.get_first_base_name(src_pecha)
+        tgt_base_name = self.get_first_base_name(tgt_pecha)
+
+        def compute_offset_table() -> OffsetTable:
+            with self.stage("offset_table"):
+                return projection.get_offset_table(
+                    src_pecha.bases[src_base_name], tgt_pecha.bases[tgt_base_name]
+                )
+
+        return self.cache.get_or_compute(
+            "offset_table",
+            [self.get_first_base_path(src_pecha), self.get_first_base_path(tgt_pecha)],
+            compute_offset_table,
+        )
+
+    def project_layer_anns(
+        self, offset_table: OffsetTable, layer: AnnotationStore
+    ) -> List[Dict]:
+        """
+        Project the annotations of a layer through an offset table, in the
+        format of the openpecha get_updated_layer_anns
+        """
+        layer_anns = list(layer.annotations())
+        offsets = []
+        for ann in layer_anns:
+            offsets += [ann.offset().begin().value(), ann.offset().end().value()]
+        projected = offset_table.project(offsets).tolist()
+        return [
+            {"span": (projected[2 * pos], projected[2 * pos + 1]), "ann_data": ann}
+            for pos, ann in enumerate(layer_anns)
+        ]
+
+    def index_anns(self, anns: List[Dict]) -> Dict:
+        """
+        Index annotations by their root idx mapping, same as extract_anns
+        """
+        indexed_anns = {}
+        for ann in anns:
+            root_idx = int(ann["root_idx_mapping"])
+            indexed_anns[root_idx] = {**ann, "root_idx_mapping": root_idx}
+        return indexed_anns
+
+    def extract_anns(self, layer: AnnotationStore, with_text: bool = True) -> Dict:
         """
         Extract annotation from layer(STAM)
+        with_text: Set to False to only extract spans and root idx mapping
         """
         anns = {}
-        for ann in layer.annotations():
-            start, end = ann.offset().begin().value(), ann.offset().end().value()
-            ann_metadata = {}
-            for data in ann:
-                ann_metadata[data.key().id()] = str(data.value())
-            anns[int(ann_metadata["root_idx_mapping"])] = {
-                "Span": {"start": start, "end": end},
-                "text": str(ann),
-                "root_idx_mapping": int(ann_metadata["root_idx_mapping"]),
-            }
+        with self.stage("extract_anns"):
+            for ann, root_idx_mapping in iter_root_idx_anns(layer):
+                offset = ann.offset()
+                start, end = offset.begin().value(), offset.end().value()
+                curr_ann: Dict = {"Span": {"start": start, "end": end}}
+                if with_text:
+                    curr_ann["text"] = str(ann)
+                curr_ann["root_idx_mapping"] = int(root_idx_mapping)
+                anns[curr_ann["root_idx_mapping"]] = curr_ann
+        self.count("annotations", len(anns))
         return anns
 
+    def extract_spans(
+        self,
+        layer: AnnotationStore,
+        unique: bool = True,
+        base: Optional[Union[str, Path]] = None,
+    ) -> SpanArray:
+        """
+        Extract the spans and root idx of the annotations from layer(STAM).
+        If unique, annotations are indexed by their root idx as in extract_anns,
+        otherwise all are kept with their first root idx as in
+        extract_commentary_anns.
+        No text is read from the layer, the span array slices it from base
+        (text or base file path) when asked for.
+        """
+        positions: Dict[int, int] = {}
+        starts: List[int] = []
+        ends: List[int] = []
+        root_idx: List[int] = []
+        with self.stage("extract_spans"):
+            for ann, root_idx_mapping in iter_root_idx_anns(layer):
+                offset = ann.offset()
+                start, end = offset.begin().value(), offset.end().value()
+                if unique:
+                    idx = int(root_idx_mapping)
+                else:
+                    idx = parse_root_indices(root_idx_mapping).first
+
+                if unique and idx in positions:
+                    starts[positions[idx]], ends[positions[idx]] = start, end
+                    continue
+                positions[idx] = len(starts)
+                starts.append(start)
+                ends.append(end)
+                root_idx.append(idx)
+
+        self.count("annotations", len(starts))
+        return SpanArray(starts, ends, root_idx, base)
+
     def map_layer_to_layer(
         self, src_layer: AnnotationStore, tgt_layer: AnnotationStore
     ):
@@ -65,33 +739,144 @@ class AlignmentTransfer:
         2. Map the annotations from source to target layer
         src_layer -> tgt_layer (One to Many)
         """
+        src_spans = self.extract_spans(src_layer)
+        tgt_spans = self.extract_spans(tgt_layer)
+        return self.map_span_arrays(src_spans, tgt_spans)
+
+    def map_anns_to_anns(self, src_anns: Dict, tgt_anns: Dict):
+        """
+        Map the extracted annotations from source to target layer
+        src_anns -> tgt_anns (One to Many)
+        """
+        return self.map_span_arrays(
+            SpanArray.from_anns(src_anns.values()),
+            SpanArray.from_anns(tgt_anns.values()),
+        )
+
+    def map_span_arrays(self, src_spans: SpanArray, tgt_spans: SpanArray):
+        """
+        Map the annotations from source to target span array
+        src_spans -> tgt_spans (One to Many)
+        """
+        import numpy as np
+
+        with self.stage("map_spans"):
+            if self.window_size is None:
+                src_pos, tgt_pos = get_span_overlaps(
+                    src_spans.starts,
+                    src_spans.ends,
+                    tgt_spans.starts,
+                    tgt_spans.ends,
+                    stats=self.stats,
+                )
+            else:
+                src_pos, tgt_pos = get_windowed_span_overlaps(
+                    src_spans.starts,
+                    src_spans.ends,
+                    tgt_spans.starts,
+                    tgt_spans.ends,
+                    self.window_size,
+                    stats=self.stats,
+                )
+        self.count("matched_pairs", len(src_pos))
+        mapping = self.get_span_mapping(src_spans, tgt_spans, src_pos, tgt_pos)
+
+        # Sort the mapping by source indices
+        return dict(sorted(mapping.items()))
+
+    def get_span_mapping(
+        self,
+        src_spans: SpanArray,
+        tgt_spans: SpanArray,
+        src_pos: np.ndarray,
+        tgt_pos: np.ndarray,
+    ) -> Dict[int, List]:
+        """
+        Map every src span to the tgt spans of its overlaps: (src position, tgt
+        position) pairs sorted by src position. A src idx held by several spans
+        gets the tgt spans of the last one.
+        """
+        import numpy as np
+
+        # Overlaps of the source at position i are in tgt_pos[bounds[i]:bounds[i + 1]]
+        bounds = np.searchsorted(src_pos, np.arange(len(src_spans) + 1)).tolist()
+
+        tgt_idxs = tgt_spans.root_idx.tolist()
+        tgt_starts = tgt_spans.starts.tolist()
+        tgt_ends = tgt_spans.ends.tolist()
+        tgt_positions = tgt_pos.tolist()
+
         mapping: Dict = {}
+        for pos, src_idx in enumerate(src_spans.root_idx.tolist()):
+            first, last = bounds[pos], bounds[pos + 1]
+            mapping[src_idx] = [
+                [tgt_idxs[tgt], [tgt_starts[tgt], tgt_ends[tgt]]]
+                for tgt in tgt_positions[first:last]
+            ]
+        return mapping
+
+    def map_windowed_span_arrays(
+        self, src_spans: SpanArray, tgt_spans: SpanArray, windows: List[Window]
+    ) -> Dict[int, List]:
+        """
+        Map the src spans, transferred to the tgt base, to the tgt spans window
+        by window: the src spans starting in the tgt side of a window are only
+        checked against the tgt spans starting in the range they cover, and
+        the ones crossing its start (checked in the previous windows too). So
+        the spans, overlaps and mappings handled at once are the ones of a
+        window.
+        src_spans -> tgt_spans (One to Many), as map_span_arrays
+        """
+        import numpy as np
+
+        with self.stage("map_spans"):
+            tgt_index = SpanIndex(tgt_spans)
+            src_order = np.argsort(src_spans.starts, kind="stable")
+            window_bounds = np.searchsorted(
+                src_spans.starts[src_order], [window[2] for window in windows[1:]]
+            )
+
+            mapping: Dict[int, List] = {}
+            # Src idx -> position of the src span it was mapped with
+            mapped_positions: Dict[int, int] = {}
+            for positions in np.split(src_order, window_bounds):
+                if not len(positions):
+                    continue
+                positions = np.sort(positions)
+                window_spans = SpanArray(
+                    src_spans.starts[positions],
+                    src_spans.ends[positions],
+                    src_spans.root_idx[positions],
+                )
+                start = int(window_spans.starts.min())
+                end = int(window_spans.ends.max())
+                first, last = np.searchsorted(tgt_index.sorted_starts, [start, end])
+                candidates = np.union1d(
+                    tgt_index.order[first:last], tgt_index.get_overlaps(start, start)
+                ).astype(np.int64)
+                candidate_spans = SpanArray(
+                    tgt_spans.starts[candidates],
+                    tgt_spans.ends[candidates],
+                    tgt_spans.root_idx[candidates],
+                )
 
-        src_anns = self.extract_anns(src_layer)
-        tgt_anns = self.extract_anns(tgt_layer)
-
-        for src_idx, src_span in src_anns.items():
-            src_start, src_end = src_span["Span"]["start"], src_span["Span"]["end"]
-            mapping[src_idx] = []
-
-            for tgt_idx, tgt_span in tgt_anns.items():
-                tgt_start, tgt_end = tgt_span["Span"]["start"], tgt_span["Span"]["end"]
-
-                # Check for mapping conditions
-                if (
-                    src_start
-                    <= tgt_start
-                    < src_end  # Target annotation starts within source
-                    or src_start
-                    < tgt_end
-                    <= src_end  # Target annotation ends within source
-                    or (
-                        tgt_start < src_start and tgt_end > src_end
-                    )  # Target fully contains source
-                ) and not (
-                    tgt_start == src_end or tgt_end == src_start
-                ):  # No exact edge overlap
-                    mapping[src_idx].append([tgt_idx, [tgt_start, tgt_end]])
+                src_pos, tgt_pos = get_span_overlaps(
+                    window_spans.starts,
+                    window_spans.ends,
+                    candidate_spans.starts,
+                    candidate_spans.ends,
+                    stats=self.stats,
+                )
+                self.count("matched_pairs", len(src_pos))
+                window_mapping = self.get_span_mapping(
+                    window_spans, candidate_spans, src_pos, tgt_pos
+                )
+                for src_idx, pos in zip(
+                    window_spans.root_idx.tolist(), positions.tolist()
+                ):
+                    if pos > mapped_positions.get(src_idx, -1):
+                        mapped_positions[src_idx] = pos
+                        mapping[src_idx] = window_mapping[src_idx]
 
         # Sort the mapping by source indices
         return dict(sorted(mapping.items()))
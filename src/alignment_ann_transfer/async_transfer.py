@@ -0,0 +1,302 @@
+from __future__ import annotations
+
+import asyncio
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+    Type,
+    Union,
+)
+
+from alignment_ann_transfer import AlignmentTransfer
+from alignment_ann_transfer.commentary import CommentaryAlignmentTransfer
+from alignment_ann_transfer.mapping_store import MappingStore
+from alignment_ann_transfer.translation import TranslationAlignmentTransfer
+
+if TYPE_CHECKING:
+    from openpecha.pecha import Pecha
+
+    from alignment_ann_transfer.chapters import PechaChapter
+
+# (pecha path, base name, chapter) of a pecha sent to a worker process, the
+# base name and chapter being None for a whole pecha (see PechaChapter)
+PechaRef = Tuple[str, Optional[str], Optional[int]]
+
+# Transfers of a worker process by (class, in_memory, cache_dir), kept between
+# tasks so their caches are reused
+worker_transfers: Dict[Tuple, AlignmentTransfer] = {}
+
+
+def get_worker_transfer(
+    transfer_class: Type[AlignmentTransfer], in_memory: bool, cache_dir: Optional[str]
+) -> AlignmentTransfer:
+    key = (transfer_class, in_memory, cache_dir)
+    transfer = worker_transfers.get(key)
+    if transfer is None:
+        mapping_store = MappingStore(Path(cache_dir)) if cache_dir else None
+        transfer = transfer_class(in_memory=in_memory, mapping_store=mapping_store)
+        worker_transfers[key] = transfer
+    return transfer
+
+
+def get_pecha_ref(pecha: Pecha) -> PechaRef:
+    return (
+        str(pecha.pecha_path),
+        getattr(pecha, "base_name", None),
+        getattr(pecha, "chapter", None),
+    )
+
+
+def load_pecha_ref(pecha_ref: PechaRef) -> Union[Pecha, PechaChapter]:
+    """
+    Load a pecha, or the chapter of a pecha, from its ref
+    """
+    from openpecha.pecha import Pecha
+
+    from alignment_ann_transfer.chapters import PechaChapter
+
+    pecha_path, base_name, chapter = pecha_ref
+    if base_name is None:
+        return Pecha.from_path(Path(pecha_path))
+    # Only the chapter base is read
+    return PechaChapter.from_path(Path(pecha_path), base_name, chapter or 1)
+
+
+def compute_mapping(
+    transfer_class: Type[AlignmentTransfer],
+    method: str,
+    pecha_refs: List[PechaRef],
+    in_memory: bool,
+    cache_dir: Optional[str],
+) -> Dict[int, List]:
+    """
+    Compute a pechas mapping in a worker process
+    """
+    transfer = get_worker_transfer(transfer_class, in_memory, cache_dir)
+    pechas = [load_pecha_ref(pecha_ref) for pecha_ref in pecha_refs]
+    return getattr(transfer, method)(*pechas)
+
+
+class AsyncAlignmentTransfer:
+    """
+    Asyncio counterpart of an alignment transfer, which never blocks the event
+    loop: the pechas mappings (base update and mapping) are computed in a
+    process pool, and the layers are read and the outputs built in a bounded
+    thread pool.
+    Concurrent requests for the same mapping wait for the same computation.
+
+    in_memory: Base update in memory (default), so concurrent computations
+    never write into the same pecha.
+    cache_dir: Directory of a MappingStore shared by the worker processes.
+    """
+
+    transfer_class: Type[AlignmentTransfer] = AlignmentTransfer
+
+    def __init__(
+        self,
+        max_threads: Optional[int] = None,
+        max_processes: Optional[int] = None,
+        in_memory: bool = True,
+        cache_dir: Optional[Path] = None,
+    ):
+        self.in_memory = in_memory
+        self.cache_dir = str(cache_dir) if cache_dir else None
+        self.transfer = self.transfer_class(in_memory=in_memory)
+        self.thread_pool = ThreadPoolExecutor(max_workers=max_threads)
+        self.process_pool = ProcessPoolExecutor(max_workers=max_processes)
+        self.in_flight: Dict[Tuple, asyncio.Future] = {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.thread_pool.shutdown(wait=False)
+        self.process_pool.shutdown(wait=False)
+
+    async def run_in_thread(self, func: Callable, *args) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.thread_pool, partial(func, *args))
+
+    async def run_in_process(self, method: str, pecha_refs: List[PechaRef]) -> Dict:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.process_pool,
+            compute_mapping,
+            self.transfer_class,
+            method,
+            pecha_refs,
+            self.in_memory,
+            self.cache_dir,
+        )
+
+    async def get_mapping(self, method: str, *pechas: Pecha) -> Dict[int, List]:
+        """
+        Get the pechas mapping of a transfer method computed in the process
+        pool, joining the in flight computation of the same mapping if any
+        """
+        pecha_refs = [get_pecha_ref(pecha) for pecha in pechas]
+        key = (method, *pecha_refs)
+        future = self.in_flight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self.run_in_process(method, pecha_refs))
+            self.in_flight[key] = future
+            future.add_done_callback(lambda _: self.in_flight.pop(key, None))
+        return await asyncio.shield(future)
+
+    async def get_root_pechas_mapping(
+        self, root_pecha: Pecha, root_display_pecha: Pecha
+    ) -> Dict[int, List]:
+        return await self.get_mapping(
+            "get_root_pechas_mapping", root_pecha, root_display_pecha
+        )
+
+    async def get_inverse_root_pechas_mapping(
+        self, root_pecha: Pecha, root_display_pecha: Pecha
+    ) -> Dict[int, List]:
+        return await self.get_mapping(
+            "get_inverse_root_pechas_mapping", root_pecha, root_display_pecha
+        )
+
+
+class AsyncTranslationAlignmentTransfer(AsyncAlignmentTransfer):
+    transfer: TranslationAlignmentTransfer
+    transfer_class = TranslationAlignmentTransfer
+
+    async def get_translation_pechas_mapping(
+        self, translation_pecha: Pecha, translation_display_pecha: Pecha
+    ) -> Dict[int, List]:
+        return await self.get_mapping(
+            "get_translation_pechas_mapping",
+            translation_pecha,
+            translation_display_pecha,
+        )
+
+    async def get_serialized_translation(
+        self, root_pecha: Pecha, root_display_pecha: Pecha, translation_pecha: Pecha
+    ) -> List[str]:
+        root_map = await self.get_root_pechas_mapping(root_pecha, root_display_pecha)
+        return await self.run_in_thread(
+            lambda: list(
+                self.transfer.serialize_translation(
+                    root_map, self.transfer.get_layer_anns(translation_pecha)
+                )
+            )
+        )
+
+    async def get_serialized_translation_display(
+        self,
+        root_pecha: Pecha,
+        root_display_pecha: Pecha,
+        translation_pecha: Pecha,
+        translation_display_pecha: Pecha,
+    ) -> List[str]:
+        root_map, translation_map = await asyncio.gather(
+            self.get_root_pechas_mapping(root_pecha, root_display_pecha),
+            self.get_translation_pechas_mapping(
+                translation_pecha, translation_display_pecha
+            ),
+        )
+        return await self.run_in_thread(
+            lambda: list(
+                self.transfer.serialize_translation_display(
+                    self.transfer.compose_mappings(translation_map, root_map),
+                    self.transfer.get_layer_anns(translation_display_pecha),
+                )
+            )
+        )
+
+    async def get_aligned_translation(
+        self, root_pecha: Pecha, root_display_pecha: Pecha, translation_pecha: Pecha
+    ) -> List[Dict]:
+        root_map = await self.get_inverse_root_pechas_mapping(
+            root_pecha, root_display_pecha
+        )
+        return await self.run_in_thread(
+            lambda: list(
+                self.transfer.align_translation(
+                    root_map,
+                    self.transfer.get_layer_anns(translation_pecha),
+                    self.transfer.get_layer_anns(root_display_pecha),
+                    self.transfer.get_layer_anns(root_pecha),
+                )
+            )
+        )
+
+
+class AsyncCommentaryAlignmentTransfer(AsyncAlignmentTransfer):
+    transfer: CommentaryAlignmentTransfer
+    transfer_class = CommentaryAlignmentTransfer
+
+    async def get_commentary_pechas_mapping(
+        self, commentary_pecha: Pecha, commentary_display_pecha: Pecha
+    ) -> Dict[int, List]:
+        return await self.get_mapping(
+            "get_commentary_pechas_mapping",
+            commentary_pecha,
+            commentary_display_pecha,
+        )
+
+    async def get_serialized_commentary(
+        self, root_pecha: Pecha, root_display_pecha: Pecha, commentary_pecha: Pecha
+    ) -> List[str]:
+        root_map = await self.get_root_pechas_mapping(root_pecha, root_display_pecha)
+        return await self.run_in_thread(
+            lambda: list(
+                self.transfer.serialize_commentary(
+                    root_map,
+                    self.transfer.get_commentary_layer_anns(commentary_pecha),
+                    self.transfer.get_layer_anns(root_display_pecha),
+                    self.transfer.get_layer_anns(root_pecha),
+                )
+            )
+        )
+
+    async def get_serialized_commentary_display(
+        self,
+        root_pecha: Pecha,
+        root_display_pecha: Pecha,
+        commentary_pecha: Pecha,
+        commentary_display_pecha: Pecha,
+    ) -> List[str]:
+        root_map, commentary_map = await asyncio.gather(
+            self.get_root_pechas_mapping(root_pecha, root_display_pecha),
+            self.get_commentary_pechas_mapping(
+                commentary_pecha, commentary_display_pecha
+            ),
+        )
+        return await self.run_in_thread(
+            lambda: list(
+                self.transfer.serialize_commentary_display(
+                    self.transfer.compose_mappings(commentary_map, root_map),
+                    self.transfer.get_layer_anns(commentary_display_pecha),
+                )
+            )
+        )
+
+    async def get_aligned_display_commentary(
+        self, root_pecha: Pecha, root_display_pecha: Pecha, commentary_pecha: Pecha
+    ) -> List[Dict]:
+        root_map = await self.get_inverse_root_pechas_mapping(
+            root_pecha, root_display_pecha
+        )
+        return await self.run_in_thread(
+            lambda: list(
+                self.transfer.align_commentary(
+                    root_map,
+                    self.transfer.get_commentary_layer_anns(commentary_pecha),
+                    self.transfer.get_layer_anns(root_display_pecha),
+                    self.transfer.get_layer_anns(root_pecha),
+                )
+            )
+        )
@@ -0,0 +1,477 @@
+"""
+Run the alignment transfer of many pecha sets in parallel.
+
+A manifest is a json list of pecha sets (jobs), paths being relative to the
+manifest file:
+
+    [
+        {
+            "id": "translation-1",
+            "type": "translation",
+            "root": "P2/I73078576",
+            "root_display": "P1/I15C4AA72",
+            "translation": "P3/I4FA57826",
+            "translation_display": "P4/I18FD6864"
+        },
+        {
+            "id": "commentary-1",
+            "type": "commentary",
+            "root": "...",
+            "root_display": "...",
+            "commentary": "...",
+            "commentary_display": "..."
+        }
+    ]
+
+Pechas with several bases are transferred chapter by chapter, the n-th base
+listed in the metadata.json of every pecha of a job forming chapter n.
+
+Every output that can be computed from the given pechas is written to
+<output_dir>/<job id>/<output name>.json as soon as its job finishes, and a
+status line per job, with the time spent in each transfer stage, is appended
+to <output_dir>/results.jsonl.
+
+In delta mode (--delta), only the segments changed since the previous run
+into the same output_dir are written, to <output name>.delta.json, with a
+<output_dir>/<job id>/manifest.json of every delta written (see delta.py).
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import signal
+import time
+import traceback
+from contextlib import contextmanager
+from itertools import chain
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Set, Type
+
+from alignment_ann_transfer.stats import TransferStats
+from alignment_ann_transfer.writer import write_json_array
+
+# The sessions, chapters, delta and mapping store modules are imported by the
+# jobs, so importing the batch module stays cheap for the runner
+if TYPE_CHECKING:
+    from multiprocessing.connection import Connection
+
+    from alignment_ann_transfer.session import PechaSetSession
+
+# job type -> session class name (see session.py)
+SESSIONS = {
+    "translation": "TranslationSession",
+    "commentary": "CommentarySession",
+}
+
+# Seconds a job may run past its timeout before the batch kills its process,
+# the job's own SIGALRM timeout failing it before that
+TIMEOUT_GRACE = 5.0
+
+# output name -> (session method, pechas it needs)
+JOB_OUTPUTS = {
+    "translation": {
+        "serialized_translation": (
+            "iter_serialized_translation",
+            ["root", "root_display", "translation"],
+        ),
+        "serialized_translation_display": (
+            "iter_serialized_translation_display",
+            ["root", "root_display", "translation", "translation_display"],
+        ),
+        "aligned_translation": (
+            "iter_aligned_translation",
+            ["root", "root_display", "translation"],
+        ),
+    },
+    "commentary": {
+        "serialized_commentary": (
+            "iter_serialized_commentary",
+            ["root", "root_display", "commentary"],
+        ),
+        "serialized_commentary_display": (
+            "iter_serialized_commentary_display",
+            ["root", "root_display", "commentary", "commentary_display"],
+        ),
+        "aligned_commentary": (
+            "iter_aligned_display_commentary",
+            ["root", "root_display", "commentary"],
+        ),
+    },
+}
+
+# Outputs of a row per root display segment, keyed by root display idx in
+# the deltas
+ROW_OUTPUTS = {"aligned_translation", "aligned_commentary"}
+
+
+def get_job_pecha_names(job: Dict) -> List[str]:
+    pecha_names = {
+        name: None
+        for _, output_pecha_names in JOB_OUTPUTS[job["type"]].values()
+        for name in output_pecha_names
+        if job.get(name)
+    }
+    return list(pecha_names)
+
+
+def get_job_pecha_paths(job: Dict) -> Set[str]:
+    return {job[name] for name in get_job_pecha_names(job)}
+
+
+def get_session_class(job_type: str) -> Type[PechaSetSession]:
+    from alignment_ann_transfer import session
+
+    return getattr(session, SESSIONS[job_type])
+
+
+def load_manifest(manifest_path: Path) -> List[Dict]:
+    """
+    Load the jobs of a manifest, with their pecha paths resolved
+    """
+    manifest_path = Path(manifest_path)
+    jobs = json.loads(manifest_path.read_text(encoding="utf-8"))
+
+    job_ids = set()
+    for job in jobs:
+        if job.get("type") not in SESSIONS:
+            raise ValueError(
+                f"Job {job.get('id')} has an unknown type {job.get('type')}"
+            )
+        if job.get("id") is None or job["id"] in job_ids:
+            raise ValueError(f"Job id {job.get('id')} is missing or not unique")
+        job_ids.add(job["id"])
+
+        for name in get_job_pecha_names(job):
+            job[name] = str((manifest_path.parent / job[name]).resolve())
+    return jobs
+
+
+@contextmanager
+def time_limit(timeout: Optional[float]):
+    """
+    Raise TimeoutError if the block runs longer than timeout seconds.
+    Only enforced where SIGALRM is available (the job runs in the main thread
+    of its worker process), and only once the job is back in python code: a
+    job stuck in native code is stopped by run_batch instead.
+    """
+    if not timeout or not hasattr(signal, "SIGALRM"):
+        yield
+        return
+
+    def on_timeout(signum, frame):
+        raise TimeoutError(f"Job exceeded its {timeout}s timeout")
+
+    previous_handler = signal.signal(signal.SIGALRM, on_timeout)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous_handler)
+
+
+def write_json(path: Path, items: Iterable):
+    """
+    Stream items into a json array file, only renamed to path once complete
+    """
+    tmp_path = path.with_suffix(".json.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        write_json_array(items, f, indent=2)
+    tmp_path.replace(path)
+
+
+def run_job(
+    job: Dict,
+    output_dir: str,
+    in_memory: bool = True,
+    timeout: Optional[float] = None,
+    cache_dir: Optional[str] = None,
+    delta: bool = False,
+) -> Dict:
+    """
+    Compute and write every output of a job (or its delta), capturing any
+    error
+    """
+    from openpecha.pecha import Pecha
+
+    from alignment_ann_transfer.chapters import get_chapter_sessions
+    from alignment_ann_transfer.delta import (
+        commit_fingerprints,
+        write_delta,
+        write_json_file,
+    )
+    from alignment_ann_transfer.mapping_store import MappingStore
+
+    start_time = time.monotonic()
+    outputs = []
+    stats = TransferStats()
+    try:
+        with time_limit(timeout):
+            mapping_store = MappingStore(Path(cache_dir)) if cache_dir else None
+            session_class = get_session_class(job["type"])
+            transfer = session_class.transfer_class(
+                in_memory=in_memory, mapping_store=mapping_store, stats=stats
+            )
+            pechas = {
+                name: Pecha.from_path(Path(job[name]))
+                for name in get_job_pecha_names(job)
+            }
+            sessions = get_chapter_sessions(
+                session_class,
+                {f"{name}_pecha": pecha for name, pecha in pechas.items()},
+                transfer,
+            )
+
+            job_dir = Path(output_dir) / str(job["id"])
+            job_dir.mkdir(parents=True, exist_ok=True)
+            manifest = {}
+            for output_name, (method, pecha_names) in JOB_OUTPUTS[job["type"]].items():
+                if not all(name in pechas for name in pecha_names):
+                    continue
+                output = chain.from_iterable(
+                    getattr(session, method)() for session in sessions
+                )
+                if delta:
+                    segment_ids = None
+                    if output_name in ROW_OUTPUTS:
+                        segment_ids = chain.from_iterable(
+                            session.iter_row_ids() for session in sessions
+                        )
+                    manifest[output_name] = write_delta(
+                        job_dir, output_name, output, segment_ids
+                    )
+                else:
+                    write_json(job_dir / f"{output_name}.json", output)
+                outputs.append(output_name)
+            if delta:
+                write_json_file(job_dir / "manifest.json", manifest)
+                commit_fingerprints(job_dir, manifest)
+    except Exception as e:
+        return {
+            "id": job["id"],
+            "status": "error",
+            "outputs": outputs,
+            "error": f"{type(e).__name__}: {e}",
+            "traceback": traceback.format_exc(),
+            "duration": time.monotonic() - start_time,
+            "stats": stats.as_dict(),
+        }
+
+    return {
+        "id": job["id"],
+        "status": "ok",
+        "outputs": outputs,
+        "duration": time.monotonic() - start_time,
+        "stats": stats.as_dict(),
+    }
+
+
+def run_job_in_process(connection: Connection, *args):
+    """
+    Run a job, sending its result back through connection
+    """
+    try:
+        connection.send(run_job(*args))
+    finally:
+        connection.close()
+
+
+class JobProcess:
+    """
+    A job running in a process of its own, so it can be killed if it runs past
+    its deadline (monotonic time) without affecting the other jobs
+    """
+
+    def __init__(self, job: Dict, args: tuple, deadline: Optional[float] = None):
+        import multiprocessing
+
+        self.job = job
+        self.deadline = deadline
+        self.connection, child_connection = multiprocessing.Pipe(duplex=False)
+        self.process = multiprocessing.Process(
+            target=run_job_in_process, args=(child_connection, job, *args)
+        )
+        self.process.start()
+        child_connection.close()
+
+    def get_result(self) -> Dict:
+        """
+        Get the result of a finished job, once its connection is readable
+        """
+        try:
+            result = self.connection.recv()
+        except EOFError:
+            # The process exited without a result (eg: killed)
+            self.process.join()
+            result = {
+                "id": self.job["id"],
+                "status": "error",
+                "error": f"Job process exited with code {self.process.exitcode}",
+            }
+        self.process.join()
+        self.connection.close()
+        return result
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.connection.close()
+
+
+def get_timeout_result(job: Dict, timeout: float) -> Dict:
+    return {
+        "id": job["id"],
+        "status": "error",
+        "error": f"TimeoutError: Job exceeded its {timeout}s timeout, process killed",
+    }
+
+
+def run_batch(
+    manifest_path: Path,
+    output_dir: Path,
+    workers: Optional[int] = None,
+    timeout: Optional[float] = None,
+    in_memory: bool = True,
+    cache_dir: Optional[Path] = None,
+    delta: bool = False,
+) -> List[Dict]:
+    """
+    Run every job of the manifest in a process of its own, at most workers at
+    a time, and return their results.
+    With a cache_dir, the pechas mappings are shared through a MappingStore.
+
+    With in_memory (default) the pechas are only read. Otherwise base update
+    writes temporary layers into the pechas, so two jobs sharing a pecha are
+    never run at the same time.
+
+    With delta, only the changes since the previous run into output_dir are
+    written.
+
+    A job still running TIMEOUT_GRACE seconds past its timeout (stuck where
+    its own timeout cannot stop it, eg: loading a layer) has its process
+    killed and fails with a TimeoutError.
+    """
+    from multiprocessing.connection import wait
+
+    jobs = load_manifest(manifest_path)
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+    args = (str(output_dir), in_memory, timeout, str(cache_dir) if cache_dir else None)
+
+    results: List[Dict] = []
+    pending = list(jobs)
+    running: List[JobProcess] = []
+    busy_pechas: Set[str] = set()
+
+    try:
+        with open(output_dir / "results.jsonl", "w", encoding="utf-8") as results_file:
+
+            def add_result(result: Dict):
+                results.append(result)
+                results_file.write(json.dumps(result, ensure_ascii=False) + "\n")
+                results_file.flush()
+
+            while pending or running:
+                # Start the jobs which do not share a pecha with a running job
+                waiting = []
+                for job in pending:
+                    job_pechas = get_job_pecha_paths(job)
+                    if len(running) >= workers or (
+                        not in_memory and job_pechas & busy_pechas
+                    ):
+                        waiting.append(job)
+                        continue
+
+                    deadline = None
+                    if timeout:
+                        deadline = time.monotonic() + timeout + TIMEOUT_GRACE
+                    try:
+                        running.append(JobProcess(job, (*args, delta), deadline))
+                    except Exception as e:
+                        add_result(
+                            {"id": job["id"], "status": "error", "error": repr(e)}
+                        )
+                        continue
+                    busy_pechas |= job_pechas
+                pending = waiting
+
+                if not running:
+                    continue
+
+                deadlines = [p.deadline for p in running if p.deadline is not None]
+                wait_timeout = None
+                if deadlines:
+                    wait_timeout = max(min(deadlines) - time.monotonic(), 0)
+                ready = wait([p.connection for p in running], timeout=wait_timeout)
+
+                now = time.monotonic()
+                for job_process in list(running):
+                    if job_process.connection in ready:
+                        result = job_process.get_result()
+                    elif (
+                        job_process.deadline is not None and job_process.deadline <= now
+                    ):
+                        assert timeout is not None
+                        job_process.kill()
+                        result = get_timeout_result(job_process.job, timeout)
+                    else:
+                        continue
+                    running.remove(job_process)
+                    busy_pechas -= get_job_pecha_paths(job_process.job)
+                    add_result(result)
+    finally:
+        for job_process in running:
+            job_process.kill()
+    return results
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        description="Serialize and align the pecha sets of a manifest in parallel"
+    )
+    parser.add_argument("manifest", type=Path, help="Json manifest of pecha sets")
+    parser.add_argument("output_dir", type=Path, help="Directory to write outputs")
+    parser.add_argument(
+        "-w", "--workers", type=int, default=None, help="Number of worker processes"
+    )
+    parser.add_argument(
+        "-t", "--timeout", type=float, default=None, help="Timeout per job (seconds)"
+    )
+    parser.add_argument(
+        "--merge-pecha",
+        action="store_true",
+        help="Base update by merging layers into the pechas instead of in memory",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=Path,
+        default=None,
+        help="Directory of the persistent pechas mapping store",
+    )
+    parser.add_argument(
+        "--delta",
+        action="store_true",
+        help="Only write the segments changed since the previous run",
+    )
+    args = parser.parse_args(argv)
+
+    results = run_batch(
+        args.manifest,
+        args.output_dir,
+        workers=args.workers,
+        timeout=args.timeout,
+        in_memory=not args.merge_pecha,
+        cache_dir=args.cache_dir,
+        delta=args.delta,
+    )
+    failed = [result for result in results if result["status"] != "ok"]
+    print(f"{len(results) - len(failed)} jobs succeeded, {len(failed)} failed")
+    for result in failed:
+        print(f"{result['id']}: {result['error']}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,114 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+from alignment_ann_transfer.commentary import CommentaryAlignmentTransfer
+from alignment_ann_transfer.index import AlignmentIndex
+from alignment_ann_transfer.translation import TranslationAlignmentTransfer
+
+if TYPE_CHECKING:
+    from openpecha.pecha import Pecha
+
+
+class BulkAlignmentTransfer(TranslationAlignmentTransfer, CommentaryAlignmentTransfer):
+    """
+    Alignment of one root and root display pechas with many translation and
+    commentary pechas at once
+    """
+
+    def get_aligned_table(
+        self,
+        root_pecha: Pecha,
+        root_display_pecha: Pecha,
+        translation_pechas: Optional[Dict[str, Pecha]] = None,
+        commentary_pechas: Optional[Dict[str, Pecha]] = None,
+    ) -> Dict[int, Dict]:
+        """
+        Get the translations and commentaries aligned to every root display
+        idx, with the root side mapping and layers computed once.
+        The pechas are given by name, see align_table for the table format.
+        """
+        return self.get_alignment_index(
+            root_pecha, root_display_pecha, translation_pechas, commentary_pechas
+        ).get_table()
+
+    def get_alignment_index(
+        self,
+        root_pecha: Pecha,
+        root_display_pecha: Pecha,
+        translation_pechas: Optional[Dict[str, Pecha]] = None,
+        commentary_pechas: Optional[Dict[str, Pecha]] = None,
+    ) -> AlignmentIndex:
+        """
+        Build the alignment index of the pechas (given by name), for
+        per-segment lookups
+        """
+        return self.build_alignment_index(
+            self.get_inverse_root_pechas_mapping(root_pecha, root_display_pecha),
+            self.get_layer_anns(root_display_pecha),
+            self.get_layer_anns(root_pecha),
+            {
+                name: self.get_layer_anns(pecha)
+                for name, pecha in (translation_pechas or {}).items()
+            },
+            {
+                name: self.get_commentary_layer_anns(pecha)
+                for name, pecha in (commentary_pechas or {}).items()
+            },
+        )
+
+    def align_table(
+        self,
+        root_map: Dict[int, List],
+        root_display_anns: Dict,
+        root_anns: Dict,
+        translation_anns: Dict[str, Dict],
+        commentary_anns: Dict[str, List[Dict]],
+    ) -> Dict[int, Dict]:
+        """
+        Align the anns of every translation and commentary to the root display
+        anns with the root display -> root mapping, in a single pass:
+        {root display idx: {
+            "root_display_text": text,
+            "translation_text": {translation name: texts},
+            "commentary_text": {commentary name: texts},
+        }}
+        The texts of a translation or commentary are the same as in the rows
+        of align_translation and align_commentary.
+        """
+        return self.build_alignment_index(
+            root_map, root_display_anns, root_anns, translation_anns, commentary_anns
+        ).get_table()
+
+    def build_alignment_index(
+        self,
+        root_map: Dict[int, List],
+        root_display_anns: Dict,
+        root_anns: Dict,
+        translation_anns: Dict[str, Dict],
+        commentary_anns: Dict[str, List[Dict]],
+    ) -> AlignmentIndex:
+        """
+        Build the alignment index of the anns with the root display -> root
+        mapping
+        """
+        commentaries = {}
+        for name, anns in commentary_anns.items():
+            # Same as align_commentary: root idxs past the number of commentary
+            # segments are not aligned
+            commentaries[name] = {
+                root_idx: texts
+                for root_idx, texts in self.index_commentary_texts(anns).items()
+                if root_idx - 1 < len(anns)
+            }
+
+        return AlignmentIndex(
+            {idx: root_display_anns[idx]["text"] for idx in root_map},
+            {idx: [m[0] for m in map] for idx, map in root_map.items()},
+            {idx for idx, ann in root_anns.items() if not ann["text"].strip()},
+            {
+                name: {idx: ann["text"] for idx, ann in anns.items()}
+                for name, anns in translation_anns.items()
+            },
+            commentaries,
+        )
@@ -0,0 +1,89 @@
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Optional, Sequence, Tuple
+
+
+class LayerCache:
+    """
+    LRU cache for values computed from pecha files (extracted annotations,
+    pechas mappings).
+
+    An entry is keyed by a name and the paths of the files it was computed
+    from. It is recomputed as soon as any of these files changes on disk
+    (mtime or size), and the least recently used entries are evicted once
+    there are more than `maxsize` of them.
+    Entries can be read and added from several threads, a value being
+    computed outside of the lock.
+    """
+
+    def __init__(self, maxsize: int = 128):
+        self.maxsize = maxsize
+        self.entries: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_file_stamp(path: Path) -> Tuple[int, int]:
+        stat = path.stat()
+        return stat.st_mtime_ns, stat.st_size
+
+    def get_or_compute(
+        self, name: str, paths: Sequence[Path], compute: Callable[[], Any]
+    ) -> Any:
+        """
+        Return the cached value for (name, paths), computing it if it is
+        missing or if any of the files changed since it was computed.
+        """
+        key, stamps = self.get_key(name, paths)
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == stamps:
+                self.entries.move_to_end(key)
+                return entry[1]
+
+        # Stamped before computing, so a file changed meanwhile is recomputed
+        value = compute()
+        self.add_entry(key, stamps, value)
+        return value
+
+    def set(self, name: str, paths: Sequence[Path], value: Any):
+        """
+        Cache a value computed from the current content of paths
+        """
+        self.add_entry(*self.get_key(name, paths), value)
+
+    def get_key(self, name: str, paths: Sequence[Path]) -> Tuple[Tuple, Tuple]:
+        paths = tuple(Path(path).resolve() for path in paths)
+        stamps = tuple(self.get_file_stamp(path) for path in paths)
+        return (name, paths), stamps
+
+    def add_entry(self, key: Tuple, stamps: Tuple, value: Any):
+        if self.maxsize <= 0:
+            return
+
+        with self.lock:
+            self.entries[key] = (stamps, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, path: Optional[Path] = None):
+        """
+        Drop every entry computed from a file under `path`, or every entry
+        if no path is given.
+        """
+        if path is None:
+            with self.lock:
+                self.entries.clear()
+            return
+
+        path = Path(path).resolve()
+        with self.lock:
+            for key in list(self.entries):
+                _, paths = key
+                if any(p == path or path in p.parents for p in paths):
+                    del self.entries[key]
+
+    def __len__(self):
+        return len(self.entries)
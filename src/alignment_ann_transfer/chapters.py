@@ -0,0 +1,226 @@
+from __future__ import annotations
+
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, List, Optional, Type
+
+from alignment_ann_transfer import AlignmentTransfer
+from alignment_ann_transfer.session import PechaSetSession
+
+if TYPE_CHECKING:
+    from openpecha.pecha import Pecha
+
+    from alignment_ann_transfer.async_transfer import PechaRef
+
+
+class PechaChapter:
+    """
+    One base (chapter or volume) of a pecha with its layers, usable in place of
+    the pecha by the transfers and sessions: its bases only hold that base, so
+    its first base and first layer are the chapter ones.
+
+    pecha may be None (see from_path): only the chapter base is then read, and
+    the pecha is loaded if a layer is merged into it.
+    """
+
+    def __init__(
+        self,
+        pecha: Optional[Pecha],
+        base_name: str,
+        chapter: int,
+        pecha_path: Optional[Path] = None,
+    ):
+        if pecha is not None:
+            pecha_path = pecha.pecha_path
+        assert pecha_path is not None
+        self.pecha = pecha
+        self.base_name = base_name
+        self.chapter = chapter
+        self.pecha_path = Path(pecha_path)
+        self.base_path = self.pecha_path / "base"
+        self.layer_path = self.pecha_path / "layers"
+        if pecha is not None:
+            self.base_path = pecha.base_path
+            self.layer_path = pecha.layer_path
+        self.base: Optional[str] = None
+
+    @classmethod
+    def from_path(cls, pecha_path: Path, base_name: str, chapter: int) -> PechaChapter:
+        """
+        Get a chapter without loading its pecha, the other bases being left
+        unread
+        """
+        return cls(None, base_name, chapter, pecha_path)
+
+    @property
+    def bases(self) -> Dict[str, str]:
+        if self.pecha is not None:
+            return {self.base_name: self.pecha.bases[self.base_name]}
+        if self.base is None:
+            base_file = self.base_path / f"{self.base_name}.txt"
+            self.base = base_file.read_text(encoding="utf-8")
+        return {self.base_name: self.base}
+
+    def merge_pecha(self, src_pecha, src_base_name: str, tgt_base_name: str):
+        from openpecha.pecha import Pecha
+
+        if self.pecha is None:
+            self.pecha = Pecha.from_path(self.pecha_path)
+        if isinstance(src_pecha, PechaChapter) and src_pecha.pecha is None:
+            src_pecha.pecha = Pecha.from_path(src_pecha.pecha_path)
+        src_pecha = getattr(src_pecha, "pecha", src_pecha)
+        self.pecha.merge_pecha(src_pecha, src_base_name, tgt_base_name)
+
+
+def get_base_names(pecha: Pecha) -> List[str]:
+    """
+    Get the base names of a pecha in the order of the bases list of its
+    metadata.json, the order of pecha.bases being the one of the files on disk.
+    The metadata may only leave out the bases of a single base pecha.
+    """
+    metadata_path = Path(pecha.pecha_path) / "metadata.json"
+    metadata = json.loads(metadata_path.read_text(encoding="utf-8"))
+    bases = metadata.get("bases") or []
+    # [{base name: base metadata}], or {base name: base metadata}
+    if isinstance(bases, dict):
+        bases = [bases]
+    base_names = [base_name for base in bases for base_name in base]
+    if not base_names and len(pecha.bases) == 1:
+        return list(pecha.bases)
+    if sorted(base_names) != sorted(pecha.bases):
+        raise ValueError(
+            f"Bases of {metadata_path} {base_names} do not match the base files "
+            f"{sorted(pecha.bases)}"
+        )
+    return base_names
+
+
+def get_pecha_chapters(pecha: Pecha) -> List[PechaChapter]:
+    """
+    Get the chapters of a pecha, numbered from 1 in the order of the bases of
+    its metadata
+    """
+    return [
+        PechaChapter(pecha, base_name, chapter)
+        for chapter, base_name in enumerate(get_base_names(pecha), start=1)
+    ]
+
+
+def get_chapter_count(pechas: Dict[str, Optional[Pecha]]) -> int:
+    counts = {name: len(pecha.bases) for name, pecha in pechas.items() if pecha}
+    if len(set(counts.values())) != 1:
+        raise ValueError(f"Pechas do not have the same number of bases: {counts}")
+    if not any(counts.values()):
+        raise ValueError("Pechas do not have any base")
+    return next(iter(counts.values()))
+
+
+def get_chapter_sessions(
+    session_class: Type[PechaSetSession],
+    pechas: Dict[str, Optional[Pecha]],
+    transfer: Optional[AlignmentTransfer] = None,
+) -> List[PechaSetSession]:
+    """
+    Get a session per chapter of a pecha set, the n-th base (in metadata
+    order) of every pecha forming chapter n.
+    pechas: session argument name (eg: root_pecha) -> pecha
+    """
+    chapter_count = get_chapter_count(pechas)
+    if transfer is None:
+        transfer = session_class.transfer_class()
+    chapters = {
+        name: get_pecha_chapters(pecha) if pecha else None
+        for name, pecha in pechas.items()
+    }
+    return [
+        session_class(
+            transfer=transfer,
+            chapter=chapter,
+            **{
+                name: pecha_chapters[chapter - 1] if pecha_chapters else None
+                for name, pecha_chapters in chapters.items()
+            },
+        )
+        for chapter in range(1, chapter_count + 1)
+    ]
+
+
+def compute_chapter_outputs(
+    session_class: Type[PechaSetSession],
+    pecha_refs: Dict[str, PechaRef],
+    chapter: int,
+    methods: List[str],
+    in_memory: bool,
+    cache_dir: Optional[str],
+) -> Dict[str, List]:
+    """
+    Map and serialize one chapter of a pecha set in a worker process, reading
+    only the chapter base and layers of every pecha
+    """
+    from alignment_ann_transfer.async_transfer import (
+        get_worker_transfer,
+        load_pecha_ref,
+    )
+
+    transfer = get_worker_transfer(session_class.transfer_class, in_memory, cache_dir)
+    session = session_class(
+        transfer=transfer,
+        chapter=chapter,
+        **{name: load_pecha_ref(pecha_ref) for name, pecha_ref in pecha_refs.items()},
+    )
+    return {method: list(getattr(session, method)()) for method in methods}
+
+
+def get_chapter_outputs(
+    session_class: Type[PechaSetSession],
+    pechas: Dict[str, Optional[Pecha]],
+    methods: List[str],
+    max_processes: Optional[int] = None,
+    in_memory: bool = True,
+    cache_dir: Optional[Path] = None,
+) -> Dict[str, List]:
+    """
+    Compute the outputs (session method names, eg: get_serialized_translation)
+    of every chapter of a pecha set, each chapter being mapped in its own
+    process, and concatenate them in chapter order.
+
+    in_memory: Base update in memory (default). Otherwise the chapters are
+    mapped one after the other, as base update writes into the pechas.
+    """
+    chapter_count = get_chapter_count(pechas)
+    base_names = {
+        name: (str(pecha.pecha_path), get_base_names(pecha))
+        for name, pecha in pechas.items()
+        if pecha
+    }
+    chapter_refs: List[Dict[str, PechaRef]] = [
+        {
+            name: (pecha_path, pecha_base_names[chapter - 1], chapter)
+            for name, (pecha_path, pecha_base_names) in base_names.items()
+        }
+        for chapter in range(1, chapter_count + 1)
+    ]
+    args = (methods, in_memory, str(cache_dir) if cache_dir else None)
+
+    max_processes = min(max_processes or os.cpu_count() or 1, chapter_count)
+    if max_processes == 1 or not in_memory:
+        results = [
+            compute_chapter_outputs(session_class, pecha_refs, chapter, *args)
+            for chapter, pecha_refs in enumerate(chapter_refs, start=1)
+        ]
+    else:
+        with ProcessPoolExecutor(max_workers=max_processes) as executor:
+            futures = [
+                executor.submit(
+                    compute_chapter_outputs, session_class, pecha_refs, chapter, *args
+                )
+                for chapter, pecha_refs in enumerate(chapter_refs, start=1)
+            ]
+            results = [future.result() for future in futures]
+
+    return {
+        method: [item for result in results for item in result[method]]
+        for method in methods
+    }
@@ -1,10 +1,14 @@
-from typing import Dict, List
+from __future__ import annotations
 
-from openpecha.pecha import Pecha
-from stam import AnnotationStore
+from typing import TYPE_CHECKING, Dict, Iterator, List, Mapping, Sequence
 
 from alignment_ann_transfer import AlignmentTransfer
-from alignment_ann_transfer.utils import parse_root_mapping
+from alignment_ann_transfer.spans import CommentaryLayerAnns, SpanArray
+from alignment_ann_transfer.utils import iter_root_idx_anns, parse_root_indices
+
+if TYPE_CHECKING:
+    from openpecha.pecha import Pecha
+    from stam import AnnotationStore
 
 
 class CommentaryAlignmentTransfer(AlignmentTransfer):
@@ -14,52 +18,141 @@ class CommentaryAlignmentTransfer(AlignmentTransfer):
         """
         Get Segmentation mapping from commentary display pecha -> commentary pecha(root idx mapping)
         """
-        display_layer_path = self.get_first_layer_path(commentary_pecha)
-        new_tgt_layer_path = self.base_update(
-            commentary_display_pecha, commentary_pecha
+        return self.get_cached_mapping(
+            "commentary_pechas_mapping",
+            self.get_pecha_files(commentary_display_pecha)
+            + self.get_pecha_files(commentary_pecha),
+            lambda: self.compute_commentary_pechas_mapping(
+                commentary_display_pecha, commentary_pecha
+            ),
         )
 
-        display_layer = AnnotationStore(file=str(display_layer_path))
-        transfer_layer = AnnotationStore(file=str(new_tgt_layer_path))
+    def compute_commentary_pechas_mapping(
+        self, src_pecha: Pecha, tgt_pecha: Pecha
+    ) -> Dict[int, List]:
+        """
+        1. Transfer the src pecha layer to tgt pecha base
+        2. Map the transferred layer -> tgt pecha layer(root idx mapping)
+        """
+        with self.stage("pechas_mapping"):
+            display_spans = self.get_layer_spans(tgt_pecha, unique=False)
+            transfer_spans = self.get_transfer_spans(src_pecha, tgt_pecha, unique=False)
+            if self.window_size is not None:
+                return self.map_windowed_span_arrays(
+                    transfer_spans,
+                    display_spans,
+                    self.get_windows(src_pecha, tgt_pecha),
+                )
+            return self.map_span_arrays(transfer_spans, display_spans)
+
+    def get_commentary_layer_anns(self, pecha: Pecha) -> List[Dict]:
+        """
+        Get the extracted commentary annotations of the pecha first layer (cached)
+        """
+        layer_path = self.get_first_layer_path(pecha)
+
+        def extract() -> List[Dict]:
+            if self.snapshot_store is None:
+                return self.extract_commentary_anns(self.get_layer(pecha))
+            with self.stage("extract_anns"):
+                anns = self.get_layer_snapshot(pecha).get_commentary_anns()
+            self.count("annotations", len(anns))
+            return anns
+
+        return self.cache.get_or_compute("commentary_anns", [layer_path], extract)
+
+    def get_lazy_commentary_layer_anns(self, pecha: Pecha) -> CommentaryLayerAnns:
+        """
+        Get the commentary annotations of the pecha first layer as
+        get_commentary_layer_anns, their text being sliced from the base when
+        looked up: only their spans and root idx mappings are cached
+        """
+        if self.snapshot_store is not None:
+            snapshot = self.get_layer_snapshot(pecha)
+            return CommentaryLayerAnns(
+                self.get_layer_spans(pecha, unique=False),
+                snapshot.get_root_idx_mapping,
+                snapshot.get_text,
+            )
+
+        root_idx_mappings = self.cache.get_or_compute(
+            "root_idx_mappings",
+            [self.get_first_layer_path(pecha)],
+            lambda: [
+                mapping for _, mapping in iter_root_idx_anns(self.get_layer(pecha))
+            ],
+        )
+        return CommentaryLayerAnns(
+            self.get_base_spans(pecha), root_idx_mappings.__getitem__
+        )
 
-        map = self.map_commentary_layer_to_layer(transfer_layer, display_layer)
+    def iter_commentary_chapters(
+        self, method: str, pechas: Dict[str, Pecha]
+    ) -> Iterator:
+        """
+        Yield the output of a CommentarySession method for every chapter of
+        multi-base pechas
+        """
+        from alignment_ann_transfer.session import CommentarySession
 
-        # Clean up the layer
-        new_tgt_layer_path.unlink()
-        return map
+        return self.iter_chapter_outputs(CommentarySession, method, pechas)
 
     def get_serialized_commentary(
         self, root_pecha: Pecha, root_display_pecha: Pecha, commentary_pecha: Pecha
-    ):
+    ) -> List[str]:
         """
         Input: map from transfer_layer -> display_layer (One to Many)
         Structure in a way such as : <chapter number><display idx>commentary text
         Note: From many relation in display layer, take first idx (Sefaria map limitation)
         """
+        return list(
+            self.iter_serialized_commentary(
+                root_pecha, root_display_pecha, commentary_pecha
+            )
+        )
 
-        def is_empty(text):
-            """Check if text is empty or contains only newlines."""
-            return not text.strip().replace("\n", "")
-
-        map = self.get_root_pechas_mapping(root_pecha, root_display_pecha)
-
-        root_display_layer_path = next(root_display_pecha.layer_path.rglob("*.json"))
-        root_display_anns = self.extract_anns(
-            AnnotationStore(file=str(root_display_layer_path))
+    def iter_serialized_commentary(
+        self, root_pecha: Pecha, root_display_pecha: Pecha, commentary_pecha: Pecha
+    ) -> Iterator[str]:
+        """
+        Yield the segments of get_serialized_commentary one by one
+        """
+        if self.has_chapters(root_pecha, root_display_pecha, commentary_pecha):
+            yield from self.iter_commentary_chapters(
+                "iter_serialized_commentary",
+                {
+                    "root_pecha": root_pecha,
+                    "root_display_pecha": root_display_pecha,
+                    "commentary_pecha": commentary_pecha,
+                },
+            )
+            return
+        yield from self.serialize_commentary(
+            self.get_root_pechas_mapping(root_pecha, root_display_pecha),
+            self.get_lazy_commentary_layer_anns(commentary_pecha),
+            self.get_lazy_layer_anns(root_display_pecha),
+            self.get_lazy_layer_anns(root_pecha),
         )
 
-        root_layer_path = next(root_pecha.layer_path.rglob("*.json"))
-        root_anns = self.extract_anns(AnnotationStore(file=str(root_layer_path)))
+    def serialize_commentary(
+        self,
+        map: Dict[int, List],
+        commentary_anns: Sequence[Dict],
+        root_display_anns: Mapping[int, Dict],
+        root_anns: Mapping[int, Dict],
+        chapter: int = 1,
+    ) -> Iterator[str]:
+        """
+        Serialize the commentary anns of a chapter with the root -> root
+        display mapping
+        """
 
-        commentary_layer_path = next(commentary_pecha.layer_path.rglob("*.json"))
-        commentary_anns = self.extract_commentary_anns(
-            AnnotationStore(file=str(commentary_layer_path))
-        )
+        def is_empty(text):
+            """Check if text is empty or contains only newlines."""
+            return not text.strip().replace("\n", "")
 
-        segments = []
         for ann in commentary_anns:
-            root_indices = parse_root_mapping(ann["root_idx_mapping"])
-            first_idx = root_indices[0]
+            first_idx = parse_root_indices(ann["root_idx_mapping"]).first
             commentary_text = ann["text"]
 
             # # If the commentary text is empty, skip
@@ -78,32 +171,56 @@ class CommentaryAlignmentTransfer(AlignmentTransfer):
                 if display_idx in root_display_anns and not is_empty(
                     root_display_anns[display_idx]["text"]
                 ):
-                    curr_segment = f"<1><{display_idx}>{commentary_text}"
+                    curr_segment = f"<{chapter}><{display_idx}>{commentary_text}"
                 # If root display is empty, dont add any mapping
                 else:
                     curr_segment = commentary_text
-            segments.append(curr_segment)
-        return segments
+            yield curr_segment
 
     def get_aligned_display_commentary(
         self, root_pecha: Pecha, root_display_pecha: Pecha, commentary_pecha: Pecha
     ) -> List[Dict]:
-        root_map = self.get_root_pechas_mapping(root_display_pecha, root_pecha)
-
-        layer_path = next(commentary_pecha.layer_path.rglob("*.json"))
-        commentary_anns = self.extract_commentary_anns(
-            AnnotationStore(file=str(layer_path))
+        return list(
+            self.iter_aligned_display_commentary(
+                root_pecha, root_display_pecha, commentary_pecha
+            )
         )
 
-        root_display_layer_path = next(root_display_pecha.layer_path.rglob("*.json"))
-        root_display_anns = self.extract_anns(
-            AnnotationStore(file=str(root_display_layer_path))
+    def iter_aligned_display_commentary(
+        self, root_pecha: Pecha, root_display_pecha: Pecha, commentary_pecha: Pecha
+    ) -> Iterator[Dict]:
+        """
+        Yield the aligned segments of get_aligned_display_commentary one by one
+        """
+        if self.has_chapters(root_pecha, root_display_pecha, commentary_pecha):
+            yield from self.iter_commentary_chapters(
+                "iter_aligned_display_commentary",
+                {
+                    "root_pecha": root_pecha,
+                    "root_display_pecha": root_display_pecha,
+                    "commentary_pecha": commentary_pecha,
+                },
+            )
+            return
+        yield from self.align_commentary(
+            self.get_inverse_root_pechas_mapping(root_pecha, root_display_pecha),
+            self.get_lazy_commentary_layer_anns(commentary_pecha),
+            self.get_lazy_layer_anns(root_display_pecha),
+            self.get_lazy_layer_anns(root_pecha),
         )
 
-        root_layer_path = next(root_pecha.layer_path.rglob("*.json"))
-        root_anns = self.extract_anns(AnnotationStore(file=str(root_layer_path)))
-
-        aligned_segments = []
+    def align_commentary(
+        self,
+        root_map: Dict[int, List],
+        commentary_anns: Sequence[Dict],
+        root_display_anns: Mapping[int, Dict],
+        root_anns: Mapping[int, Dict],
+    ) -> Iterator[Dict]:
+        """
+        Align the commentary anns to the root display anns with the
+        root display -> root mapping
+        """
+        commentary_index = self.index_commentary_positions(commentary_anns)
 
         for root_display_idx, map in root_map.items():
             root_display_text = root_display_anns[root_display_idx]["text"]
@@ -114,6 +231,7 @@ class CommentaryAlignmentTransfer(AlignmentTransfer):
                 commentary_texts = None
             else:
                 commentary_texts = []
+                seen_texts = set()
                 for m in map:
                     root_idx = m[0]
                     if not root_anns[root_idx]["text"].strip():
@@ -122,25 +240,46 @@ class CommentaryAlignmentTransfer(AlignmentTransfer):
                     if root_idx - 1 >= len(commentary_anns):
                         continue
 
-                    for ann in commentary_anns:
-                        root_indices = parse_root_mapping(ann["root_idx_mapping"])
-                        if root_idx in root_indices:
-                            commentary_text = ann["text"]
-                            if not commentary_text.strip():
-                                continue
+                    for pos in commentary_index.get(root_idx, []):
+                        commentary_text = commentary_anns[pos]["text"]
+                        if not commentary_text.strip() or commentary_text in seen_texts:
+                            continue
 
-                            if commentary_text in commentary_texts:
-                                continue
+                        seen_texts.add(commentary_text)
+                        commentary_texts.append(commentary_text)
 
-                            commentary_texts.append(ann["text"])
+            yield {
+                "root_display_text": root_display_text,
+                "commentary_text": commentary_texts,
+            }
 
-            aligned_segments.append(
-                {
-                    "root_display_text": root_display_text,
-                    "commentary_text": commentary_texts,
-                }
-            )
-        return aligned_segments
+    def index_commentary_positions(
+        self, commentary_anns: Sequence[Dict]
+    ) -> Dict[int, List[int]]:
+        """
+        Index the positions of the commentary anns by the root indices they are
+        mapped to, keeping the commentary layer order (their text is not read)
+        """
+        index: Dict[int, List[int]] = {}
+        for pos, ann in enumerate(commentary_anns):
+            for root_idx in parse_root_indices(ann["root_idx_mapping"]):
+                index.setdefault(root_idx, []).append(pos)
+        return index
+
+    def index_commentary_texts(self, commentary_anns: List[Dict]) -> Dict[int, List]:
+        """
+        Index the non empty commentary texts by the root indices they are mapped to,
+        keeping the commentary layer order
+        """
+        index: Dict[int, List] = {}
+        for ann in commentary_anns:
+            commentary_text = ann["text"]
+            if not commentary_text.strip():
+                continue
+
+            for root_idx in parse_root_indices(ann["root_idx_mapping"]):
+                index.setdefault(root_idx, []).append(commentary_text)
+        return index
 
     def get_serialized_commentary_display(
         self,
@@ -148,47 +287,84 @@ class CommentaryAlignmentTransfer(AlignmentTransfer):
         root_display_pecha: Pecha,
         commentary_pecha: Pecha,
         commentary_display_pecha: Pecha,
-    ):
+    ) -> List[str]:
         """
         Input: map from transfer_layer -> display_layer (One to Many)
         Structure in a way such as : <chapter number><display idx>translation text
         Note: From many relation in display layer, take first idx (Sefaria map limitation)
         """
+        return list(
+            self.iter_serialized_commentary_display(
+                root_pecha,
+                root_display_pecha,
+                commentary_pecha,
+                commentary_display_pecha,
+            )
+        )
+
+    def iter_serialized_commentary_display(
+        self,
+        root_pecha: Pecha,
+        root_display_pecha: Pecha,
+        commentary_pecha: Pecha,
+        commentary_display_pecha: Pecha,
+    ) -> Iterator[str]:
+        """
+        Yield the segments of get_serialized_commentary_display one by one
+        """
+        if self.has_chapters(
+            root_pecha, root_display_pecha, commentary_pecha, commentary_display_pecha
+        ):
+            yield from self.iter_commentary_chapters(
+                "iter_serialized_commentary_display",
+                {
+                    "root_pecha": root_pecha,
+                    "root_display_pecha": root_display_pecha,
+                    "commentary_pecha": commentary_pecha,
+                    "commentary_display_pecha": commentary_display_pecha,
+                },
+            )
+            return
         root_map = self.get_root_pechas_mapping(root_pecha, root_display_pecha)
         commentary_map = self.get_commentary_pechas_mapping(
             commentary_pecha, commentary_display_pecha
         )
+        yield from self.serialize_commentary_display(
+            self.compose_mappings(commentary_map, root_map),
+            self.get_lazy_layer_anns(commentary_display_pecha),
+        )
 
-        layer_path = next(commentary_display_pecha.layer_path.rglob("*.json"))
-
-        anns = self.extract_anns(AnnotationStore(file=str(layer_path)))
-
-        segments = []
+    def serialize_commentary_display(
+        self, display_map: Dict[int, int], anns: Mapping[int, Dict], chapter: int = 1
+    ) -> Iterator[str]:
+        """
+        Serialize the commentary display anns of a chapter with the composed
+        commentary display -> root display mapping
+        """
         for idx, ann in anns.items():
             commentary_text = ann["text"]
-            root_idx = commentary_map[idx][0][0]
-            root_display_idx = root_map[root_idx][0][0]
-            segments.append(f"<1><{root_display_idx}>{commentary_text}")
-
-        return segments
+            yield f"<{chapter}><{display_map[idx]}>{commentary_text}"
 
-    def extract_commentary_anns(self, layer: AnnotationStore) -> List[Dict]:
+    def extract_commentary_anns(
+        self, layer: AnnotationStore, with_text: bool = True
+    ) -> List[Dict]:
         """
         Extract annotation from layer(STAM)
+        with_text: Set to False to only extract spans and root idx mapping
         """
         anns = []
-        for ann in layer.annotations():
-            start, end = ann.offset().begin().value(), ann.offset().end().value()
-            ann_metadata = {}
-            for data in ann:
-                ann_metadata[data.key().id()] = str(data.value())
-            anns.append(
-                {
+        with self.stage("extract_anns"):
+            for ann, root_idx_mapping in iter_root_idx_anns(layer):
+                offset = ann.offset()
+                start, end = offset.begin().value(), offset.end().value()
+                curr_ann: Dict = {
                     "Span": {"start": start, "end": end},
-                    "root_idx_mapping": ann_metadata["root_idx_mapping"],
-                    "text": str(ann),
+                    "root_idx_mapping": root_idx_mapping,
                 }
-            )
+                if with_text:
+                    curr_ann["text"] = str(ann)
+                anns.append(curr_ann)
+        self.count("annotations", len(anns))
         return anns
 
     def map_commentary_layer_to_layer(
@@ -199,36 +375,15 @@ class CommentaryAlignmentTransfer(AlignmentTransfer):
         2. Map the annotations from source to target layer
         src_layer -> tgt_layer (One to Many)
         """
-        mapping: Dict = {}
-
-        src_anns = self.extract_commentary_anns(src_layer)
-        tgt_anns = self.extract_commentary_anns(tgt_layer)
-
-        for src_ann in src_anns:
-            src_start, src_end = src_ann["Span"]["start"], src_ann["Span"]["end"]
-            src_idx = int(src_ann["root_idx_mapping"])
-            mapping[src_idx] = []
-
-            for tgt_ann in tgt_anns:
-                tgt_start, tgt_end = tgt_ann["Span"]["start"], tgt_ann["Span"]["end"]
-                tgt_indicies = parse_root_mapping(tgt_ann["root_idx_mapping"])
-                tgt_idx = tgt_indicies[0]  # Take the first index
-
-                # Check for mapping conditions
-                if (
-                    src_start
-                    <= tgt_start
-                    < src_end  # Target annotation starts within source
-                    or src_start
-                    < tgt_end
-                    <= src_end  # Target annotation ends within source
-                    or (
-                        tgt_start < src_start and tgt_end > src_end
-                    )  # Target fully contains source
-                ) and not (
-                    tgt_start == src_end or tgt_end == src_start
-                ):  # No exact edge overlap
-                    mapping[src_idx].append([tgt_idx, [tgt_start, tgt_end]])
-
-        # Sort the mapping by source indices
-        return dict(sorted(mapping.items()))
+        src_spans = self.extract_spans(src_layer, unique=False)
+        tgt_spans = self.extract_spans(tgt_layer, unique=False)
+        return self.map_span_arrays(src_spans, tgt_spans)
+
+    def map_commentary_anns_to_anns(self, src_anns: List[Dict], tgt_anns: List[Dict]):
+        """
+        Map the extracted annotations from source to target layer
+        src_anns -> tgt_anns (One to Many)
+        """
+        return self.map_span_arrays(
+            SpanArray.from_anns(src_anns), SpanArray.from_anns(tgt_anns)
+        )
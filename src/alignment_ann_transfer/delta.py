@@ -0,0 +1,286 @@
+"""
+Delta export of the transfer outputs: only the segments added, changed or
+removed since the previous export of an output are written.
+
+Every segment gets a stable id:
+    - "<chapter>.<display idx>.<n>" for the n-th serialized segment of a
+    root display segment (<chapter><display idx>text), segments without the
+    prefix taking the one of the previous segment
+    - the id given with it otherwise, eg: "<chapter>.<display idx>" for the
+    aligned rows, one per root display segment (see
+    PechaSetSession.iter_row_ids)
+    - "<position>" for the other outputs
+
+The hashes of the segments of the last export are kept in
+<output name>.fingerprint.json, and the edit in <output name>.delta.json:
+
+    {
+        "output": "serialized_translation",
+        "previous_digest": "...",  # null on the first export
+        "digest": "...",
+        "added": {id: segment},
+        "changed": {id: segment},
+        "removed": [id],
+        "moved": [id],  # kept segments out of their previous order
+        "after": {id: id}  # id of the segment before an added or moved one,
+                           # null at the start of the output
+    }
+
+The other segments keep their previous order, so a delta only grows with the
+edit. The digest identifies the full output, so a delta is only applied to the
+output it was computed from (see apply_delta).
+
+The new fingerprints are staged next to the deltas and only replace the
+previous ones with commit_fingerprints, once every delta of the export and its
+manifest are written: an interrupted export is computed again from the same
+previous export.
+"""
+import hashlib
+import json
+import re
+from bisect import bisect_left
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+# Bump when the segment ids or hashes change, to export everything again
+FINGERPRINT_VERSION = 2
+
+SEGMENT_PREFIX = re.compile(r"<(\d+)><(\d+)>")
+
+
+def iter_segment_ids(segments: Iterable[Any]) -> Iterator[Tuple[str, Any]]:
+    """
+    Yield the segments of an output with their stable id
+    """
+    occurrences: Dict[str, int] = {}
+    key = "0.0"
+    for position, segment in enumerate(segments):
+        if not isinstance(segment, str):
+            yield str(position), segment
+            continue
+
+        prefix = SEGMENT_PREFIX.match(segment)
+        if prefix:
+            key = f"{prefix.group(1)}.{prefix.group(2)}"
+        occurrence = occurrences.get(key, 0)
+        occurrences[key] = occurrence + 1
+        yield f"{key}.{occurrence}", segment
+
+
+def get_segment_hash(segment: Any) -> str:
+    encoded = json.dumps(segment, ensure_ascii=False, sort_keys=True)
+    return hashlib.blake2b(encoded.encode("utf-8"), digest_size=8).hexdigest()
+
+
+def get_digest(fingerprint: Dict[str, str]) -> str:
+    digest = hashlib.sha256()
+    for segment_id, segment_hash in fingerprint.items():
+        digest.update(f"{segment_id}:{segment_hash}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def load_fingerprint(path: Path) -> Optional[Dict[str, str]]:
+    """
+    Load the segment hashes of the previous export, if any
+    """
+    if not path.exists():
+        return None
+    fingerprint = json.loads(path.read_text(encoding="utf-8"))
+    if fingerprint["version"] != FINGERPRINT_VERSION:
+        return None
+    return fingerprint["segments"]
+
+
+def get_delta(
+    output_name: str,
+    segments: Iterable[Any],
+    previous: Optional[Dict[str, str]] = None,
+    segment_ids: Optional[Iterable[str]] = None,
+) -> Tuple[Dict, Dict[str, str]]:
+    """
+    Get the delta of the segments against the previous segment hashes (in
+    output order), and their own segment hashes. Only the added and changed
+    segments are kept in memory.
+    segment_ids: Ids of the segments, see iter_segment_ids if not given
+    """
+    fingerprint: Dict[str, str] = {}
+    added: Dict[str, Any] = {}
+    changed: Dict[str, Any] = {}
+    previous_fingerprint = previous or {}
+    if segment_ids is None:
+        id_segments = iter_segment_ids(segments)
+    else:
+        id_segments = zip(segment_ids, segments)
+    for segment_id, segment in id_segments:
+        if segment_id in fingerprint:
+            raise ValueError(f"Segment id {segment_id} of {output_name} is repeated")
+        segment_hash = get_segment_hash(segment)
+        fingerprint[segment_id] = segment_hash
+        previous_hash = previous_fingerprint.get(segment_id)
+        if previous_hash is None:
+            added[segment_id] = segment
+        elif previous_hash != segment_hash:
+            changed[segment_id] = segment
+
+    moved = get_moved_ids(previous_fingerprint, fingerprint)
+    # Id of the segment every added or moved segment now follows
+    after: Dict[str, Optional[str]] = {}
+    previous_id = None
+    for segment_id in fingerprint:
+        if segment_id in added or segment_id in moved:
+            after[segment_id] = previous_id
+        previous_id = segment_id
+    delta = {
+        "output": output_name,
+        "previous_digest": get_digest(previous) if previous is not None else None,
+        "digest": get_digest(fingerprint),
+        "added": added,
+        "changed": changed,
+        "removed": [
+            segment_id
+            for segment_id in previous_fingerprint
+            if segment_id not in fingerprint
+        ],
+        "moved": [segment_id for segment_id in fingerprint if segment_id in moved],
+        "after": after,
+    }
+    return delta, fingerprint
+
+
+def get_moved_ids(previous_ids: Iterable[str], segment_ids: Iterable[str]) -> Set[str]:
+    """
+    Get the fewest ids, of the segments in both exports, to move for the
+    others to keep their previous order: the ones out of a longest increasing
+    run of their previous positions
+    """
+    previous_positions = {
+        segment_id: pos for pos, segment_id in enumerate(previous_ids)
+    }
+    kept_ids = [
+        segment_id for segment_id in segment_ids if segment_id in previous_positions
+    ]
+    positions = [previous_positions[segment_id] for segment_id in kept_ids]
+
+    # Position in kept_ids of the last item of the increasing runs by length,
+    # with the smallest last previous position, and the item before each item
+    run_ends: List[int] = []
+    run_end_positions: List[int] = []
+    before: List[int] = []
+    for i, position in enumerate(positions):
+        length = bisect_left(run_end_positions, position)
+        before.append(run_ends[length - 1] if length else -1)
+        if length == len(run_ends):
+            run_ends.append(i)
+            run_end_positions.append(position)
+        else:
+            run_ends[length] = i
+            run_end_positions[length] = position
+
+    in_order: Set[str] = set()
+    i = run_ends[-1] if run_ends else -1
+    while i != -1:
+        in_order.add(kept_ids[i])
+        i = before[i]
+    return {segment_id for segment_id in kept_ids if segment_id not in in_order}
+
+
+def write_delta(
+    output_dir: Path,
+    output_name: str,
+    segments: Iterable[Any],
+    segment_ids: Optional[Iterable[str]] = None,
+) -> Dict:
+    """
+    Write the delta of an output since its previous export in output_dir and
+    stage its segment hashes for the next one (see commit_fingerprints).
+    Return the manifest entry of the output: digests and number of segments in
+    the output and in the delta.
+    """
+    fingerprint_path = output_dir / f"{output_name}.fingerprint.json"
+    delta, fingerprint = get_delta(
+        output_name, segments, load_fingerprint(fingerprint_path), segment_ids
+    )
+
+    write_json_file(output_dir / f"{output_name}.delta.json", delta)
+    write_json_file(
+        get_staged_path(fingerprint_path),
+        {"version": FINGERPRINT_VERSION, "segments": fingerprint},
+    )
+    return {
+        "previous_digest": delta["previous_digest"],
+        "digest": delta["digest"],
+        "segments": len(fingerprint),
+        "added": len(delta["added"]),
+        "changed": len(delta["changed"]),
+        "removed": len(delta["removed"]),
+        "moved": len(delta["moved"]),
+    }
+
+
+def get_staged_path(fingerprint_path: Path) -> Path:
+    return fingerprint_path.with_name(f"{fingerprint_path.name}.staged")
+
+
+def commit_fingerprints(output_dir: Path, output_names: Iterable[str]):
+    """
+    Replace the fingerprints of the outputs by the ones staged by write_delta,
+    to be called once every delta of the export and its manifest are written
+    """
+    for output_name in output_names:
+        fingerprint_path = output_dir / f"{output_name}.fingerprint.json"
+        get_staged_path(fingerprint_path).replace(fingerprint_path)
+
+
+def apply_delta(segments: Dict[str, Any], delta: Dict) -> Dict[str, Any]:
+    """
+    Apply a delta to the segments (by id, in output order) of the previous
+    export, giving the segments in the new output order.
+    Raise a ValueError if the segments are not the ones of the export the
+    delta was computed from.
+    """
+    if delta["previous_digest"] is None:
+        if segments:
+            raise ValueError(
+                f"Delta of {delta['output']} is a first export, it can not be "
+                f"applied to {len(segments)} segments"
+            )
+    else:
+        digest = get_digest(
+            {
+                segment_id: get_segment_hash(segment)
+                for segment_id, segment in segments.items()
+            }
+        )
+        if digest != delta["previous_digest"]:
+            raise ValueError(
+                f"Delta of {delta['output']} was computed from the export "
+                f"{delta['previous_digest']}, not from these segments ({digest})"
+            )
+
+    removed = set(delta["removed"])
+    updated = {**delta["changed"], **delta["added"]}
+    # Id of a segment -> id of the added or moved segment right after it
+    following = {
+        after_id: segment_id for segment_id, after_id in delta["after"].items()
+    }
+
+    new_segments: Dict[str, Any] = {}
+
+    def add_following(segment_id: Optional[str]):
+        while segment_id in following:
+            segment_id = following[segment_id]
+            new_segments[segment_id] = updated.get(segment_id, segments.get(segment_id))
+
+    add_following(None)
+    for segment_id, segment in segments.items():
+        if segment_id in removed or segment_id in delta["after"]:
+            continue
+        new_segments[segment_id] = updated.get(segment_id, segment)
+        add_following(segment_id)
+    return new_segments
+
+
+def write_json_file(path: Path, data: Any):
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    tmp_path.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+    tmp_path.replace(path)
@@ -0,0 +1,146 @@
+import json
+from pathlib import Path
+from typing import Dict, List, Optional, Set
+
+# Bump when the saved index format changes
+INDEX_VERSION = 1
+
+
+class AlignmentIndex:
+    """
+    Precomputed alignment of the root display segments with the root,
+    translation and commentary segments, for per-segment lookups:
+    root display idx -> root idxs -> translation / commentary texts, and
+    root idx -> root display idxs. Every lookup is a dict lookup.
+
+    The index is never modified once built, so a single instance can be
+    shared by any number of threads. Build it with
+    BulkAlignmentTransfer.get_alignment_index, save and load it with
+    save / load.
+    """
+
+    def __init__(
+        self,
+        root_display_texts: Dict[int, str],
+        root_idxs: Dict[int, List[int]],
+        empty_root_idxs: Set[int],
+        translations: Dict[str, Dict[int, str]],
+        commentaries: Dict[str, Dict[int, List[str]]],
+    ):
+        """
+        root_display_texts: root display idx -> text, in root display order
+        root_idxs: root display idx -> root idxs it is mapped to
+        empty_root_idxs: Root idxs of the blank root segments, never aligned
+        translations: translation name -> root idx -> translation text
+        commentaries: commentary name -> root idx -> commentary texts
+        """
+        self.root_display_texts = root_display_texts
+        self.root_idxs = root_idxs
+        self.empty_root_idxs = empty_root_idxs
+        self.translations = translations
+        self.commentaries = commentaries
+
+        self.root_display_idxs: Dict[int, List[int]] = {}
+        for root_display_idx, idxs in root_idxs.items():
+            for root_idx in idxs:
+                self.root_display_idxs.setdefault(root_idx, []).append(root_display_idx)
+
+    def __len__(self) -> int:
+        return len(self.root_display_texts)
+
+    def __contains__(self, root_display_idx: int) -> bool:
+        return root_display_idx in self.root_display_texts
+
+    def get_root_idxs(self, root_display_idx: int) -> List[int]:
+        return list(self.root_idxs.get(root_display_idx, []))
+
+    def get_root_display_idxs(self, root_idx: int) -> List[int]:
+        return list(self.root_display_idxs.get(root_idx, []))
+
+    def get_aligned_root_idxs(self, root_display_idx: int) -> Optional[List[int]]:
+        """
+        Get the root idxs the translations and commentaries of a root display
+        segment are taken from, or None if it is blank or not mapped
+        """
+        root_idxs = self.root_idxs.get(root_display_idx)
+        if not root_idxs or not self.root_display_texts[root_display_idx].strip():
+            return None
+        return [idx for idx in root_idxs if idx not in self.empty_root_idxs]
+
+    def get_translation_texts(
+        self, name: str, root_display_idx: int
+    ) -> Optional[List[str]]:
+        root_idxs = self.get_aligned_root_idxs(root_display_idx)
+        if root_idxs is None:
+            return None
+        translation = self.translations[name]
+        return [translation[idx] for idx in root_idxs if idx in translation]
+
+    def get_commentary_texts(
+        self, name: str, root_display_idx: int
+    ) -> Optional[List[str]]:
+        root_idxs = self.get_aligned_root_idxs(root_display_idx)
+        if root_idxs is None:
+            return None
+        commentary = self.commentaries[name]
+        texts: Dict[str, None] = {}
+        for root_idx in root_idxs:
+            texts.update(dict.fromkeys(commentary.get(root_idx, [])))
+        return list(texts)
+
+    def get_row(self, root_display_idx: int) -> Dict:
+        """
+        Get the aligned texts of a root display segment, as a row of
+        BulkAlignmentTransfer.align_table
+        """
+        return {
+            "root_display_text": self.root_display_texts[root_display_idx],
+            "translation_text": {
+                name: self.get_translation_texts(name, root_display_idx)
+                for name in self.translations
+            },
+            "commentary_text": {
+                name: self.get_commentary_texts(name, root_display_idx)
+                for name in self.commentaries
+            },
+        }
+
+    def get_table(self) -> Dict[int, Dict]:
+        return {idx: self.get_row(idx) for idx in self.root_display_texts}
+
+    def save(self, path: Path):
+        index = {
+            "version": INDEX_VERSION,
+            "root_display_texts": self.root_display_texts,
+            "root_idxs": self.root_idxs,
+            "empty_root_idxs": sorted(self.empty_root_idxs),
+            "translations": self.translations,
+            "commentaries": self.commentaries,
+        }
+        Path(path).write_text(json.dumps(index, ensure_ascii=False), encoding="utf-8")
+
+    @classmethod
+    def load(cls, path: Path) -> "AlignmentIndex":
+        index = json.loads(Path(path).read_text(encoding="utf-8"))
+        if index["version"] != INDEX_VERSION:
+            raise ValueError(f"{path} is an alignment index of another version")
+        return cls(
+            with_int_keys(index["root_display_texts"]),
+            with_int_keys(index["root_idxs"]),
+            set(index["empty_root_idxs"]),
+            {
+                name: with_int_keys(translation)
+                for name, translation in index["translations"].items()
+            },
+            {
+                name: with_int_keys(commentary)
+                for name, commentary in index["commentaries"].items()
+            },
+        )
+
+
+def with_int_keys(mapping: Dict) -> Dict:
+    """
+    Convert back the idx keys of a dict loaded from JSON
+    """
+    return {int(key): value for key, value in mapping.items()}
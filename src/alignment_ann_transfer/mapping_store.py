@@ -0,0 +1,96 @@
+import hashlib
+import json
+import os
+import sqlite3
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Bump when the mapping computation changes, to ignore the stored mappings
+MAPPING_STORE_VERSION = 1
+
+DEFAULT_CACHE_DIR = Path(
+    os.environ.get(
+        "ALIGNMENT_ANN_TRANSFER_CACHE_DIR",
+        Path.home() / ".cache" / "alignment_ann_transfer",
+    )
+)
+
+
+class MappingStore:
+    """
+    Persistent store of pechas mappings in a SQLite database, shared by every
+    process using the same cache dir.
+
+    A mapping is keyed by its name and the content hashes of the files it was
+    computed from (bases and layers), so editing any of them makes the next
+    call compute and store a new mapping.
+    """
+
+    def __init__(self, cache_dir: Optional[Path] = None):
+        self.cache_dir = Path(cache_dir) if cache_dir else DEFAULT_CACHE_DIR
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.db_path = self.cache_dir / "mappings.sqlite3"
+        # (path, mtime, size) -> sha256, so unchanged files are not hashed again
+        self.file_hashes: Dict[Tuple[str, int, int], str] = {}
+
+        with self.connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS mappings (key TEXT PRIMARY KEY, mapping TEXT)"
+            )
+
+    @contextmanager
+    def connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(str(self.db_path), timeout=60)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get_file_hash(self, path: Path) -> str:
+        stat = path.stat()
+        file_key = (str(path.resolve()), stat.st_mtime_ns, stat.st_size)
+        if file_key not in self.file_hashes:
+            self.file_hashes[file_key] = hashlib.sha256(path.read_bytes()).hexdigest()
+        return self.file_hashes[file_key]
+
+    def get_key(self, name: str, paths: Sequence[Path]) -> str:
+        key = hashlib.sha256(f"{MAPPING_STORE_VERSION}:{name}".encode())
+        for path in paths:
+            key.update(self.get_file_hash(Path(path)).encode())
+        return key.hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[int, List]]:
+        with self.connect() as conn:
+            row = conn.execute(
+                "SELECT mapping FROM mappings WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {int(idx): value for idx, value in json.loads(row[0])}
+
+    def set(self, key: str, mapping: Dict[int, List]):
+        with self.connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO mappings (key, mapping) VALUES (?, ?)",
+                (key, json.dumps(list(mapping.items()))),
+            )
+
+    def get_or_compute(
+        self,
+        name: str,
+        paths: Sequence[Path],
+        compute: Callable[[], Dict[int, List]],
+    ) -> Dict[int, List]:
+        key = self.get_key(name, paths)
+        mapping = self.get(key)
+        if mapping is None:
+            mapping = compute()
+            self.set(key, mapping)
+        return mapping
+
+    def clear(self):
+        with self.connect() as conn:
+            conn.execute("DELETE FROM mappings")
@@ -0,0 +1,206 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, List, Sequence, Tuple
+
+# numpy and diff_match_patch are imported on first use, see alignment_ann_transfer
+if TYPE_CHECKING:
+    import numpy as np
+
+# (src start, tgt start, length) of a run of characters equal in both bases
+Run = Tuple[int, int, int]
+
+
+class OffsetTable:
+    """
+    Offset translation table of a src base -> tgt base projection: the runs
+    equal in both bases, sorted by src start.
+    An offset inside a run moves with it. An offset in src characters deleted
+    or replaced in tgt goes to the end of the previous run, an offset right
+    before tgt insertions goes after them (same as the diff_xIndex of the
+    openpecha base update).
+    """
+
+    __slots__ = ("src_starts", "tgt_starts", "lengths")
+
+    def __init__(self, runs: Sequence[Run], src_length: int, tgt_length: int):
+        import numpy as np
+
+        # Empty runs at the start and the end of the bases bound every offset
+        table = [(0, 0, 0), *runs, (src_length, tgt_length, 0)]
+        self.src_starts, self.tgt_starts, self.lengths = (
+            np.asarray(column, dtype=np.int64) for column in zip(*table)
+        )
+
+    def project(self, offsets) -> np.ndarray:
+        """
+        Project src offsets (int array) to tgt offsets, with a binary search of
+        their run
+        """
+        import numpy as np
+
+        offsets = np.asarray(offsets, dtype=np.int64)
+        run = np.searchsorted(self.src_starts, offsets, side="right") - 1
+        shift = np.minimum(offsets - self.src_starts[run], self.lengths[run])
+        return self.tgt_starts[run] + shift
+
+    def __len__(self) -> int:
+        return len(self.src_starts) - 2
+
+
+class DiffProjection:
+    """
+    Offset projection from a diff (diff-match-patch) of the whole bases, as
+    done by the openpecha base update.
+    Subclass it and override get_runs to plug another diff into
+    AlignmentTransfer(projection=...).
+    """
+
+    def __init__(self, diff_timeout: float = 60):
+        self.diff_timeout = diff_timeout
+
+    def __repr__(self) -> str:
+        """
+        Class and parameters, identifying the offsets the projection gives
+        """
+        params = ", ".join(
+            f"{name}={value!r}" for name, value in sorted(vars(self).items())
+        )
+        return f"{type(self).__name__}({params})"
+
+    def get_offset_table(self, src_base: str, tgt_base: str) -> OffsetTable:
+        return OffsetTable(
+            self.get_runs(src_base, tgt_base), len(src_base), len(tgt_base)
+        )
+
+    def get_runs(self, src_base: str, tgt_base: str) -> List[Run]:
+        return self.get_diff_runs(src_base, tgt_base)
+
+    def get_diff_runs(
+        self, src: str, tgt: str, src_start: int = 0, tgt_start: int = 0
+    ) -> List[Run]:
+        """
+        Get the equal runs of a diff of src and tgt, found at src_start and
+        tgt_start in the bases
+        """
+        from diff_match_patch import diff_match_patch
+
+        if not src or not tgt:
+            return []
+        if src == tgt:
+            return [(src_start, tgt_start, len(src))]
+
+        dmp = diff_match_patch()
+        dmp.Diff_Timeout = self.diff_timeout
+        runs = []
+        for op, text in dmp.diff_main(src, tgt, checklines=False):
+            if op == dmp.DIFF_EQUAL:
+                runs.append((src_start, tgt_start, len(text)))
+            if op != dmp.DIFF_INSERT:
+                src_start += len(text)
+            if op != dmp.DIFF_DELETE:
+                tgt_start += len(text)
+        return runs
+
+
+class AnchoredProjection(DiffProjection):
+    """
+    Offset projection for large and mostly identical bases: blocks of
+    anchor_length src characters found once in tgt near their expected
+    position (within max_drift characters) anchor the runs, which are
+    extended as long as both bases are equal. Only the gaps between the runs
+    are diffed.
+    """
+
+    def __init__(
+        self, anchor_length: int = 32, max_drift: int = 1000, diff_timeout: float = 60
+    ):
+        super().__init__(diff_timeout)
+        self.anchor_length = anchor_length
+        self.max_drift = max_drift
+
+    def get_runs(self, src_base: str, tgt_base: str) -> List[Run]:
+        runs: List[Run] = []
+        src_end = tgt_end = 0
+        for src_start, tgt_start, length in self.get_anchor_runs(src_base, tgt_base):
+            runs += self.get_diff_runs(
+                src_base[src_end:src_start],
+                tgt_base[tgt_end:tgt_start],
+                src_end,
+                tgt_end,
+            )
+            runs.append((src_start, tgt_start, length))
+            src_end, tgt_end = src_start + length, tgt_start + length
+        runs += self.get_diff_runs(
+            src_base[src_end:], tgt_base[tgt_end:], src_end, tgt_end
+        )
+        return runs
+
+    def get_anchor_runs(self, src_base: str, tgt_base: str) -> List[Run]:
+        """
+        Get the maximal equal runs around the anchors, in order and not
+        overlapping
+        """
+        k = self.anchor_length
+        runs: List[Run] = []
+        src_end = tgt_end = 0
+        pos = 0
+        while pos + k <= len(src_base):
+            expected = tgt_end + pos - src_end
+            tgt_pos = self.find_anchor(src_base, pos, tgt_base, tgt_end, expected)
+            if tgt_pos == -1:
+                pos += k
+                continue
+
+            # Extend back to the previous run, then forward
+            while (
+                pos > src_end
+                and tgt_pos > tgt_end
+                and src_base[pos - 1] == tgt_base[tgt_pos - 1]
+            ):
+                pos -= 1
+                tgt_pos -= 1
+            length = get_common_prefix_length(src_base, pos, tgt_base, tgt_pos)
+            runs.append((pos, tgt_pos, length))
+            src_end, tgt_end = pos + length, tgt_pos + length
+            pos = src_end
+        return runs
+
+    def find_anchor(
+        self, src_base: str, src_pos: int, tgt_base: str, tgt_start: int, expected: int
+    ) -> int:
+        """
+        Find the anchor_length src characters at src_pos in tgt base, after
+        tgt_start and within max_drift characters of the expected position.
+        -1 if they are not found there, or found more than once.
+        """
+        block_end = src_pos + self.anchor_length
+        block = src_base[src_pos:block_end]
+        window_start = max(tgt_start, expected - self.max_drift)
+        window_end = min(len(tgt_base), expected + self.max_drift + self.anchor_length)
+        tgt_pos = tgt_base.find(block, window_start, window_end)
+        if tgt_pos == -1 or tgt_base.find(block, tgt_pos + 1, window_end) != -1:
+            return -1
+        return tgt_pos
+
+
+def get_common_prefix_length(src: str, src_start: int, tgt: str, tgt_start: int) -> int:
+    """
+    Length of the common prefix of src[src_start:] and tgt[tgt_start:],
+    comparing slices of doubling then halving size
+    """
+    limit = min(len(src) - src_start, len(tgt) - tgt_start)
+    length = 0
+    step = 64
+    growing = True
+    while step:
+        src_pos, src_end = src_start + length, src_start + length + step
+        tgt_pos, tgt_end = tgt_start + length, tgt_start + length + step
+        if length + step <= limit and src[src_pos:src_end] == tgt[tgt_pos:tgt_end]:
+            length += step
+            if growing:
+                step *= 2
+                continue
+        else:
+            growing = False
+        step //= 2
+    return length
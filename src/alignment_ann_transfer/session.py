@@ -0,0 +1,287 @@
+from __future__ import annotations
+
+from functools import cached_property
+from typing import TYPE_CHECKING, Dict, Iterator, List, Optional
+
+from alignment_ann_transfer import AlignmentTransfer
+from alignment_ann_transfer.bulk import BulkAlignmentTransfer
+from alignment_ann_transfer.commentary import CommentaryAlignmentTransfer
+from alignment_ann_transfer.index import AlignmentIndex
+from alignment_ann_transfer.translation import TranslationAlignmentTransfer
+
+if TYPE_CHECKING:
+    from openpecha.pecha import Pecha
+
+
+class PechaSetSession:
+    """
+    Root and root display pechas given once, with their layers and mappings
+    computed lazily and at most once.
+    The root display -> root mapping is derived from the root -> root display
+    mapping, so every output needs a single base update of the root layer.
+
+    chapter: Chapter number of the serialized segments, the pechas being the
+    chapter bases for multi-base pechas (see chapters.get_chapter_sessions).
+    """
+
+    transfer_class = AlignmentTransfer
+
+    def __init__(
+        self,
+        root_pecha: Pecha,
+        root_display_pecha: Pecha,
+        transfer: Optional[AlignmentTransfer] = None,
+        chapter: int = 1,
+    ):
+        self.root_pecha = root_pecha
+        self.root_display_pecha = root_display_pecha
+        self.transfer = transfer if transfer is not None else self.transfer_class()
+        self.chapter = chapter
+
+    @cached_property
+    def root_anns(self) -> Dict:
+        return self.transfer.get_layer_anns(self.root_pecha)
+
+    @cached_property
+    def root_display_anns(self) -> Dict:
+        return self.transfer.get_layer_anns(self.root_display_pecha)
+
+    @cached_property
+    def root_mapping(self) -> Dict[int, List]:
+        """
+        root -> root display mapping
+        """
+        return self.transfer.get_root_pechas_mapping(
+            self.root_pecha, self.root_display_pecha
+        )
+
+    @cached_property
+    def inverse_root_mapping(self) -> Dict[int, List]:
+        """
+        root display -> root mapping
+        """
+        return self.transfer.invert_mapping(
+            self.root_mapping,
+            self.transfer.get_layer_spans(self.root_pecha),
+            self.transfer.get_layer_spans(self.root_display_pecha),
+        )
+
+    def iter_row_ids(self) -> Iterator[str]:
+        """
+        Ids of the aligned rows (one per root display segment), in row order:
+        "<chapter>.<root display idx>"
+        """
+        return (f"{self.chapter}.{idx}" for idx in self.inverse_root_mapping)
+
+    def get_display_pecha(self, name: str) -> Pecha:
+        display_pecha = getattr(self, f"{name}_display_pecha")
+        if display_pecha is None:
+            raise ValueError(f"Session was created without a {name} display pecha")
+        return display_pecha
+
+
+class TranslationSession(PechaSetSession):
+    transfer: TranslationAlignmentTransfer
+    transfer_class = TranslationAlignmentTransfer
+
+    def __init__(
+        self,
+        root_pecha: Pecha,
+        root_display_pecha: Pecha,
+        translation_pecha: Pecha,
+        translation_display_pecha: Optional[Pecha] = None,
+        transfer: Optional[TranslationAlignmentTransfer] = None,
+        chapter: int = 1,
+    ):
+        super().__init__(root_pecha, root_display_pecha, transfer, chapter)
+        self.translation_pecha = translation_pecha
+        self.translation_display_pecha = translation_display_pecha
+
+    @cached_property
+    def translation_anns(self) -> Dict:
+        return self.transfer.get_layer_anns(self.translation_pecha)
+
+    @cached_property
+    def translation_display_anns(self) -> Dict:
+        return self.transfer.get_layer_anns(self.get_display_pecha("translation"))
+
+    @cached_property
+    def translation_mapping(self) -> Dict[int, List]:
+        """
+        translation display -> translation mapping
+        """
+        return self.transfer.get_translation_pechas_mapping(
+            self.translation_pecha, self.get_display_pecha("translation")
+        )
+
+    @cached_property
+    def translation_display_mapping(self) -> Dict[int, int]:
+        """
+        translation display idx -> root display idx
+        """
+        return self.transfer.compose_mappings(
+            self.translation_mapping, self.root_mapping
+        )
+
+    def get_serialized_translation(self) -> List[str]:
+        return list(self.iter_serialized_translation())
+
+    def iter_serialized_translation(self) -> Iterator[str]:
+        return self.transfer.serialize_translation(
+            self.root_mapping, self.translation_anns, self.chapter
+        )
+
+    def get_serialized_translation_display(self) -> List[str]:
+        return list(self.iter_serialized_translation_display())
+
+    def iter_serialized_translation_display(self) -> Iterator[str]:
+        return self.transfer.serialize_translation_display(
+            self.translation_display_mapping,
+            self.translation_display_anns,
+            self.chapter,
+        )
+
+    def get_aligned_translation(self) -> List[Dict]:
+        return list(self.iter_aligned_translation())
+
+    def iter_aligned_translation(self) -> Iterator[Dict]:
+        return self.transfer.align_translation(
+            self.inverse_root_mapping,
+            self.translation_anns,
+            self.root_display_anns,
+            self.root_anns,
+        )
+
+
+class CommentarySession(PechaSetSession):
+    transfer: CommentaryAlignmentTransfer
+    transfer_class = CommentaryAlignmentTransfer
+
+    def __init__(
+        self,
+        root_pecha: Pecha,
+        root_display_pecha: Pecha,
+        commentary_pecha: Pecha,
+        commentary_display_pecha: Optional[Pecha] = None,
+        transfer: Optional[CommentaryAlignmentTransfer] = None,
+        chapter: int = 1,
+    ):
+        super().__init__(root_pecha, root_display_pecha, transfer, chapter)
+        self.commentary_pecha = commentary_pecha
+        self.commentary_display_pecha = commentary_display_pecha
+
+    @cached_property
+    def commentary_anns(self) -> List[Dict]:
+        return self.transfer.get_commentary_layer_anns(self.commentary_pecha)
+
+    @cached_property
+    def commentary_display_anns(self) -> Dict:
+        return self.transfer.get_layer_anns(self.get_display_pecha("commentary"))
+
+    @cached_property
+    def commentary_mapping(self) -> Dict[int, List]:
+        """
+        commentary display -> commentary (root idx) mapping
+        """
+        return self.transfer.get_commentary_pechas_mapping(
+            self.commentary_pecha, self.get_display_pecha("commentary")
+        )
+
+    @cached_property
+    def commentary_display_mapping(self) -> Dict[int, int]:
+        """
+        commentary display idx -> root display idx
+        """
+        return self.transfer.compose_mappings(
+            self.commentary_mapping, self.root_mapping
+        )
+
+    def get_serialized_commentary(self) -> List[str]:
+        return list(self.iter_serialized_commentary())
+
+    def iter_serialized_commentary(self) -> Iterator[str]:
+        return self.transfer.serialize_commentary(
+            self.root_mapping,
+            self.commentary_anns,
+            self.root_display_anns,
+            self.root_anns,
+            self.chapter,
+        )
+
+    def get_serialized_commentary_display(self) -> List[str]:
+        return list(self.iter_serialized_commentary_display())
+
+    def iter_serialized_commentary_display(self) -> Iterator[str]:
+        return self.transfer.serialize_commentary_display(
+            self.commentary_display_mapping,
+            self.commentary_display_anns,
+            self.chapter,
+        )
+
+    def get_aligned_display_commentary(self) -> List[Dict]:
+        return list(self.iter_aligned_display_commentary())
+
+    def iter_aligned_display_commentary(self) -> Iterator[Dict]:
+        return self.transfer.align_commentary(
+            self.inverse_root_mapping,
+            self.commentary_anns,
+            self.root_display_anns,
+            self.root_anns,
+        )
+
+
+class BulkSession(PechaSetSession):
+    """
+    Root and root display pechas aligned with many translation and
+    commentary pechas (by name), sharing the root side layers and mappings.
+    """
+
+    transfer: BulkAlignmentTransfer
+    transfer_class = BulkAlignmentTransfer
+
+    def __init__(
+        self,
+        root_pecha: Pecha,
+        root_display_pecha: Pecha,
+        translation_pechas: Optional[Dict[str, Pecha]] = None,
+        commentary_pechas: Optional[Dict[str, Pecha]] = None,
+        transfer: Optional[BulkAlignmentTransfer] = None,
+        chapter: int = 1,
+    ):
+        super().__init__(root_pecha, root_display_pecha, transfer, chapter)
+        self.translation_pechas = translation_pechas or {}
+        self.commentary_pechas = commentary_pechas or {}
+
+    @cached_property
+    def translation_anns(self) -> Dict[str, Dict]:
+        return {
+            name: self.transfer.get_layer_anns(pecha)
+            for name, pecha in self.translation_pechas.items()
+        }
+
+    @cached_property
+    def commentary_anns(self) -> Dict[str, List[Dict]]:
+        return {
+            name: self.transfer.get_commentary_layer_anns(pecha)
+            for name, pecha in self.commentary_pechas.items()
+        }
+
+    def get_aligned_table(self) -> Dict[int, Dict]:
+        """
+        Get the translations and commentaries aligned to every root display
+        idx, see BulkAlignmentTransfer.align_table
+        """
+        return self.alignment_index.get_table()
+
+    @cached_property
+    def alignment_index(self) -> AlignmentIndex:
+        """
+        Alignment index of the pechas, for per-segment lookups
+        """
+        return self.transfer.build_alignment_index(
+            self.inverse_root_mapping,
+            self.root_display_anns,
+            self.root_anns,
+            self.translation_anns,
+            self.commentary_anns,
+        )
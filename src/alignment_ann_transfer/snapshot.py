@@ -0,0 +1,292 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+import tempfile
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+from alignment_ann_transfer.spans import SpanArray
+from alignment_ann_transfer.utils import iter_root_idx_anns, parse_root_indices
+
+# numpy and stam are imported on first use, see alignment_ann_transfer
+if TYPE_CHECKING:
+    import numpy as np
+
+SNAPSHOT_MAGIC = b"ALSNAP\x00\x00"
+# Bump when the snapshot layout changes, to export the snapshots again
+SNAPSHOT_VERSION = 1
+
+# Int64 arrays of a snapshot, one value per annotation (in layer order) except
+# mapping_offsets, the offsets of the interned root_idx_mapping values
+ARRAYS = [
+    "starts",
+    "ends",
+    "byte_starts",
+    "byte_ends",
+    "root_idx",
+    "mapping_ids",
+    "mapping_offsets",
+]
+
+
+def get_file_stamp(path: Path) -> List[int]:
+    stat = Path(path).stat()
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def get_byte_offsets(text: str, offsets) -> np.ndarray:
+    """
+    Convert character offsets of text to byte offsets in its UTF-8 encoding
+    """
+    import numpy as np
+
+    code_points = np.frombuffer(text.encode("utf-32-le"), dtype="<u4")
+    char_sizes = (
+        1 + (code_points >= 0x80) + (code_points >= 0x800) + (code_points >= 0x10000)
+    )
+    char_offsets = np.zeros(len(code_points) + 1, dtype=np.int64)
+    np.cumsum(char_sizes, out=char_offsets[1:])
+    return char_offsets[np.asarray(offsets, dtype=np.int64)]
+
+
+def write_layer_snapshot(
+    snapshot_path: Path,
+    layer_path: Path,
+    base_path: Path,
+    spans: List[Tuple[int, int, str]],
+):
+    """
+    Write the snapshot of a layer from the (start, end, root_idx_mapping) of
+    its annotations, atomically
+    """
+    import numpy as np
+
+    base = Path(base_path).read_text(encoding="utf-8")
+    mapping_ids: Dict[str, int] = {}
+    for _, _, root_idx_mapping in spans:
+        mapping_ids.setdefault(root_idx_mapping, len(mapping_ids))
+    encoded_mappings = [mapping.encode("utf-8") for mapping in mapping_ids]
+
+    starts = np.asarray([span[0] for span in spans], dtype=np.int64)
+    ends = np.asarray([span[1] for span in spans], dtype=np.int64)
+    mapping_offsets = np.zeros(len(encoded_mappings) + 1, dtype=np.int64)
+    np.cumsum([len(mapping) for mapping in encoded_mappings], out=mapping_offsets[1:])
+    arrays = {
+        "starts": starts,
+        "ends": ends,
+        "byte_starts": get_byte_offsets(base, starts),
+        "byte_ends": get_byte_offsets(base, ends),
+        "root_idx": [parse_root_indices(span[2]).first for span in spans],
+        "mapping_ids": [mapping_ids[span[2]] for span in spans],
+        "mapping_offsets": mapping_offsets,
+    }
+    data = [np.asarray(arrays[name], dtype="<i8").tobytes() for name in ARRAYS]
+    data.append(b"".join(encoded_mappings))
+
+    header = {
+        "version": SNAPSHOT_VERSION,
+        "count": len(spans),
+        "mappings": len(encoded_mappings),
+        "layer": get_file_stamp(layer_path),
+        "base_path": str(Path(base_path).resolve()),
+        "base": get_file_stamp(base_path),
+    }
+    header_bytes = json.dumps(header).encode("utf-8")
+    # Keep the arrays 8 bytes aligned
+    header_bytes += b" " * (-(len(SNAPSHOT_MAGIC) + 8 + len(header_bytes)) % 8)
+
+    # A temporary file of its own, as several threads or processes may export
+    # the same snapshot at once
+    snapshot_path = Path(snapshot_path)
+    fd, tmp_path = tempfile.mkstemp(
+        dir=snapshot_path.parent, prefix=f"{snapshot_path.name}.", suffix=".tmp"
+    )
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(SNAPSHOT_MAGIC)
+            f.write(struct.pack("<Q", len(header_bytes)))
+            f.write(header_bytes)
+            for chunk in data:
+                f.write(chunk)
+        os.replace(tmp_path, snapshot_path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def export_layer_snapshot(snapshot_path: Path, layer_path: Path, base_path: Path):
+    """
+    Export the snapshot of a STAM layer, its text being sliced from base_path
+    """
+    from stam import AnnotationStore
+
+    spans = []
+    layer = AnnotationStore(file=str(layer_path))
+    for ann, root_idx_mapping in iter_root_idx_anns(layer):
+        offset = ann.offset()
+        spans.append((offset.begin().value(), offset.end().value(), root_idx_mapping))
+    write_layer_snapshot(snapshot_path, layer_path, base_path, spans)
+
+
+class LayerSnapshot:
+    """
+    Compact binary snapshot of a layer, opened with mmap: its arrays are read
+    without copy and shared by every process through the page cache.
+    Holds the character and UTF-8 byte spans of the annotations in layer
+    order, their first root idx and their interned root_idx_mapping. Their
+    text is sliced from the memory mapped base file.
+    The maps are closed once the snapshot and the arrays read from it are
+    garbage collected.
+    """
+
+    def __init__(self, snapshot_path: Path):
+        import numpy as np
+
+        self.path = Path(snapshot_path)
+        with open(self.path, "rb") as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.buffer[: len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+            raise ValueError(f"{self.path} is not a layer snapshot")
+        (header_size,) = struct.unpack_from("<Q", self.buffer, len(SNAPSHOT_MAGIC))
+        offset = len(SNAPSHOT_MAGIC) + 8
+        header_end = offset + header_size
+        self.header = json.loads(self.buffer[offset:header_end])
+        offset = header_end
+
+        self.arrays: Dict[str, np.ndarray] = {}
+        for name in ARRAYS:
+            count = self.header["count"]
+            if name == "mapping_offsets":
+                count = self.header["mappings"] + 1
+            self.arrays[name] = np.frombuffer(
+                self.buffer, dtype="<i8", count=count, offset=offset
+            )
+            offset += count * 8
+        self.mappings_offset = offset
+        self.base_path = Path(self.header["base_path"])
+        self.base_buffer: Optional[mmap.mmap] = None
+
+    @property
+    def starts(self) -> np.ndarray:
+        return self.arrays["starts"]
+
+    @property
+    def ends(self) -> np.ndarray:
+        return self.arrays["ends"]
+
+    @property
+    def root_idx(self) -> np.ndarray:
+        return self.arrays["root_idx"]
+
+    def __len__(self) -> int:
+        return self.header["count"]
+
+    def is_fresh(self, layer_path: Path, base_path: Path) -> bool:
+        """
+        Check the snapshot was exported from the current layer and base files
+        """
+        return (
+            self.header["version"] == SNAPSHOT_VERSION
+            and self.header["layer"] == get_file_stamp(layer_path)
+            and self.base_path == Path(base_path).resolve()
+            and self.header["base"] == get_file_stamp(base_path)
+        )
+
+    def get_root_idx_mapping(self, pos: int) -> str:
+        mapping_id = int(self.arrays["mapping_ids"][pos])
+        mapping_offsets = self.arrays["mapping_offsets"]
+        start = self.mappings_offset + int(mapping_offsets[mapping_id])
+        end = self.mappings_offset + int(mapping_offsets[mapping_id + 1])
+        return self.buffer[start:end].decode("utf-8")
+
+    def get_text(self, pos: int) -> str:
+        if self.base_buffer is None:
+            with open(self.base_path, "rb") as f:
+                # A file of size 0 can not be memory mapped
+                if os.fstat(f.fileno()).st_size:
+                    self.base_buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            if self.base_buffer is None:
+                return ""
+        start = int(self.arrays["byte_starts"][pos])
+        end = int(self.arrays["byte_ends"][pos])
+        return self.base_buffer[start:end].decode("utf-8")
+
+    def get_anns(self, with_text: bool = True) -> Dict:
+        """
+        Get the annotations indexed by their root idx mapping, same as
+        AlignmentTransfer.extract_anns
+        """
+        starts, ends = self.starts.tolist(), self.ends.tolist()
+        anns = {}
+        for pos in range(len(self)):
+            curr_ann: Dict = {"Span": {"start": starts[pos], "end": ends[pos]}}
+            if with_text:
+                curr_ann["text"] = self.get_text(pos)
+            curr_ann["root_idx_mapping"] = int(self.get_root_idx_mapping(pos))
+            anns[curr_ann["root_idx_mapping"]] = curr_ann
+        return anns
+
+    def get_commentary_anns(self, with_text: bool = True) -> List[Dict]:
+        """
+        Get the annotations in layer order, same as
+        CommentaryAlignmentTransfer.extract_commentary_anns
+        """
+        starts, ends = self.starts.tolist(), self.ends.tolist()
+        anns = []
+        for pos in range(len(self)):
+            curr_ann: Dict = {
+                "Span": {"start": starts[pos], "end": ends[pos]},
+                "root_idx_mapping": self.get_root_idx_mapping(pos),
+            }
+            if with_text:
+                curr_ann["text"] = self.get_text(pos)
+            anns.append(curr_ann)
+        return anns
+
+    def get_spans(self, unique: bool = True) -> SpanArray:
+        """
+        Get the span array of the annotations, same as
+        AlignmentTransfer.extract_spans: without copy unless unique and some
+        annotations share a root idx
+        """
+        import numpy as np
+
+        starts, ends, root_idx = self.starts, self.ends, self.root_idx
+        if unique and len(np.unique(root_idx)) != len(root_idx):
+            # The first position of a root idx gets the span of the last one
+            _, first_pos = np.unique(root_idx, return_index=True)
+            _, last_pos = np.unique(root_idx[::-1], return_index=True)
+            last_pos = len(root_idx) - 1 - last_pos
+            order = np.argsort(first_pos, kind="stable")
+            starts = starts[last_pos[order]]
+            ends = ends[last_pos[order]]
+            root_idx = root_idx[first_pos[order]]
+        return SpanArray(starts, ends, root_idx, self.base_path)
+
+
+class LayerSnapshotStore:
+    """
+    Directory of layer snapshots, exported from the STAM layers when missing
+    or older than their layer or base file. It can be shared by every process.
+    """
+
+    def __init__(self, snapshot_dir: Path):
+        self.snapshot_dir = Path(snapshot_dir)
+        self.snapshot_dir.mkdir(parents=True, exist_ok=True)
+
+    def get_snapshot_path(self, layer_path: Path) -> Path:
+        name = hashlib.sha256(str(Path(layer_path).resolve()).encode()).hexdigest()
+        return self.snapshot_dir / f"{name[:32]}.snap"
+
+    def get(self, layer_path: Path, base_path: Path) -> LayerSnapshot:
+        snapshot_path = self.get_snapshot_path(layer_path)
+        if snapshot_path.exists():
+            snapshot = LayerSnapshot(snapshot_path)
+            if snapshot.is_fresh(layer_path, base_path):
+                return snapshot
+        export_layer_snapshot(snapshot_path, layer_path, base_path)
+        return LayerSnapshot(snapshot_path)
@@ -0,0 +1,351 @@
+from __future__ import annotations
+
+from collections import abc
+from pathlib import Path
+from typing import (
+    TYPE_CHECKING,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+from alignment_ann_transfer.stats import TransferStats
+from alignment_ann_transfer.utils import Span, parse_root_indices
+
+# numpy is imported on first use, see alignment_ann_transfer
+if TYPE_CHECKING:
+    import numpy as np
+
+
+class SpanArray:
+    """
+    Columnar annotations of a layer: starts, ends and root_idx int arrays,
+    with the text of an annotation sliced from the base only when asked for.
+    root_idx is the (first) root idx the annotation is mapped to.
+
+    base is the base text, or the path of the base file which is then only
+    read on the first get_text.
+    """
+
+    __slots__ = ("starts", "ends", "root_idx", "base")
+
+    def __init__(self, starts, ends, root_idx, base: Optional[Union[str, Path]] = None):
+        import numpy as np
+
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.ends = np.asarray(ends, dtype=np.int64)
+        self.root_idx = np.asarray(root_idx, dtype=np.int64)
+        self.base = base
+
+    @classmethod
+    def from_anns(
+        cls, anns: Iterable[Dict], base: Optional[Union[str, Path]] = None
+    ) -> "SpanArray":
+        """
+        Build from extracted annotations (extract_anns or extract_commentary_anns)
+        """
+        starts, ends, root_idx = [], [], []
+        for ann in anns:
+            starts.append(ann["Span"]["start"])
+            ends.append(ann["Span"]["end"])
+            root_idx.append(parse_root_indices(str(ann["root_idx_mapping"])).first)
+        return cls(starts, ends, root_idx, base)
+
+    def get_text(self, pos: int) -> str:
+        if self.base is None:
+            raise ValueError("Span array was extracted without its base")
+        if isinstance(self.base, Path):
+            self.base = self.base.read_text(encoding="utf-8")
+
+        start, end = int(self.starts[pos]), int(self.ends[pos])
+        return self.base[start:end]
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+
+class LayerAnns(abc.Mapping):
+    """
+    Annotations of a layer indexed by their root idx, as extract_anns gives
+    them, built from the span array of all its annotations (unique=False) only
+    when looked up: their text is sliced by get_text (SpanArray.get_text by
+    default) per annotation, so the texts of the layer are never all held.
+    """
+
+    def __init__(
+        self, spans: SpanArray, get_text: Optional[Callable[[int], str]] = None
+    ):
+        self.spans = spans
+        self.get_text = get_text or spans.get_text
+        # Same as extract_anns: layer order of the first annotation of a root
+        # idx, with the last one
+        self.positions: Dict[int, int] = {}
+        for pos, idx in enumerate(spans.root_idx.tolist()):
+            self.positions[idx] = pos
+
+    def __getitem__(self, idx: int) -> Dict:
+        pos = self.positions[idx]
+        return {
+            "Span": {
+                "start": int(self.spans.starts[pos]),
+                "end": int(self.spans.ends[pos]),
+            },
+            "text": self.get_text(pos),
+            "root_idx_mapping": idx,
+        }
+
+    def __contains__(self, idx: object) -> bool:
+        return idx in self.positions
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.positions)
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+
+class CommentaryLayerAnns(abc.Sequence):
+    """
+    Annotations of a commentary layer in layer order, as
+    extract_commentary_anns gives them, built from the span array of all its
+    annotations only when looked up (see LayerAnns)
+    """
+
+    def __init__(
+        self,
+        spans: SpanArray,
+        get_root_idx_mapping: Callable[[int], str],
+        get_text: Optional[Callable[[int], str]] = None,
+    ):
+        self.spans = spans
+        self.get_root_idx_mapping = get_root_idx_mapping
+        self.get_text = get_text or spans.get_text
+
+    def __getitem__(self, pos):
+        if not 0 <= pos < len(self):
+            raise IndexError(pos)
+        return {
+            "Span": {
+                "start": int(self.spans.starts[pos]),
+                "end": int(self.spans.ends[pos]),
+            },
+            "root_idx_mapping": self.get_root_idx_mapping(pos),
+            "text": self.get_text(pos),
+        }
+
+    def __len__(self) -> int:
+        return len(self.spans)
+
+
+class SpanIndex:
+    """
+    Span array sorted by start, with a max tree of the ends, to find the spans
+    overlapping a few other spans by binary search: the time follows the
+    number of overlaps (times the log of the number of spans) instead of the
+    number of spans.
+    """
+
+    def __init__(self, spans: SpanArray):
+        import numpy as np
+
+        self.spans = spans
+        self.order = np.argsort(spans.starts, kind="stable")
+        self.sorted_starts = spans.starts[self.order]
+
+        # end_tree[0] holds the ends in start order, end_tree[level][i] the max
+        # of end_tree[level - 1][2 * i] and end_tree[level - 1][2 * i + 1]
+        size = 1 << max(len(spans) - 1, 0).bit_length()
+        ends = np.full(size, np.iinfo(np.int64).min, dtype=np.int64)
+        ends[: len(spans)] = spans.ends[self.order]
+        self.end_tree = [ends]
+        while len(ends) > 1:
+            ends = np.maximum(ends[0::2], ends[1::2])
+            self.end_tree.append(ends)
+
+    def get_overlaps(self, start: int, end: int) -> List[int]:
+        """
+        Get the sorted positions of the spans overlapping [start, end), as in
+        get_span_overlaps: spans only touching it at an edge do not overlap
+        """
+        import numpy as np
+
+        if not len(self.spans):
+            return []
+
+        # The spans starting before end, whose end is after start
+        count = int(np.searchsorted(self.sorted_starts, end, side="left"))
+        found = []
+        nodes = [(len(self.end_tree) - 1, 0)]
+        while nodes:
+            level, i = nodes.pop()
+            if i << level >= count or self.end_tree[level][i] <= start:
+                continue
+            if level == 0:
+                found.append(i)
+            else:
+                nodes += [(level - 1, 2 * i + 1), (level - 1, 2 * i)]
+        return sorted(self.order[found].tolist())
+
+
+def get_span_overlaps(
+    src_starts: np.ndarray,
+    src_ends: np.ndarray,
+    tgt_starts: np.ndarray,
+    tgt_ends: np.ndarray,
+    stats: Optional[TransferStats] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Get the (src position, tgt position) pairs of all overlapping spans,
+    sorted by src then tgt position. Spans only touching at an edge do not
+    overlap.
+
+    Every pair is found from one side only:
+        - the targets starting inside a source are a range of the targets
+        sorted by start
+        - the sources starting inside a target, after its start, are a range
+        of the sources sorted by start
+    These ranges only hold overlapping pairs (but for empty targets at the
+    start of a source), so the time and memory follow the number of overlaps
+    however long or nested the spans are. The checked pairs are counted as
+    candidate_pairs in stats.
+    """
+    import numpy as np
+
+    src_starts, src_ends = np.asarray(src_starts), np.asarray(src_ends)
+    tgt_starts, tgt_ends = np.asarray(tgt_starts), np.asarray(tgt_ends)
+    if not len(src_starts) or not len(tgt_starts):
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty
+
+    # Targets starting in [src start, src end)
+    tgt_order = np.argsort(tgt_starts, kind="stable")
+    sorted_tgt_starts = tgt_starts[tgt_order]
+    inner_src_pos, inner_tgt_pos = get_range_pairs(
+        np.searchsorted(sorted_tgt_starts, src_starts, side="left"),
+        np.searchsorted(sorted_tgt_starts, src_ends, side="left"),
+    )
+    inner_tgt_pos = tgt_order[inner_tgt_pos]
+
+    # Sources starting in (tgt start, tgt end)
+    src_order = np.argsort(src_starts, kind="stable")
+    sorted_src_starts = src_starts[src_order]
+    outer_tgt_pos, outer_src_pos = get_range_pairs(
+        np.searchsorted(sorted_src_starts, tgt_starts, side="right"),
+        np.searchsorted(sorted_src_starts, tgt_ends, side="left"),
+    )
+    outer_src_pos = src_order[outer_src_pos]
+
+    if stats is not None:
+        stats.add("candidate_pairs", len(inner_src_pos) + len(outer_src_pos))
+
+    # An empty target at the start of a source only touches it
+    overlaps = tgt_ends[inner_tgt_pos] > src_starts[inner_src_pos]
+    src_pos = np.concatenate((inner_src_pos[overlaps], outer_src_pos))
+    tgt_pos = np.concatenate((inner_tgt_pos[overlaps], outer_tgt_pos))
+
+    pair_order = np.lexsort((tgt_pos, src_pos))
+    return src_pos[pair_order], tgt_pos[pair_order]
+
+
+def get_range_pairs(lo: np.ndarray, hi: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Get the (i, j) pairs of every j in range(lo[i], hi[i])
+    """
+    import numpy as np
+
+    counts = np.maximum(hi - lo, 0)
+    rows = np.repeat(np.arange(len(lo)), counts)
+    values = np.arange(counts.sum()) - np.repeat(
+        np.cumsum(counts) - counts - lo, counts
+    )
+    return rows, values
+
+
+def get_windowed_span_overlaps(
+    src_starts: np.ndarray,
+    src_ends: np.ndarray,
+    tgt_starts: np.ndarray,
+    tgt_ends: np.ndarray,
+    window_size: int,
+    stats: Optional[TransferStats] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Same as get_span_overlaps, the sources being checked window by window:
+    the sources starting in a window of window_size characters are only
+    checked against the targets overlapping the text they cover, so the
+    arrays of a window are bounded by its spans instead of the whole layers.
+    A target spanning several windows is checked in each of them.
+    """
+    import numpy as np
+
+    src_starts, src_ends = np.asarray(src_starts), np.asarray(src_ends)
+    tgt_starts, tgt_ends = np.asarray(tgt_starts), np.asarray(tgt_ends)
+    if not len(src_starts) or not len(tgt_starts):
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty
+
+    src_windows = src_starts // window_size
+    src_order = np.argsort(src_windows, kind="stable")
+    window_bounds = np.flatnonzero(np.diff(src_windows[src_order])) + 1
+    windows = np.split(src_order, window_bounds)
+    window_starts = np.array([src_starts[positions].min() for positions in windows])
+    window_ends = np.array([src_ends[positions].max() for positions in windows])
+
+    # Targets starting in [window start, window end)
+    tgt_order = np.argsort(tgt_starts, kind="stable")
+    sorted_tgt_starts = tgt_starts[tgt_order]
+    inner_lo = np.searchsorted(sorted_tgt_starts, window_starts, side="left")
+    inner_hi = np.searchsorted(sorted_tgt_starts, window_ends, side="left")
+
+    # Targets starting before a window start and ending after it
+    outer_tgt_pos, outer_windows = get_range_pairs(
+        np.searchsorted(window_starts, tgt_starts, side="right"),
+        np.searchsorted(window_starts, tgt_ends, side="left"),
+    )
+    outer_order = np.argsort(outer_windows, kind="stable")
+    outer_bounds = np.cumsum(np.bincount(outer_windows, minlength=len(windows)))
+    outer_tgts = np.split(outer_tgt_pos[outer_order], outer_bounds[:-1])
+
+    src_pairs, tgt_pairs = [], []
+    for positions, lo, hi, outer in zip(
+        windows, inner_lo.tolist(), inner_hi.tolist(), outer_tgts
+    ):
+        candidates = np.concatenate((outer, tgt_order[lo:hi]))
+        src_pos, tgt_pos = get_span_overlaps(
+            src_starts[positions],
+            src_ends[positions],
+            tgt_starts[candidates],
+            tgt_ends[candidates],
+            stats,
+        )
+        src_pairs.append(positions[src_pos])
+        tgt_pairs.append(candidates[tgt_pos])
+
+    src_pos, tgt_pos = np.concatenate(src_pairs), np.concatenate(tgt_pairs)
+    pair_order = np.lexsort((tgt_pos, src_pos))
+    return src_pos[pair_order], tgt_pos[pair_order]
+
+
+def get_overlapping_spans(
+    src_spans: Sequence[Span], tgt_spans: Sequence[Span]
+) -> List[List[int]]:
+    """
+    For every source span, get the positions of the target spans overlapping it
+    (in target order). Spans only touching at an edge do not overlap.
+    """
+    import numpy as np
+
+    src = np.asarray(src_spans, dtype=np.int64).reshape(-1, 2)
+    tgt = np.asarray(tgt_spans, dtype=np.int64).reshape(-1, 2)
+    src_pos, tgt_pos = get_span_overlaps(src[:, 0], src[:, 1], tgt[:, 0], tgt[:, 1])
+
+    matches: List[List[int]] = [[] for _ in range(len(src))]
+    for pos, tgt_position in zip(src_pos.tolist(), tgt_pos.tolist()):
+        matches[pos].append(tgt_position)
+    return matches
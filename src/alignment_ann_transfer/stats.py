@@ -0,0 +1,64 @@
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, Optional
+
+# Called with the stage name and its duration (seconds) when a stage ends
+StageCallback = Callable[[str, float], None]
+
+
+class TransferStats:
+    """
+    Per stage durations and counters recorded by an AlignmentTransfer
+    created with stats=TransferStats().
+
+    Stages (seconds spent, and number of runs):
+        load_layer: Loading a layer file into an AnnotationStore
+        load_snapshot: Opening (or exporting) the snapshot of a layer
+        extract_anns / extract_spans: Reading the annotations of a layer
+        base_update: Merging a layer into a pecha (merge_pecha)
+        base_update_anns: Projecting a layer to another base in memory
+        offset_table: Building the offset table of two bases (projection)
+        map_spans: Finding the overlapping spans of two layers
+        pechas_mapping: Computing a pechas mapping, including the stages above
+    Counters:
+        annotations: Annotations extracted or projected
+        bytes_read: Size of the loaded layer and snapshot files
+        candidate_pairs / matched_pairs: Span pairs checked / found overlapping
+        windows: Windows of the bases projected (window_size)
+
+    on_stage is called every time a stage ends, eg: to forward it to a
+    metrics system.
+    """
+
+    def __init__(self, on_stage: Optional[StageCallback] = None):
+        self.on_stage = on_stage
+        self.durations: Dict[str, float] = {}
+        self.calls: Dict[str, int] = {}
+        self.counters: Dict[str, int] = {}
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start_time
+            self.durations[name] = self.durations.get(name, 0.0) + duration
+            self.calls[name] = self.calls.get(name, 0) + 1
+            if self.on_stage is not None:
+                self.on_stage(name, duration)
+
+    def add(self, name: str, value: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def reset(self):
+        self.durations.clear()
+        self.calls.clear()
+        self.counters.clear()
+
+    def as_dict(self) -> Dict:
+        return {
+            "durations": dict(self.durations),
+            "calls": dict(self.calls),
+            "counters": dict(self.counters),
+        }
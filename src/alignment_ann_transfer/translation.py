@@ -1,10 +1,12 @@
-from typing import Dict, List
+from __future__ import annotations
 
-from openpecha.pecha import Pecha
-from stam import AnnotationStore
+from typing import TYPE_CHECKING, Dict, Iterator, List, Mapping
 
 from alignment_ann_transfer import AlignmentTransfer
 
+if TYPE_CHECKING:
+    from openpecha.pecha import Pecha
+
 
 class TranslationAlignmentTransfer(AlignmentTransfer):
     def get_translation_pechas_mapping(
@@ -13,39 +15,72 @@ class TranslationAlignmentTransfer(AlignmentTransfer):
         """
         Get Segmentation mapping from translation display pecha -> translation pecha
         """
-        display_layer_path = self.get_first_layer_path(translation_pecha)
-        new_tgt_layer_path = self.base_update(
-            translation_display_pecha, translation_pecha
+        return self.get_cached_mapping(
+            "translation_pechas_mapping",
+            self.get_pecha_files(translation_display_pecha)
+            + self.get_pecha_files(translation_pecha),
+            lambda: self.compute_pechas_mapping(
+                translation_display_pecha, translation_pecha
+            ),
         )
 
-        display_layer = AnnotationStore(file=str(display_layer_path))
-        transfer_layer = AnnotationStore(file=str(new_tgt_layer_path))
-
-        map = self.map_layer_to_layer(transfer_layer, display_layer)
+    def iter_translation_chapters(
+        self, method: str, pechas: Dict[str, Pecha]
+    ) -> Iterator:
+        """
+        Yield the output of a TranslationSession method for every chapter of
+        multi-base pechas
+        """
+        from alignment_ann_transfer.session import TranslationSession
 
-        # Clean up the layer
-        new_tgt_layer_path.unlink()
-        return map
+        return self.iter_chapter_outputs(TranslationSession, method, pechas)
 
     def get_serialized_translation(
         self, root_pecha: Pecha, root_display_pecha: Pecha, translation_pecha: Pecha
-    ):
+    ) -> List[str]:
         """
         Input: map from transfer_layer -> display_layer (One to Many)
         Structure in a way such as : <chapter number><display idx>translation text
         Note: From many relation in display layer, take first idx (Sefaria map limitation)
         """
-        map = self.get_root_pechas_mapping(root_pecha, root_display_pecha)
-        layer_path = next(translation_pecha.layer_path.rglob("*.json"))
+        return list(
+            self.iter_serialized_translation(
+                root_pecha, root_display_pecha, translation_pecha
+            )
+        )
 
-        anns = self.extract_anns(AnnotationStore(file=str(layer_path)))
+    def iter_serialized_translation(
+        self, root_pecha: Pecha, root_display_pecha: Pecha, translation_pecha: Pecha
+    ) -> Iterator[str]:
+        """
+        Yield the segments of get_serialized_translation one by one
+        """
+        if self.has_chapters(root_pecha, root_display_pecha, translation_pecha):
+            yield from self.iter_translation_chapters(
+                "iter_serialized_translation",
+                {
+                    "root_pecha": root_pecha,
+                    "root_display_pecha": root_display_pecha,
+                    "translation_pecha": translation_pecha,
+                },
+            )
+            return
+        yield from self.serialize_translation(
+            self.get_root_pechas_mapping(root_pecha, root_display_pecha),
+            self.get_lazy_layer_anns(translation_pecha),
+        )
 
-        segments = []
+    def serialize_translation(
+        self, map: Dict[int, List], anns: Mapping[int, Dict], chapter: int = 1
+    ) -> Iterator[str]:
+        """
+        Serialize the translation anns of a chapter with the root -> root
+        display mapping
+        """
         for idx, display_map in map.items():
             translation_text = anns[idx]["text"]
             display_idx = display_map[0][0]
-            segments.append(f"<1><{display_idx}>{translation_text}")
-        return segments
+            yield f"<{chapter}><{display_idx}>{translation_text}"
 
     def get_serialized_translation_display(
         self,
@@ -53,48 +88,107 @@ class TranslationAlignmentTransfer(AlignmentTransfer):
         root_display_pecha: Pecha,
         translation_pecha: Pecha,
         translation_display_pecha: Pecha,
-    ):
+    ) -> List[str]:
         """
         Input: map from transfer_layer -> display_layer (One to Many)
         Structure in a way such as : <chapter number><display idx>translation text
         Note: From many relation in display layer, take first idx (Sefaria map limitation)
         """
+        return list(
+            self.iter_serialized_translation_display(
+                root_pecha,
+                root_display_pecha,
+                translation_pecha,
+                translation_display_pecha,
+            )
+        )
+
+    def iter_serialized_translation_display(
+        self,
+        root_pecha: Pecha,
+        root_display_pecha: Pecha,
+        translation_pecha: Pecha,
+        translation_display_pecha: Pecha,
+    ) -> Iterator[str]:
+        """
+        Yield the segments of get_serialized_translation_display one by one
+        """
+        if self.has_chapters(
+            root_pecha, root_display_pecha, translation_pecha, translation_display_pecha
+        ):
+            yield from self.iter_translation_chapters(
+                "iter_serialized_translation_display",
+                {
+                    "root_pecha": root_pecha,
+                    "root_display_pecha": root_display_pecha,
+                    "translation_pecha": translation_pecha,
+                    "translation_display_pecha": translation_display_pecha,
+                },
+            )
+            return
         root_map = self.get_root_pechas_mapping(root_pecha, root_display_pecha)
         translation_map = self.get_translation_pechas_mapping(
             translation_pecha, translation_display_pecha
         )
+        yield from self.serialize_translation_display(
+            self.compose_mappings(translation_map, root_map),
+            self.get_lazy_layer_anns(translation_display_pecha),
+        )
 
-        layer_path = next(translation_display_pecha.layer_path.rglob("*.json"))
-
-        anns = self.extract_anns(AnnotationStore(file=str(layer_path)))
-
-        segments = []
-        for src_idx, tgt_map in translation_map.items():
+    def serialize_translation_display(
+        self, display_map: Dict[int, int], anns: Mapping[int, Dict], chapter: int = 1
+    ) -> Iterator[str]:
+        """
+        Serialize the translation display anns of a chapter with the composed
+        translation display -> root display mapping
+        """
+        for src_idx, root_display_idx in display_map.items():
             translation_text = anns[src_idx]["text"]
-            tgt_idx = tgt_map[0][0]
-
-            root_idx = root_map[tgt_idx][0][0]
-            segments.append(f"<1><{root_idx}>{translation_text}")
-        return segments
+            yield f"<{chapter}><{root_display_idx}>{translation_text}"
 
     def get_aligned_translation(
         self, root_pecha: Pecha, root_display_pecha: Pecha, translation_pecha: Pecha
     ) -> List[Dict]:
-        root_map = self.get_root_pechas_mapping(root_display_pecha, root_pecha)
-
-        layer_path = next(translation_pecha.layer_path.rglob("*.json"))
-        translation_anns = self.extract_anns(AnnotationStore(file=str(layer_path)))
-
-        root_display_layer_path = next(root_display_pecha.layer_path.rglob("*.json"))
-        root_display_anns = self.extract_anns(
-            AnnotationStore(file=str(root_display_layer_path))
+        return list(
+            self.iter_aligned_translation(
+                root_pecha, root_display_pecha, translation_pecha
+            )
         )
 
-        root_layer_path = next(root_pecha.layer_path.rglob("*.json"))
-        root_anns = self.extract_anns(AnnotationStore(file=str(root_layer_path)))
-
-        aligned_segments = []
+    def iter_aligned_translation(
+        self, root_pecha: Pecha, root_display_pecha: Pecha, translation_pecha: Pecha
+    ) -> Iterator[Dict]:
+        """
+        Yield the aligned segments of get_aligned_translation one by one
+        """
+        if self.has_chapters(root_pecha, root_display_pecha, translation_pecha):
+            yield from self.iter_translation_chapters(
+                "iter_aligned_translation",
+                {
+                    "root_pecha": root_pecha,
+                    "root_display_pecha": root_display_pecha,
+                    "translation_pecha": translation_pecha,
+                },
+            )
+            return
+        yield from self.align_translation(
+            self.get_inverse_root_pechas_mapping(root_pecha, root_display_pecha),
+            self.get_lazy_layer_anns(translation_pecha),
+            self.get_lazy_layer_anns(root_display_pecha),
+            self.get_lazy_layer_anns(root_pecha),
+        )
 
+    def align_translation(
+        self,
+        root_map: Dict[int, List],
+        translation_anns: Mapping[int, Dict],
+        root_display_anns: Mapping[int, Dict],
+        root_anns: Mapping[int, Dict],
+    ) -> Iterator[Dict]:
+        """
+        Align the translation anns to the root display anns with the
+        root display -> root mapping
+        """
         for root_display_idx, map in root_map.items():
             root_display_text = root_display_anns[root_display_idx]["text"]
             if not map:
@@ -116,10 +210,7 @@ class TranslationAlignmentTransfer(AlignmentTransfer):
                     translation_text = translation_anns[root_idx]["text"]
                     translation_texts.append(translation_text)
 
-            aligned_segments.append(
-                {
-                    "root_display_text": root_display_text,
-                    "translation_text": translation_texts,
-                }
-            )
-        return aligned_segments
+            yield {
+                "root_display_text": root_display_text,
+                "translation_text": translation_texts,
+            }
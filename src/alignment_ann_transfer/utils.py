@@ -1,15 +1,121 @@
-from typing import List
+from __future__ import annotations
+
+from bisect import bisect_right
+from functools import lru_cache
+from typing import TYPE_CHECKING, Dict, Iterator, List, Sequence, Tuple
+
+if TYPE_CHECKING:
+    from stam import Annotation, AnnotationStore, DataKey
+
+Span = Tuple[int, int]
+
+
+class RootIndices:
+    """
+    Root indices of a root_idx_mapping (eg: "1-3,5") stored as sorted and
+    merged inclusive (start, end) intervals
+    """
+
+    __slots__ = ("starts", "ends")
+
+    def __init__(self, intervals: Sequence[Span]):
+        self.starts: List[int] = []
+        self.ends: List[int] = []
+        for start, end in sorted(intervals):
+            if start > end:
+                continue
+            if self.ends and start <= self.ends[-1] + 1:
+                self.ends[-1] = max(self.ends[-1], end)
+            else:
+                self.starts.append(start)
+                self.ends.append(end)
+
+    @property
+    def first(self) -> int:
+        if not self.starts:
+            raise IndexError("root idx mapping has no index")
+        return self.starts[0]
+
+    @property
+    def intervals(self) -> List[Span]:
+        return list(zip(self.starts, self.ends))
+
+    def __contains__(self, idx: int) -> bool:
+        pos = bisect_right(self.starts, idx) - 1
+        return pos >= 0 and idx <= self.ends[pos]
+
+    def __iter__(self) -> Iterator[int]:
+        for start, end in zip(self.starts, self.ends):
+            yield from range(start, end + 1)
+
+    def __len__(self) -> int:
+        return sum(end - start + 1 for start, end in zip(self.starts, self.ends))
+
+    def __repr__(self) -> str:
+        return f"RootIndices({self.intervals})"
+
+
+@lru_cache(maxsize=65536)
+def parse_root_indices(mapping: str) -> RootIndices:
+    """
+    Parse a root_idx_mapping, memoized per distinct mapping string.
+    The returned RootIndices is shared and should not be modified.
+    """
+    intervals = []
+    for map in mapping.strip().split(","):
+        map = map.strip()
+        if "-" in map:
+            start, end = map.split("-")
+            intervals.append((int(start), int(end)))
+        else:
+            intervals.append((int(map), int(map)))
+    return RootIndices(intervals)
 
 
 def parse_root_mapping(mapping: str) -> List[int]:
-    res = []
+    """
+    Get the sorted root indices of a root_idx_mapping, an index listed several
+    times being repeated (eg: "1-3,2" -> [1, 2, 2, 3]). parse_root_indices
+    gives them merged without the expansion.
+    """
+    res: List[int] = []
     for map in mapping.strip().split(","):
         map = map.strip()
         if "-" in map:
             start, end = map.split("-")
-            res.extend(list(range(int(start), int(end) + 1)))
+            res.extend(range(int(start), int(end) + 1))
         else:
             res.append(int(map))
 
     res.sort()
     return res
+
+
+def get_root_idx_key(layer: AnnotationStore) -> DataKey:
+    """
+    Get the root_idx_mapping key of a layer(STAM), whatever its annotation set
+    """
+    for dataset in layer.datasets():
+        for key in dataset.keys():
+            if key.id() == "root_idx_mapping":
+                return key
+    raise KeyError("root_idx_mapping")
+
+
+def iter_root_idx_anns(layer: AnnotationStore) -> Iterator[Tuple[Annotation, str]]:
+    """
+    Yield the annotations of a layer(STAM) in layer order with their
+    root_idx_mapping, read in bulk from the data of the root_idx_mapping key:
+    the other keys of the annotations (eg: Structure_Type) are never read.
+    """
+    key = get_root_idx_key(layer)
+    if key.annotations_count() != layer.annotations_len():
+        raise KeyError("root_idx_mapping")
+
+    root_idx_mappings: Dict[Annotation, str] = {}
+    for data in key.data():
+        root_idx_mapping = str(data.value())
+        for ann in data.annotations():
+            root_idx_mappings[ann] = root_idx_mapping
+    for ann in key.annotations():
+        yield ann, root_idx_mappings[ann]
@@ -0,0 +1,129 @@
+"""
+Windowed base update of very large bases: the src and tgt bases are cut into
+windows of about window_size characters at anchors (blocks of characters found
+once in both bases, see AnchoredProjection.find_anchor), and the annotation
+offsets of every window are projected with an offset table of that window
+only. An annotation crossing a cut has its start and end projected by their
+own windows.
+
+The diffs are bounded by the window size, and the windows can be projected by
+several processes. The transferred spans are then mapped to the tgt spans of
+their window (see AlignmentTransfer.map_windowed_span_arrays), but the bases
+and the layer span arrays are still held whole. A window grows until an anchor is
+found, so bases with no common block of anchor_length characters for long
+stretches give larger windows.
+"""
+from __future__ import annotations
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import TYPE_CHECKING, Deque, Iterator, List, Tuple
+
+from alignment_ann_transfer.projection import AnchoredProjection, DiffProjection
+
+# numpy is imported on first use, see alignment_ann_transfer
+if TYPE_CHECKING:
+    from concurrent.futures import Future
+
+    import numpy as np
+
+# (src start, src end, tgt start, tgt end) of a window of the bases
+Window = Tuple[int, int, int, int]
+
+
+def get_windows(
+    src_base: str,
+    tgt_base: str,
+    window_size: int,
+    anchor_length: int = 32,
+    max_drift: int = 1000,
+) -> List[Window]:
+    """
+    Cut the bases into windows of at least window_size src characters, at
+    anchors found in both bases
+    """
+    anchors = AnchoredProjection(anchor_length, max_drift)
+    windows: List[Window] = []
+    src_start = tgt_start = 0
+    pos = window_size
+    while pos + anchor_length <= len(src_base):
+        expected = tgt_start + pos - src_start
+        tgt_pos = anchors.find_anchor(src_base, pos, tgt_base, tgt_start, expected)
+        if tgt_pos == -1:
+            pos += anchor_length
+            continue
+        windows.append((src_start, pos, tgt_start, tgt_pos))
+        src_start, tgt_start = pos, tgt_pos
+        pos += window_size
+    windows.append((src_start, len(src_base), tgt_start, len(tgt_base)))
+    return windows
+
+
+def project_window(
+    projection: DiffProjection,
+    src_text: str,
+    tgt_text: str,
+    src_start: int,
+    tgt_start: int,
+    offsets: np.ndarray,
+) -> np.ndarray:
+    """
+    Project the src offsets of a window, in a worker process or not
+    """
+    offset_table = projection.get_offset_table(src_text, tgt_text)
+    return offset_table.project(offsets - src_start) + tgt_start
+
+
+def project_windows(
+    projection: DiffProjection,
+    src_base: str,
+    tgt_base: str,
+    windows: List[Window],
+    offsets,
+    max_processes: int = 1,
+) -> np.ndarray:
+    """
+    Project src offsets (int array) to tgt offsets window by window, with up
+    to max_processes processes. At most two windows per process are waiting
+    to be projected, so the base slices sent to the processes stay bounded.
+    """
+    import numpy as np
+
+    offsets = np.asarray(offsets, dtype=np.int64)
+    order = np.argsort(offsets, kind="stable")
+    sorted_offsets = offsets[order]
+    # The offsets of the i-th window end at sorted_offsets[window_ends[i]], the
+    # end of the src base being in the last window
+    window_starts = np.searchsorted(sorted_offsets, [window[0] for window in windows])
+    window_ends = [*window_starts.tolist()[1:], len(offsets)]
+    projected = np.empty_like(offsets)
+
+    def iter_window_args() -> Iterator[Tuple]:
+        first = 0
+        for (src_start, src_end, tgt_start, tgt_end), last in zip(windows, window_ends):
+            if last > first:
+                yield order[first:last], (
+                    projection,
+                    src_base[src_start:src_end],
+                    tgt_base[tgt_start:tgt_end],
+                    src_start,
+                    tgt_start,
+                    sorted_offsets[first:last],
+                )
+            first = last
+
+    if max_processes == 1:
+        for positions, args in iter_window_args():
+            projected[positions] = project_window(*args)
+        return projected
+
+    with ProcessPoolExecutor(max_workers=max_processes) as executor:
+        pending: Deque[Tuple[np.ndarray, Future]] = deque()
+        for positions, args in iter_window_args():
+            pending.append((positions, executor.submit(project_window, *args)))
+            if len(pending) >= 2 * max_processes:
+                positions, future = pending.popleft()
+                projected[positions] = future.result()
+        for positions, future in pending:
+            projected[positions] = future.result()
+    return projected
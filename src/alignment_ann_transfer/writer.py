@@ -0,0 +1,36 @@
+import json
+import textwrap
+from typing import IO, Any, Iterable, Optional
+
+
+def write_json_array(items: Iterable[Any], fp: IO[str], indent: Optional[int] = None):
+    """
+    Write items as a json array, encoding and writing one item at a time so the
+    whole output is never held in memory. The output is the same as
+    json.dump(list(items), fp, ensure_ascii=False, indent=indent).
+    """
+    if indent is None:
+        first_separator, separator, prefix = "", ", ", ""
+    else:
+        first_separator, separator, prefix = "\n", ",\n", " " * indent
+
+    fp.write("[")
+    is_empty = True
+    for item in items:
+        encoded = json.dumps(item, ensure_ascii=False, indent=indent)
+        fp.write(first_separator if is_empty else separator)
+        fp.write(textwrap.indent(encoded, prefix) if prefix else encoded)
+        is_empty = False
+
+    if not is_empty and indent is not None:
+        fp.write("\n")
+    fp.write("]")
+
+
+def write_json_lines(items: Iterable[Any], fp: IO[str]):
+    """
+    Write items as json lines, one encoded item per line
+    """
+    for item in items:
+        fp.write(json.dumps(item, ensure_ascii=False))
+        fp.write("\n")
@@ -32,6 +32,23 @@ class TestCommentaryAlignmentTransfer(TestCase):
         expected_mapping = read_json(DATA_DIR / "commentary_pechas_mapping.json")
         assert {str(k): v for k, v in mapping.items()} == expected_mapping
 
+    def test_get_pechas_mapping_in_memory(self):
+        commentary_transfer = CommentaryAlignmentTransfer(in_memory=True)
+        layer_files = set(self.root_display_pecha.layer_path.rglob("*.json"))
+        root_mapping = commentary_transfer.get_root_pechas_mapping(
+            self.root_pecha, self.root_display_pecha
+        )
+        commentary_mapping = commentary_transfer.get_commentary_pechas_mapping(
+            self.commentary_pecha, self.commentary_display_pecha
+        )
+        assert {str(k): v for k, v in root_mapping.items()} == read_json(
+            DATA_DIR / "root_pechas_mapping.json"
+        )
+        assert {str(k): v for k, v in commentary_mapping.items()} == read_json(
+            DATA_DIR / "commentary_pechas_mapping.json"
+        )
+        assert set(self.root_display_pecha.layer_path.rglob("*.json")) == layer_files
+
     def test_get_serialized_commentary(self):
         commentary_transfer = CommentaryAlignmentTransfer()
         serialized_json = commentary_transfer.get_serialized_commentary(
@@ -61,6 +78,18 @@ class TestCommentaryAlignmentTransfer(TestCase):
         expected_aligned_commentary = read_json(DATA_DIR / "aligned_commentary.json")
         assert aligned_commentary == expected_aligned_commentary
 
+    def test_streamed_outputs_do_not_cache_texts(self):
+        commentary_transfer = CommentaryAlignmentTransfer()
+        segments = commentary_transfer.iter_aligned_display_commentary(
+            self.root_pecha, self.root_display_pecha, self.commentary_pecha
+        )
+        first_segment = next(segments)
+
+        cached = {name for name, _ in commentary_transfer.cache.entries}
+        assert not cached & {"anns", "commentary_anns"}
+        expected_aligned_commentary = read_json(DATA_DIR / "aligned_commentary.json")
+        assert [first_segment, *segments] == expected_aligned_commentary
+
 
 work = TestCommentaryAlignmentTransfer()
 work.setUp()
@@ -0,0 +1,105 @@
+import asyncio
+from pathlib import Path
+from unittest import TestCase, mock
+
+from openpecha.pecha import Pecha
+from openpecha.utils import read_json
+
+from alignment_ann_transfer.async_transfer import (
+    AsyncCommentaryAlignmentTransfer,
+    AsyncTranslationAlignmentTransfer,
+)
+from alignment_ann_transfer.translation import TranslationAlignmentTransfer
+
+TESTS_DIR = Path(__file__).parent
+TRANSLATION_DATA_DIR = TESTS_DIR / "translation" / "data"
+COMMENTARY_DATA_DIR = TESTS_DIR / "commentary" / "data"
+
+
+class TestAsyncTranslationAlignmentTransfer(TestCase):
+    def setUp(self):
+        self.root_pecha = Pecha.from_path(TRANSLATION_DATA_DIR / "P2/I73078576")
+        self.root_display_pecha = Pecha.from_path(TRANSLATION_DATA_DIR / "P1/I15C4AA72")
+        self.translation_pecha = Pecha.from_path(TRANSLATION_DATA_DIR / "P3/I4FA57826")
+        self.translation_display_pecha = Pecha.from_path(
+            TRANSLATION_DATA_DIR / "P4/I18FD6864"
+        )
+
+    def test_outputs(self):
+        async def get_outputs():
+            async with AsyncTranslationAlignmentTransfer(max_processes=2) as transfer:
+                return await asyncio.gather(
+                    transfer.get_serialized_translation(
+                        self.root_pecha, self.root_display_pecha, self.translation_pecha
+                    ),
+                    transfer.get_serialized_translation_display(
+                        self.root_pecha,
+                        self.root_display_pecha,
+                        self.translation_pecha,
+                        self.translation_display_pecha,
+                    ),
+                    transfer.get_aligned_translation(
+                        self.root_pecha, self.root_display_pecha, self.translation_pecha
+                    ),
+                )
+
+        outputs = asyncio.run(get_outputs())
+
+        assert outputs == [
+            read_json(TRANSLATION_DATA_DIR / "serialized_translation.json"),
+            read_json(TRANSLATION_DATA_DIR / "serialized_translation_display.json"),
+            read_json(TRANSLATION_DATA_DIR / "aligned_translation.json"),
+        ]
+
+    def test_concurrent_requests_are_coalesced(self):
+        async def get_mappings(transfer):
+            return await asyncio.gather(
+                *[
+                    get_mapping(self.root_pecha, self.root_display_pecha)
+                    for _ in range(5)
+                    for get_mapping in (
+                        transfer.get_root_pechas_mapping,
+                        transfer.get_inverse_root_pechas_mapping,
+                    )
+                ]
+            )
+
+        async def run():
+            async with AsyncTranslationAlignmentTransfer(max_processes=1) as transfer:
+                with mock.patch.object(
+                    transfer, "run_in_process", wraps=transfer.run_in_process
+                ) as run_in_process:
+                    mappings = await get_mappings(transfer)
+                    assert run_in_process.call_count == 2
+                    assert not transfer.in_flight
+            return mappings
+
+        mappings = asyncio.run(run())
+
+        expected_mapping = read_json(TRANSLATION_DATA_DIR / "root_pechas_mapping.json")
+        expected_inverse_mapping = (
+            TranslationAlignmentTransfer().get_inverse_root_pechas_mapping(
+                self.root_pecha, self.root_display_pecha
+            )
+        )
+        for mapping in mappings[0::2]:
+            assert {str(k): v for k, v in mapping.items()} == expected_mapping
+        for mapping in mappings[1::2]:
+            assert mapping == expected_inverse_mapping
+
+
+class TestAsyncCommentaryAlignmentTransfer(TestCase):
+    def test_aligned_display_commentary(self):
+        async def get_aligned_commentary():
+            async with AsyncCommentaryAlignmentTransfer(max_processes=1) as transfer:
+                return await transfer.get_aligned_display_commentary(
+                    Pecha.from_path(COMMENTARY_DATA_DIR / "P2/IC7760088"),
+                    Pecha.from_path(COMMENTARY_DATA_DIR / "P1/IA6E66F92"),
+                    Pecha.from_path(COMMENTARY_DATA_DIR / "P3/I77BD6EA9"),
+                )
+
+        aligned_commentary = asyncio.run(get_aligned_commentary())
+
+        assert aligned_commentary == read_json(
+            COMMENTARY_DATA_DIR / "aligned_commentary.json"
+        )
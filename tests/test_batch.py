@@ -0,0 +1,139 @@
+import json
+import shutil
+import signal
+import tempfile
+import time
+from pathlib import Path
+from unittest import TestCase, mock
+
+from openpecha.utils import read_json
+
+from alignment_ann_transfer import batch, chapters
+from alignment_ann_transfer.batch import run_batch
+from alignment_ann_transfer.chapters import get_chapter_sessions
+from alignment_ann_transfer.delta import apply_delta
+
+TESTS_DIR = Path(__file__).parent
+TRANSLATION_DATA_DIR = TESTS_DIR / "translation" / "data"
+COMMENTARY_DATA_DIR = TESTS_DIR / "commentary" / "data"
+
+
+def get_stuck_sessions(session_class, pechas, transfer):
+    """
+    Hang the job of the stuck pecha set as if in native code: the SIGALRM of
+    its timeout is never handled
+    """
+    if any("stuck" in str(pecha.pecha_path) for pecha in pechas.values()):
+        signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGALRM})
+        time.sleep(60)
+    return get_chapter_sessions(session_class, pechas, transfer)
+
+
+class TestRunBatch(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.output_dir = Path(self.tmp_dir.name) / "output"
+        self.manifest_path = Path(self.tmp_dir.name) / "manifest.json"
+        jobs = [
+            {
+                "id": "translation",
+                "type": "translation",
+                "root": str(TRANSLATION_DATA_DIR / "P2/I73078576"),
+                "root_display": str(TRANSLATION_DATA_DIR / "P1/I15C4AA72"),
+                "translation": str(TRANSLATION_DATA_DIR / "P3/I4FA57826"),
+                "translation_display": str(TRANSLATION_DATA_DIR / "P4/I18FD6864"),
+            },
+            {
+                "id": "commentary",
+                "type": "commentary",
+                "root": str(COMMENTARY_DATA_DIR / "P2/IC7760088"),
+                "root_display": str(COMMENTARY_DATA_DIR / "P1/IA6E66F92"),
+                "commentary": str(COMMENTARY_DATA_DIR / "P3/I77BD6EA9"),
+            },
+            {
+                "id": "missing",
+                "type": "translation",
+                "root": "missing/root",
+                "root_display": "missing/root_display",
+                "translation": "missing/translation",
+            },
+        ]
+        self.manifest_path.write_text(json.dumps(jobs))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_run_batch(self):
+        results = run_batch(self.manifest_path, self.output_dir, workers=2)
+        results = {result["id"]: result for result in results}
+
+        assert results["translation"]["status"] == "ok"
+        assert results["commentary"]["status"] == "ok"
+        assert results["missing"]["status"] == "error"
+        results_lines = (self.output_dir / "results.jsonl").read_text().splitlines()
+        assert len(results_lines) == 3
+
+        expected_outputs = {
+            "translation/serialized_translation.json": TRANSLATION_DATA_DIR
+            / "serialized_translation.json",
+            "translation/serialized_translation_display.json": TRANSLATION_DATA_DIR
+            / "serialized_translation_display.json",
+            "translation/aligned_translation.json": TRANSLATION_DATA_DIR
+            / "aligned_translation.json",
+            "commentary/serialized_commentary.json": COMMENTARY_DATA_DIR
+            / "serialized_commentary.json",
+            "commentary/aligned_commentary.json": COMMENTARY_DATA_DIR
+            / "aligned_commentary.json",
+        }
+        for output, expected_output in expected_outputs.items():
+            assert read_json(self.output_dir / output) == read_json(expected_output)
+        assert not (
+            self.output_dir / "commentary/serialized_commentary_display.json"
+        ).exists()
+
+    def test_delta(self):
+        run_batch(self.manifest_path, self.output_dir, workers=2, delta=True)
+
+        job_dir = self.output_dir / "translation"
+        manifest = read_json(job_dir / "manifest.json")
+        expected = read_json(TRANSLATION_DATA_DIR / "serialized_translation.json")
+        assert manifest["serialized_translation"]["added"] == len(expected)
+        delta = read_json(job_dir / "serialized_translation.delta.json")
+        assert list(apply_delta({}, delta).values()) == expected
+        assert not (job_dir / "serialized_translation.json").exists()
+        # Aligned rows are keyed by root display idx
+        delta = read_json(job_dir / "aligned_translation.delta.json")
+        expected = read_json(TRANSLATION_DATA_DIR / "aligned_translation.json")
+        assert list(delta["added"]) == [f"1.{idx}" for idx in range(1, 11)]
+        assert list(apply_delta({}, delta).values()) == expected
+
+        run_batch(self.manifest_path, self.output_dir, workers=2, delta=True)
+
+        manifest = read_json(job_dir / "manifest.json")
+        for entry in manifest.values():
+            assert entry["previous_digest"] == entry["digest"]
+            assert entry["added"] == entry["changed"] == entry["removed"] == 0
+
+    def test_stuck_job(self):
+        jobs = json.loads(self.manifest_path.read_text())
+        stuck_job = {**jobs[0], "id": "stuck"}
+        stuck_job["root"] = shutil.copytree(
+            stuck_job["root"], Path(self.tmp_dir.name) / "stuck" / "root"
+        )
+        self.manifest_path.write_text(json.dumps([stuck_job, *jobs], default=str))
+
+        start_time = time.monotonic()
+        # Workers are forked with the patched sessions
+        with mock.patch.object(
+            chapters, "get_chapter_sessions", get_stuck_sessions
+        ), mock.patch.object(batch, "TIMEOUT_GRACE", 0.5):
+            results = run_batch(
+                self.manifest_path, self.output_dir, workers=2, timeout=5
+            )
+        results = {result["id"]: result for result in results}
+
+        assert time.monotonic() - start_time < 30
+        assert results["stuck"]["status"] == "error"
+        assert "TimeoutError" in results["stuck"]["error"]
+        assert results["translation"]["status"] == "ok"
+        assert results["commentary"]["status"] == "ok"
@@ -0,0 +1,65 @@
+import os
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+from alignment_ann_transfer.cache import LayerCache
+
+
+class TestLayerCache(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.layer_path = Path(self.tmp_dir.name) / "layer.json"
+        self.layer_path.write_text("{}")
+        self.calls = 0
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def compute(self):
+        self.calls += 1
+        return self.calls
+
+    def test_value_is_computed_once(self):
+        cache = LayerCache()
+        assert cache.get_or_compute("anns", [self.layer_path], self.compute) == 1
+        assert cache.get_or_compute("anns", [self.layer_path], self.compute) == 1
+        assert cache.get_or_compute("other", [self.layer_path], self.compute) == 2
+
+    def test_value_is_recomputed_when_file_changes(self):
+        cache = LayerCache()
+        cache.get_or_compute("anns", [self.layer_path], self.compute)
+
+        self.layer_path.write_text('{"id": "changed"}')
+        stat = self.layer_path.stat()
+        os.utime(self.layer_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+        assert cache.get_or_compute("anns", [self.layer_path], self.compute) == 2
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = LayerCache(maxsize=2)
+        cache.get_or_compute("a", [self.layer_path], self.compute)
+        cache.get_or_compute("b", [self.layer_path], self.compute)
+        cache.get_or_compute("a", [self.layer_path], self.compute)
+        cache.get_or_compute("c", [self.layer_path], self.compute)
+
+        assert len(cache) == 2
+        assert cache.get_or_compute("a", [self.layer_path], self.compute) == 1
+        assert cache.get_or_compute("b", [self.layer_path], self.compute) == 4
+
+    def test_set(self):
+        cache = LayerCache()
+        cache.set("anns", [self.layer_path], 10)
+        assert cache.get_or_compute("anns", [self.layer_path], self.compute) == 10
+
+        self.layer_path.write_text('{"changed": true}')
+        assert cache.get_or_compute("anns", [self.layer_path], self.compute) == 1
+
+    def test_invalidate(self):
+        cache = LayerCache()
+        cache.get_or_compute("anns", [self.layer_path], self.compute)
+
+        cache.invalidate(Path(self.tmp_dir.name))
+
+        assert len(cache) == 0
+        assert cache.get_or_compute("anns", [self.layer_path], self.compute) == 2
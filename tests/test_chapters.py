@@ -0,0 +1,176 @@
+import asyncio
+import json
+import shutil
+import tempfile
+from pathlib import Path
+from unittest import TestCase, mock
+
+from openpecha.pecha import Pecha
+from openpecha.utils import read_json
+
+from alignment_ann_transfer.async_transfer import AsyncTranslationAlignmentTransfer
+from alignment_ann_transfer.chapters import (
+    get_chapter_outputs,
+    get_chapter_sessions,
+    get_pecha_chapters,
+)
+from alignment_ann_transfer.session import TranslationSession
+from alignment_ann_transfer.translation import TranslationAlignmentTransfer
+
+TESTS_DIR = Path(__file__).parent
+TRANSLATION_DATA_DIR = TESTS_DIR / "translation" / "data"
+
+
+def copy_with_second_chapter(
+    pecha_path: Path, output_dir: Path, chapter_base_name: str
+) -> Path:
+    """
+    Copy a single base pecha with a second chapter listed after its base in
+    metadata.json: the same base with only the first 6 annotations of every
+    layer
+    """
+    new_pecha_path = output_dir / pecha_path.name
+    shutil.copytree(pecha_path, new_pecha_path)
+    base_file = next((new_pecha_path / "base").glob("*.txt"))
+    base_name = base_file.stem
+    shutil.copy(base_file, base_file.with_name(f"{chapter_base_name}.txt"))
+
+    layer_dir = new_pecha_path / "layers" / chapter_base_name
+    layer_dir.mkdir()
+    for layer_file in (new_pecha_path / "layers" / base_name).glob("*.json"):
+        layer = json.loads(layer_file.read_text(encoding="utf-8"))
+        for resource in layer["resources"]:
+            resource["@include"] = f"../../base/{chapter_base_name}.txt"
+        layer["annotations"] = layer["annotations"][:6]
+        (layer_dir / layer_file.name).write_text(json.dumps(layer), encoding="utf-8")
+
+    metadata_path = new_pecha_path / "metadata.json"
+    metadata = json.loads(metadata_path.read_text(encoding="utf-8"))
+    metadata["bases"].append(
+        {chapter_base_name: {"base_file": f"{chapter_base_name}.txt"}}
+    )
+    metadata_path.write_text(json.dumps(metadata), encoding="utf-8")
+    return new_pecha_path
+
+
+class TestChapters(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        tmp_path = Path(self.tmp_dir.name)
+        # The second chapter bases of the root and translation pechas come
+        # first on disk
+        self.pechas = {
+            name: Pecha.from_path(
+                copy_with_second_chapter(
+                    TRANSLATION_DATA_DIR / path, tmp_path, chapter_base_name
+                )
+            )
+            for name, path, chapter_base_name in [
+                ("root_pecha", "P2/I73078576", "0000"),
+                ("root_display_pecha", "P1/I15C4AA72", "ZZZZ"),
+                ("translation_pecha", "P3/I4FA57826", "0000"),
+                ("translation_display_pecha", "P4/I18FD6864", "ZZZZ"),
+            ]
+        }
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_chapter_outputs(self):
+        outputs = get_chapter_outputs(
+            TranslationSession,
+            self.pechas,
+            ["get_serialized_translation", "get_aligned_translation"],
+            max_processes=2,
+        )
+
+        second_chapter = TranslationSession(
+            chapter=2,
+            **{
+                name: get_pecha_chapters(pecha)[1]
+                for name, pecha in self.pechas.items()
+            },
+        )
+        assert second_chapter.root_pecha.base_name == "0000"
+        serialized = read_json(TRANSLATION_DATA_DIR / "serialized_translation.json")
+        second_serialized = second_chapter.get_serialized_translation()
+        assert second_serialized != serialized
+        assert second_serialized[0].startswith("<2>")
+        assert outputs["get_serialized_translation"] == serialized + second_serialized
+
+        aligned = read_json(TRANSLATION_DATA_DIR / "aligned_translation.json")
+        second_aligned = second_chapter.get_aligned_translation()
+        assert outputs["get_aligned_translation"] == aligned + second_aligned
+
+    def test_chapters_are_loaded_alone(self):
+        # The chapters are computed from their own base and layers, without
+        # loading every base of the pechas
+        with mock.patch.object(Pecha, "from_path", side_effect=AssertionError):
+            outputs = get_chapter_outputs(
+                TranslationSession,
+                self.pechas,
+                ["get_serialized_translation"],
+                max_processes=1,
+            )
+
+        sessions = get_chapter_sessions(TranslationSession, self.pechas)
+        assert outputs["get_serialized_translation"] == [
+            segment
+            for session in sessions
+            for segment in session.get_serialized_translation()
+        ]
+
+    def test_async_chapter_mappings(self):
+        root_chapters = get_pecha_chapters(self.pechas["root_pecha"])
+        display_chapters = get_pecha_chapters(self.pechas["root_display_pecha"])
+
+        async def get_mappings():
+            async with AsyncTranslationAlignmentTransfer(max_processes=2) as transfer:
+                return await asyncio.gather(
+                    *[
+                        transfer.get_root_pechas_mapping(root, display)
+                        for root, display in zip(root_chapters, display_chapters)
+                    ]
+                )
+
+        mappings = asyncio.run(get_mappings())
+
+        transfer = TranslationAlignmentTransfer()
+        assert mappings == [
+            transfer.get_root_pechas_mapping(root, display)
+            for root, display in zip(root_chapters, display_chapters)
+        ]
+        assert mappings[0] != mappings[1]
+
+    def test_legacy_outputs(self):
+        transfer = TranslationAlignmentTransfer()
+        pechas = [self.pechas[name] for name in ("root_pecha", "root_display_pecha")]
+
+        # Every chapter, never the first base alone
+        serialized = transfer.get_serialized_translation(
+            *pechas, self.pechas["translation_pecha"]
+        )
+        outputs = get_chapter_outputs(
+            TranslationSession, self.pechas, ["get_serialized_translation"]
+        )
+        assert serialized == outputs["get_serialized_translation"]
+
+        with self.assertRaises(ValueError):
+            transfer.get_root_pechas_mapping(*pechas)
+
+    def test_bases_mismatch(self):
+        pechas = dict(self.pechas)
+        pechas["root_pecha"] = Pecha.from_path(TRANSLATION_DATA_DIR / "P2/I73078576")
+
+        with self.assertRaises(ValueError):
+            get_chapter_sessions(TranslationSession, pechas)
+
+    def test_no_bases(self):
+        pechas = {}
+        for name, pecha in self.pechas.items():
+            for base_file in pecha.base_path.glob("*.txt"):
+                base_file.unlink()
+            pechas[name] = Pecha.from_path(pecha.pecha_path)
+
+        with self.assertRaises(ValueError):
+            get_chapter_sessions(TranslationSession, pechas)
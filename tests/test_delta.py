@@ -0,0 +1,93 @@
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+from alignment_ann_transfer.delta import (
+    apply_delta,
+    commit_fingerprints,
+    get_delta,
+    write_delta,
+)
+
+
+class TestDelta(TestCase):
+    def test_delta(self):
+        previous = ["<1><1>a", "<1><2>b", "c", "<1><3>d", "<1><3>e"]
+        segments = ["<1><1>a", "<1><2>B", "c", "<1><3>d", "<1><4>f"]
+        _, fingerprint = get_delta("output", previous)
+
+        delta, _ = get_delta("output", segments, fingerprint)
+
+        assert delta["added"] == {"1.4.0": "<1><4>f"}
+        assert delta["changed"] == {"1.2.0": "<1><2>B"}
+        assert delta["removed"] == ["1.3.1"]
+        previous_segments = {
+            "1.1.0": "<1><1>a",
+            "1.2.0": "<1><2>b",
+            "1.2.1": "c",
+            "1.3.0": "<1><3>d",
+            "1.3.1": "<1><3>e",
+        }
+        assert list(apply_delta(previous_segments, delta).values()) == segments
+
+    def test_output_order(self):
+        segments = ["<1><5>a", "<1><2>b"]
+
+        delta, fingerprint = get_delta("output", segments)
+        assert list(apply_delta({}, delta).values()) == segments
+
+        segments = ["<1><2>b", "<1><5>a"]
+        delta, _ = get_delta("output", segments, fingerprint)
+        previous_segments = {"1.5.0": "<1><5>a", "1.2.0": "<1><2>b"}
+        assert list(apply_delta(previous_segments, delta).values()) == segments
+
+    def test_rows(self):
+        previous = [{"text": "a"}, {"text": "b"}]
+        _, fingerprint = get_delta("output", previous, segment_ids=["1.1", "1.2"])
+
+        # A row added at the front leaves the others unchanged
+        segments = [{"text": "c"}, *previous]
+        delta, _ = get_delta("output", segments, fingerprint, ["1.0", "1.1", "1.2"])
+
+        assert delta["added"] == {"1.0": {"text": "c"}}
+        assert not delta["changed"] and not delta["removed"]
+        previous_segments = dict(zip(["1.1", "1.2"], previous))
+        assert list(apply_delta(previous_segments, delta).values()) == segments
+
+    def test_moves(self):
+        previous = [f"<1><{idx}>text" for idx in range(1, 101)]
+        _, fingerprint = get_delta("output", previous)
+
+        # Moving a segment to the end and adding one at the front only records
+        # these two
+        segments = ["<1><0>new", *previous[:10], *previous[11:], previous[10]]
+        delta, _ = get_delta("output", segments, fingerprint)
+
+        assert delta["moved"] == ["1.11.0"]
+        assert delta["after"] == {"1.0.0": None, "1.11.0": "1.100.0"}
+        previous_segments = dict(zip(fingerprint, previous))
+        assert list(apply_delta(previous_segments, delta).values()) == segments
+
+    def test_other_export(self):
+        previous = ["<1><1>a", "<1><2>b"]
+        _, fingerprint = get_delta("output", previous)
+        delta, _ = get_delta("output", ["<1><1>a", "<1><2>c"], fingerprint)
+
+        with self.assertRaises(ValueError):
+            apply_delta({"1.1.0": "<1><1>a", "1.2.0": "<1><2>B"}, delta)
+        with self.assertRaises(ValueError):
+            apply_delta({}, delta)
+
+    def test_fingerprints_are_committed_last(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            output_dir = Path(tmp_dir)
+            write_delta(output_dir, "output", ["<1><1>a"])
+
+            # An export interrupted before the commit is computed again
+            entry = write_delta(output_dir, "output", ["<1><1>a"])
+            assert entry["previous_digest"] is None and entry["added"] == 1
+
+            commit_fingerprints(output_dir, ["output"])
+            entry = write_delta(output_dir, "output", ["<1><1>a"])
+            assert entry["previous_digest"] == entry["digest"]
+            assert entry["added"] == 0
@@ -0,0 +1,42 @@
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+from alignment_ann_transfer.mapping_store import MappingStore
+
+
+class TestMappingStore(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache_dir = Path(self.tmp_dir.name) / "cache"
+        self.base_path = Path(self.tmp_dir.name) / "base.txt"
+        self.base_path.write_text("base text", encoding="utf-8")
+        self.calls = 0
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def compute(self):
+        self.calls += 1
+        return {2: [[1, [0, 4]]], 1: []}
+
+    def test_mapping_is_shared_across_stores(self):
+        mapping = MappingStore(self.cache_dir).get_or_compute(
+            "root_pechas_mapping", [self.base_path], self.compute
+        )
+        stored_mapping = MappingStore(self.cache_dir).get_or_compute(
+            "root_pechas_mapping", [self.base_path], self.compute
+        )
+
+        assert self.calls == 1
+        assert stored_mapping == mapping
+        assert list(stored_mapping) == [2, 1]
+
+    def test_mapping_is_recomputed_when_file_content_changes(self):
+        store = MappingStore(self.cache_dir)
+        store.get_or_compute("root_pechas_mapping", [self.base_path], self.compute)
+
+        self.base_path.write_text("edited base text", encoding="utf-8")
+        store.get_or_compute("root_pechas_mapping", [self.base_path], self.compute)
+
+        assert self.calls == 2
@@ -0,0 +1,165 @@
+import random
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import patch
+
+from diff_match_patch import diff_match_patch
+from openpecha.pecha import Pecha
+from openpecha.utils import read_json
+
+import alignment_ann_transfer
+from alignment_ann_transfer.mapping_store import MappingStore
+from alignment_ann_transfer.projection import AnchoredProjection, DiffProjection
+from alignment_ann_transfer.spans import get_span_overlaps, get_windowed_span_overlaps
+from alignment_ann_transfer.stats import TransferStats
+from alignment_ann_transfer.translation import TranslationAlignmentTransfer
+from alignment_ann_transfer.windowed import get_windows, project_windows
+
+TRANSLATION_DATA_DIR = Path(__file__).parent / "translation" / "data"
+
+
+def edit_text(text: str, edits: int, rng: random.Random) -> str:
+    chars = list(text)
+    for _ in range(edits):
+        pos = rng.randrange(len(chars))
+        edit = rng.choice(["delete", "insert", "replace"])
+        if edit == "delete":
+            del chars[pos]
+        elif edit == "insert":
+            chars.insert(pos, rng.choice("་།, "))
+        else:
+            chars[pos] = rng.choice("་།, ")
+    return "".join(chars)
+
+
+class TestProjection(TestCase):
+    def setUp(self):
+        rng = random.Random(0)
+        syllables = ["བྱང", "ཆུབ", "སེམས", "དཔའ", "ཤེས", "རབ", "ཀྱི", "ཕ", "རོལ"]
+        self.src = "་".join(rng.choice(syllables) for _ in range(2000))
+        self.tgt = edit_text(self.src, 40, rng)
+
+    def test_diff_projection(self):
+        dmp = diff_match_patch()
+        diffs = dmp.diff_main(self.src, self.tgt, checklines=False)
+        offsets = list(range(len(self.src) + 1))
+
+        table = DiffProjection().get_offset_table(self.src, self.tgt)
+
+        expected = [dmp.diff_xIndex(diffs, offset) for offset in offsets]
+        assert table.project(offsets).tolist() == expected
+
+    def test_anchored_projection(self):
+        table = AnchoredProjection(anchor_length=16).get_offset_table(
+            self.src, self.tgt
+        )
+
+        # Every run is equal in both texts
+        for src_start, tgt_start, length in zip(
+            table.src_starts.tolist(), table.tgt_starts.tolist(), table.lengths.tolist()
+        ):
+            for offset in range(length):
+                assert self.src[src_start + offset] == self.tgt[tgt_start + offset]
+        projected = table.project(range(len(self.src) + 1)).tolist()
+        assert projected == sorted(projected)
+        assert projected[-1] == len(self.tgt)
+
+    def test_transfer_with_projection(self):
+        transfer = TranslationAlignmentTransfer(projection=AnchoredProjection())
+
+        root_map = transfer.get_root_pechas_mapping(
+            Pecha.from_path(TRANSLATION_DATA_DIR / "P2/I73078576"),
+            Pecha.from_path(TRANSLATION_DATA_DIR / "P1/I15C4AA72"),
+        )
+
+        expected_root_map = read_json(TRANSLATION_DATA_DIR / "root_pechas_mapping.json")
+        assert {str(k): v for k, v in root_map.items()} == expected_root_map
+
+    def test_stored_mappings_are_kept_per_backend(self):
+        root_pecha = Pecha.from_path(TRANSLATION_DATA_DIR / "P2/I73078576")
+        root_display_pecha = Pecha.from_path(TRANSLATION_DATA_DIR / "P1/I15C4AA72")
+
+        computed = []
+        with tempfile.TemporaryDirectory() as cache_dir:
+            mapping_store = MappingStore(Path(cache_dir))
+            for options in [
+                {"in_memory": False},
+                {"projection": AnchoredProjection()},
+                {"window_size": 50},
+                {"projection": AnchoredProjection(), "window_size": 50},
+                {"projection": AnchoredProjection()},
+            ]:
+                stats = TransferStats()
+                TranslationAlignmentTransfer(
+                    mapping_store=mapping_store, stats=stats, **options
+                ).get_root_pechas_mapping(root_pecha, root_display_pecha)
+                computed.append(stats.calls.get("pechas_mapping", 0))
+
+        # Only the mapping of the same backend is loaded from the store
+        assert computed == [1, 1, 1, 1, 0]
+
+    def test_windowed_projection(self):
+        windows = get_windows(self.src, self.tgt, window_size=1000, anchor_length=16)
+        offsets = list(range(len(self.src) + 1))
+        projected = project_windows(
+            DiffProjection(), self.src, self.tgt, windows, offsets, max_processes=2
+        ).tolist()
+
+        assert len(windows) > 1
+        # Windows are cut at anchors equal in both texts
+        for src_start, _, tgt_start, _ in windows[1:]:
+            assert self.src[src_start:][:16] == self.tgt[tgt_start:][:16]
+            assert projected[src_start] == tgt_start
+        assert projected == sorted(projected)
+        assert projected[-1] == len(self.tgt)
+
+    def test_windowed_span_overlaps(self):
+        import numpy as np
+
+        rng = np.random.default_rng(0)
+        src_starts = rng.integers(0, 5000, 300)
+        src_ends = src_starts + rng.integers(0, 200, 300)
+        tgt_starts = rng.integers(0, 5000, 300)
+        tgt_ends = tgt_starts + rng.integers(0, 200, 300)
+
+        expected = get_span_overlaps(src_starts, src_ends, tgt_starts, tgt_ends)
+        overlaps = get_windowed_span_overlaps(
+            src_starts, src_ends, tgt_starts, tgt_ends, window_size=500
+        )
+        assert [o.tolist() for o in overlaps] == [o.tolist() for o in expected]
+
+    def test_windowed_transfer(self):
+        transfer = TranslationAlignmentTransfer(window_size=50)
+
+        root_map = transfer.get_root_pechas_mapping(
+            Pecha.from_path(TRANSLATION_DATA_DIR / "P2/I73078576"),
+            Pecha.from_path(TRANSLATION_DATA_DIR / "P1/I15C4AA72"),
+        )
+
+        expected_root_map = read_json(TRANSLATION_DATA_DIR / "root_pechas_mapping.json")
+        assert {str(k): v for k, v in root_map.items()} == expected_root_map
+
+    def test_windowed_mapping_working_set(self):
+        transfer = TranslationAlignmentTransfer(window_size=50)
+        src_pecha = Pecha.from_path(TRANSLATION_DATA_DIR / "P2/I73078576")
+        tgt_pecha = Pecha.from_path(TRANSLATION_DATA_DIR / "P1/I15C4AA72")
+        transfer_spans = transfer.get_transfer_spans(src_pecha, tgt_pecha)
+        display_spans = transfer.get_layer_spans(tgt_pecha)
+
+        with patch.object(
+            alignment_ann_transfer,
+            "get_span_overlaps",
+            wraps=alignment_ann_transfer.get_span_overlaps,
+        ) as span_overlaps:
+            root_map = transfer.get_root_pechas_mapping(src_pecha, tgt_pecha)
+
+        expected_root_map = read_json(TRANSLATION_DATA_DIR / "root_pechas_mapping.json")
+        assert {str(k): v for k, v in root_map.items()} == expected_root_map
+
+        # Every window only overlaps its own src spans with a few tgt spans
+        src_sizes = [len(c.args[0]) for c in span_overlaps.call_args_list]
+        tgt_sizes = [len(c.args[2]) for c in span_overlaps.call_args_list]
+        assert len(src_sizes) > 1
+        assert sum(src_sizes) == len(transfer_spans)
+        assert max(tgt_sizes) < len(display_spans)
@@ -0,0 +1,128 @@
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+from openpecha.pecha import Pecha
+from openpecha.utils import read_json
+
+from alignment_ann_transfer.index import AlignmentIndex
+from alignment_ann_transfer.session import (
+    BulkSession,
+    CommentarySession,
+    TranslationSession,
+)
+from alignment_ann_transfer.stats import TransferStats
+from alignment_ann_transfer.translation import TranslationAlignmentTransfer
+
+TESTS_DIR = Path(__file__).parent
+TRANSLATION_DATA_DIR = TESTS_DIR / "translation" / "data"
+COMMENTARY_DATA_DIR = TESTS_DIR / "commentary" / "data"
+
+
+class TestTranslationSession(TestCase):
+    def setUp(self):
+        self.stats = TransferStats()
+        self.session = TranslationSession(
+            Pecha.from_path(TRANSLATION_DATA_DIR / "P2/I73078576"),
+            Pecha.from_path(TRANSLATION_DATA_DIR / "P1/I15C4AA72"),
+            Pecha.from_path(TRANSLATION_DATA_DIR / "P3/I4FA57826"),
+            Pecha.from_path(TRANSLATION_DATA_DIR / "P4/I18FD6864"),
+            transfer=TranslationAlignmentTransfer(in_memory=True, stats=self.stats),
+        )
+
+    def test_outputs(self):
+        for output in [
+            "serialized_translation",
+            "serialized_translation_display",
+            "aligned_translation",
+        ]:
+            result = getattr(self.session, f"get_{output}")()
+            assert result == read_json(TRANSLATION_DATA_DIR / f"{output}.json")
+
+        # Root and translation layers are the only ones base updated
+        assert self.stats.calls["base_update_anns"] == 2
+
+
+class TestCommentarySession(TestCase):
+    def test_outputs(self):
+        session = CommentarySession(
+            Pecha.from_path(COMMENTARY_DATA_DIR / "P2/IC7760088"),
+            Pecha.from_path(COMMENTARY_DATA_DIR / "P1/IA6E66F92"),
+            Pecha.from_path(COMMENTARY_DATA_DIR / "P3/I77BD6EA9"),
+            Pecha.from_path(COMMENTARY_DATA_DIR / "P4/IE292A440"),
+        )
+
+        outputs = {
+            "serialized_commentary": session.get_serialized_commentary,
+            "serialized_commentary_display": session.get_serialized_commentary_display,
+            "aligned_commentary": session.get_aligned_display_commentary,
+        }
+        for output, get_output in outputs.items():
+            assert get_output() == read_json(COMMENTARY_DATA_DIR / f"{output}.json")
+
+    def test_without_display_pecha(self):
+        session = CommentarySession(
+            Pecha.from_path(COMMENTARY_DATA_DIR / "P2/IC7760088"),
+            Pecha.from_path(COMMENTARY_DATA_DIR / "P1/IA6E66F92"),
+            Pecha.from_path(COMMENTARY_DATA_DIR / "P3/I77BD6EA9"),
+        )
+
+        with self.assertRaises(ValueError):
+            session.get_serialized_commentary_display()
+
+
+class TestBulkSession(TestCase):
+    def get_column(self, table, column, name):
+        return [
+            {"root_display_text": row["root_display_text"], column: row[column][name]}
+            for row in table.values()
+        ]
+
+    def test_translations(self):
+        translation_pecha = Pecha.from_path(TRANSLATION_DATA_DIR / "P3/I4FA57826")
+        session = BulkSession(
+            Pecha.from_path(TRANSLATION_DATA_DIR / "P2/I73078576"),
+            Pecha.from_path(TRANSLATION_DATA_DIR / "P1/I15C4AA72"),
+            translation_pechas={"en": translation_pecha, "en2": translation_pecha},
+        )
+
+        table = session.get_aligned_table()
+
+        expected = read_json(TRANSLATION_DATA_DIR / "aligned_translation.json")
+        assert self.get_column(table, "translation_text", "en") == expected
+        assert self.get_column(table, "translation_text", "en2") == expected
+        assert all(row["commentary_text"] == {} for row in table.values())
+
+    def test_commentaries(self):
+        session = BulkSession(
+            Pecha.from_path(COMMENTARY_DATA_DIR / "P2/IC7760088"),
+            Pecha.from_path(COMMENTARY_DATA_DIR / "P1/IA6E66F92"),
+            commentary_pechas={
+                "bo": Pecha.from_path(COMMENTARY_DATA_DIR / "P3/I77BD6EA9")
+            },
+        )
+
+        table = session.get_aligned_table()
+
+        expected = read_json(COMMENTARY_DATA_DIR / "aligned_commentary.json")
+        assert self.get_column(table, "commentary_text", "bo") == expected
+
+    def test_alignment_index(self):
+        session = BulkSession(
+            Pecha.from_path(COMMENTARY_DATA_DIR / "P2/IC7760088"),
+            Pecha.from_path(COMMENTARY_DATA_DIR / "P1/IA6E66F92"),
+            commentary_pechas={
+                "bo": Pecha.from_path(COMMENTARY_DATA_DIR / "P3/I77BD6EA9")
+            },
+        )
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            index_path = Path(tmp_dir) / "index.json"
+            session.alignment_index.save(index_path)
+            index = AlignmentIndex.load(index_path)
+
+        table = session.get_aligned_table()
+        assert index.get_table() == table
+        for root_display_idx, row in table.items():
+            assert index.get_row(root_display_idx) == row
+            for root_idx in index.get_root_idxs(root_display_idx):
+                assert root_display_idx in index.get_root_display_idxs(root_idx)
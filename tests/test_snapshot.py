@@ -0,0 +1,128 @@
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from unittest import TestCase
+
+from openpecha.pecha import Pecha
+from openpecha.utils import read_json
+
+from alignment_ann_transfer.commentary import CommentaryAlignmentTransfer
+from alignment_ann_transfer.projection import DiffProjection
+from alignment_ann_transfer.session import CommentarySession, TranslationSession
+from alignment_ann_transfer.snapshot import (
+    LayerSnapshot,
+    LayerSnapshotStore,
+    write_layer_snapshot,
+)
+from alignment_ann_transfer.translation import TranslationAlignmentTransfer
+
+TESTS_DIR = Path(__file__).parent
+TRANSLATION_DATA_DIR = TESTS_DIR / "translation" / "data"
+COMMENTARY_DATA_DIR = TESTS_DIR / "commentary" / "data"
+
+
+class TestLayerSnapshot(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        tmp_path = Path(self.tmp_dir.name)
+        self.snapshot_path = tmp_path / "layer.snap"
+        self.layer_path = tmp_path / "layer.json"
+        self.layer_path.write_text("{}", encoding="utf-8")
+        self.base_path = tmp_path / "base.txt"
+        self.base_path.write_text("བྱང་ཆུབ་ sems dpa'", encoding="utf-8")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_snapshot(self):
+        spans = [(0, 8, "2"), (9, 13, "1,3-4"), (14, 18, "2")]
+        write_layer_snapshot(self.snapshot_path, self.layer_path, self.base_path, spans)
+
+        snapshot = LayerSnapshot(self.snapshot_path)
+        assert [snapshot.get_text(pos) for pos in range(3)] == [
+            "བྱང་ཆུབ་",
+            "sems",
+            "dpa'",
+        ]
+        assert [snapshot.get_root_idx_mapping(pos) for pos in range(3)] == [
+            "2",
+            "1,3-4",
+            "2",
+        ]
+        assert snapshot.root_idx.tolist() == [2, 1, 2]
+        assert snapshot.get_spans(unique=False).starts.tolist() == [0, 9, 14]
+        # Same as extract_spans: first position, last span of a root idx
+        spans = snapshot.get_spans(unique=True)
+        assert spans.starts.tolist() == [14, 9]
+        assert spans.root_idx.tolist() == [2, 1]
+
+        assert snapshot.is_fresh(self.layer_path, self.base_path)
+        stat = self.layer_path.stat()
+        os.utime(self.layer_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        assert not snapshot.is_fresh(self.layer_path, self.base_path)
+
+    def test_concurrent_writes(self):
+        spans = [(0, 8, "2"), (9, 13, "1,3-4")] * 1000
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            for _ in range(16):
+                executor.submit(
+                    write_layer_snapshot,
+                    self.snapshot_path,
+                    self.layer_path,
+                    self.base_path,
+                    spans,
+                )
+
+        snapshot = LayerSnapshot(self.snapshot_path)
+        assert snapshot.starts.tolist() == [span[0] for span in spans]
+        assert list(self.snapshot_path.parent.glob("*.tmp")) == []
+
+
+class TestSnapshotTransfer(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.snapshot_store = LayerSnapshotStore(Path(self.tmp_dir.name))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_translation_outputs(self):
+        session = TranslationSession(
+            Pecha.from_path(TRANSLATION_DATA_DIR / "P2/I73078576"),
+            Pecha.from_path(TRANSLATION_DATA_DIR / "P1/I15C4AA72"),
+            Pecha.from_path(TRANSLATION_DATA_DIR / "P3/I4FA57826"),
+            Pecha.from_path(TRANSLATION_DATA_DIR / "P4/I18FD6864"),
+            transfer=TranslationAlignmentTransfer(
+                projection=DiffProjection(), snapshot_store=self.snapshot_store
+            ),
+        )
+
+        for output in [
+            "serialized_translation",
+            "serialized_translation_display",
+            "aligned_translation",
+        ]:
+            result = getattr(session, f"get_{output}")()
+            assert result == read_json(TRANSLATION_DATA_DIR / f"{output}.json")
+        assert len(list(Path(self.tmp_dir.name).glob("*.snap"))) == 4
+
+    def test_commentary_outputs(self):
+        session = CommentarySession(
+            Pecha.from_path(COMMENTARY_DATA_DIR / "P2/IC7760088"),
+            Pecha.from_path(COMMENTARY_DATA_DIR / "P1/IA6E66F92"),
+            Pecha.from_path(COMMENTARY_DATA_DIR / "P3/I77BD6EA9"),
+            Pecha.from_path(COMMENTARY_DATA_DIR / "P4/IE292A440"),
+            transfer=CommentaryAlignmentTransfer(
+                projection=DiffProjection(), snapshot_store=self.snapshot_store
+            ),
+        )
+
+        outputs = {
+            "serialized_commentary": session.get_serialized_commentary,
+            "serialized_commentary_display": session.get_serialized_commentary_display,
+            "aligned_commentary": session.get_aligned_display_commentary,
+        }
+        for output, get_output in outputs.items():
+            assert get_output() == read_json(COMMENTARY_DATA_DIR / f"{output}.json")
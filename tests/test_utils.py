@@ -0,0 +1,130 @@
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+from stam import AnnotationStore
+
+from alignment_ann_transfer.spans import (
+    SpanArray,
+    SpanIndex,
+    get_overlapping_spans,
+    get_span_overlaps,
+    get_windowed_span_overlaps,
+)
+from alignment_ann_transfer.stats import TransferStats
+from alignment_ann_transfer.utils import (
+    iter_root_idx_anns,
+    parse_root_indices,
+    parse_root_mapping,
+)
+
+COMMENTARY_DATA_DIR = Path(__file__).parent / "commentary" / "data"
+
+
+class TestParseRootMapping(TestCase):
+    def test_parse_root_indices(self):
+        root_indices = parse_root_indices("7, 1-3,4, 10-12, 11")
+
+        assert root_indices.intervals == [(1, 4), (7, 7), (10, 12)]
+        assert root_indices.first == 1
+        assert 4 in root_indices and 11 in root_indices
+        assert 5 not in root_indices and 0 not in root_indices
+        assert len(root_indices) == 8
+
+    def test_parse_root_mapping(self):
+        assert parse_root_mapping("5,1-3") == [1, 2, 3, 5]
+        assert parse_root_mapping("2") == [2]
+        assert parse_root_mapping("1,1") == [1, 1]
+        assert parse_root_mapping("1-3,2-4") == [1, 2, 2, 3, 3, 4]
+
+
+class TestIterRootIdxAnns(TestCase):
+    def test_layer_order(self):
+        layer_path = next((COMMENTARY_DATA_DIR / "P3").rglob("layers/*/*.json"))
+        layer = AnnotationStore(file=str(layer_path))
+
+        expected = []
+        for ann in layer.annotations():
+            for data in ann:
+                if data.key().id() == "root_idx_mapping":
+                    expected.append((ann.offset().begin().value(), str(data.value())))
+
+        assert [
+            (ann.offset().begin().value(), root_idx_mapping)
+            for ann, root_idx_mapping in iter_root_idx_anns(layer)
+        ] == expected
+
+
+class TestGetOverlappingSpans(TestCase):
+    def test_get_overlapping_spans(self):
+        src_spans = [(0, 10), (10, 20), (20, 20), (25, 30)]
+        tgt_spans = [(5, 15), (0, 5), (15, 25), (20, 20), (18, 22), (26, 27)]
+
+        overlaps = get_overlapping_spans(src_spans, tgt_spans)
+
+        assert overlaps == [[0, 1], [0, 2, 4], [2, 4], [5]]
+
+    def test_edge_touching_spans_do_not_overlap(self):
+        overlaps = get_overlapping_spans([(5, 10)], [(0, 5), (10, 15), (5, 5)])
+
+        assert overlaps == [[]]
+
+    def test_long_enclosing_target(self):
+        import numpy as np
+
+        starts = np.arange(4000) * 10
+        ends = starts + 10
+        tgt_starts, tgt_ends = starts.copy(), ends.copy()
+        tgt_ends[0] = ends[-1]
+        stats = TransferStats()
+
+        src_pos, tgt_pos = get_span_overlaps(
+            starts, ends, tgt_starts, tgt_ends, stats=stats
+        )
+
+        # Every source overlaps its own target and the enclosing one, and only
+        # these pairs are checked
+        assert len(src_pos) == stats.counters["candidate_pairs"] == 7999
+        windowed = get_windowed_span_overlaps(
+            starts, ends, tgt_starts, tgt_ends, window_size=1000
+        )
+        assert windowed[0].tolist() == src_pos.tolist()
+        assert windowed[1].tolist() == tgt_pos.tolist()
+
+    def test_span_index(self):
+        spans = SpanArray([10, 0, 5, 20, 12, 12], [20, 40, 8, 25, 12, 15], range(6))
+        span_index = SpanIndex(spans)
+
+        for start, end in [(0, 5), (8, 10), (12, 13), (18, 22), (40, 50), (13, 13)]:
+            _, expected = get_span_overlaps([start], [end], spans.starts, spans.ends)
+            assert span_index.get_overlaps(start, end) == sorted(expected.tolist())
+
+
+class TestSpanArray(TestCase):
+    def test_from_anns(self):
+        anns = [
+            {"Span": {"start": 0, "end": 5}, "root_idx_mapping": "2-3"},
+            {"Span": {"start": 6, "end": 11}, "root_idx_mapping": 4},
+        ]
+        spans = SpanArray.from_anns(anns, base="hello world")
+
+        assert len(spans) == 2
+        assert spans.root_idx.tolist() == [2, 4]
+        assert spans.get_text(0) == "hello"
+        assert spans.get_text(1) == "world"
+
+    def test_text_is_read_from_base_file_on_demand(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            base_path = Path(tmp_dir) / "base.txt"
+            base_path.write_text("hello world", encoding="utf-8")
+            spans = SpanArray([0, 6], [5, 11], [1, 2], base=base_path)
+
+            assert spans.base == base_path
+            assert spans.get_text(1) == "world"
+            assert spans.base == "hello world"
+
+    def test_text_without_base(self):
+        spans = SpanArray([0], [5], [1])
+
+        with self.assertRaises(ValueError):
+            spans.get_text(0)
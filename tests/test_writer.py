@@ -0,0 +1,30 @@
+import io
+import json
+from unittest import TestCase
+
+from alignment_ann_transfer.writer import write_json_array, write_json_lines
+
+ITEMS = [
+    "<1><2>བཀྲ་ཤིས།",
+    {"root_display_text": "text\n", "translation_text": None},
+    {"root_display_text": "", "commentary_text": ["a", "b"]},
+]
+
+
+class TestWriter(TestCase):
+    def test_write_json_array(self):
+        for indent in [None, 2]:
+            for items in [ITEMS, []]:
+                fp = io.StringIO()
+                write_json_array(iter(items), fp, indent=indent)
+
+                assert fp.getvalue() == json.dumps(
+                    items, ensure_ascii=False, indent=indent
+                )
+
+    def test_write_json_lines(self):
+        fp = io.StringIO()
+        write_json_lines(iter(ITEMS), fp)
+
+        lines = fp.getvalue().splitlines()
+        assert [json.loads(line) for line in lines] == ITEMS
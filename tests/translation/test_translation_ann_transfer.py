@@ -1,9 +1,14 @@
+import copy
+import tempfile
 from pathlib import Path
 from unittest import TestCase
 
 from openpecha.pecha import Pecha
 from openpecha.utils import read_json
 
+from alignment_ann_transfer.mapping_store import MappingStore
+from alignment_ann_transfer.projection import DiffProjection
+from alignment_ann_transfer.stats import TransferStats
 from alignment_ann_transfer.translation import TranslationAlignmentTransfer
 
 DATA_DIR = Path(__file__).parent / "data"
@@ -32,6 +37,132 @@ class TestTranslationAlignmentTransfer(TestCase):
         expected_mapping = read_json(DATA_DIR / "translation_pechas_mapping.json")
         assert {str(k): v for k, v in mapping.items()} == expected_mapping
 
+    def test_get_pechas_mapping_in_memory(self):
+        translation_transfer = TranslationAlignmentTransfer(in_memory=True)
+        layer_files = set(self.root_display_pecha.layer_path.rglob("*.json"))
+        root_mapping = translation_transfer.get_root_pechas_mapping(
+            self.root_pecha, self.root_display_pecha
+        )
+        translation_mapping = translation_transfer.get_translation_pechas_mapping(
+            self.translation_pecha, self.translation_display_pecha
+        )
+        assert {str(k): v for k, v in root_mapping.items()} == read_json(
+            DATA_DIR / "root_pechas_mapping.json"
+        )
+        assert {str(k): v for k, v in translation_mapping.items()} == read_json(
+            DATA_DIR / "translation_pechas_mapping.json"
+        )
+        assert set(self.root_display_pecha.layer_path.rglob("*.json")) == layer_files
+
+    def test_update_mapping(self):
+        translation_transfer = TranslationAlignmentTransfer(in_memory=True)
+        mapping = translation_transfer.get_root_pechas_mapping(
+            self.root_pecha, self.root_display_pecha
+        )
+        transfer_index = translation_transfer.get_transfer_span_index(
+            self.root_pecha, self.root_display_pecha
+        )
+        display_anns = translation_transfer.get_layer_anns(self.root_display_pecha)
+        span = display_anns[2]["Span"]
+        span = (span["start"], span["end"])
+
+        # Resizing an annotation to its own span changes nothing
+        changes = {2: (span, span)}
+        changed = translation_transfer.update_mapping(mapping, transfer_index, changes)
+        assert changed and all(mapping[idx] == m for idx, m in changed.items())
+
+        # A removed annotation is no longer mapped, only its sources change
+        changes = {2: (span, None)}
+        changed = translation_transfer.update_mapping(mapping, transfer_index, changes)
+        assert {**mapping, **changed} == {
+            idx: [m for m in display_map if m[0] != 2]
+            for idx, display_map in mapping.items()
+        }
+        assert set(changed) == {
+            idx
+            for idx, display_map in mapping.items()
+            if 2 in {m[0] for m in display_map}
+        }
+
+    def test_updated_mapping_is_not_cached(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            translation_transfer = TranslationAlignmentTransfer(
+                in_memory=True, mapping_store=MappingStore(Path(cache_dir))
+            )
+            mapping = translation_transfer.get_root_pechas_mapping(
+                self.root_pecha, self.root_display_pecha
+            )
+            expected_mapping = copy.deepcopy(mapping)
+            # Changes not matching the (unedited) root display layer
+            display_anns = translation_transfer.get_layer_anns(self.root_display_pecha)
+            span = display_anns[2]["Span"]
+            changed = translation_transfer.update_root_pechas_mapping(
+                self.root_pecha,
+                self.root_display_pecha,
+                mapping,
+                {2: ((span["start"], span["end"]), None)},
+            )
+            assert changed
+            assert mapping == expected_mapping
+
+            # Neither in memory nor in the mapping store
+            assert (
+                translation_transfer.get_root_pechas_mapping(
+                    self.root_pecha, self.root_display_pecha
+                )
+                == expected_mapping
+            )
+            other_transfer = TranslationAlignmentTransfer(
+                in_memory=True, mapping_store=MappingStore(Path(cache_dir))
+            )
+            assert (
+                other_transfer.get_root_pechas_mapping(
+                    self.root_pecha, self.root_display_pecha
+                )
+                == expected_mapping
+            )
+
+    def test_stats(self):
+        stages = []
+        stats = TransferStats(on_stage=lambda name, duration: stages.append(name))
+        translation_transfer = TranslationAlignmentTransfer(in_memory=True, stats=stats)
+        mapping = translation_transfer.get_root_pechas_mapping(
+            self.root_pecha, self.root_display_pecha
+        )
+
+        assert set(stats.durations) == {
+            "load_layer",
+            "extract_spans",
+            "base_update_anns",
+            "map_spans",
+            "pechas_mapping",
+        }
+        assert stages[-1] == "pechas_mapping"
+        assert stats.calls["load_layer"] == 2
+        assert stats.counters["bytes_read"] > 0
+        assert stats.counters["matched_pairs"] == sum(len(m) for m in mapping.values())
+        assert stats.counters["candidate_pairs"] >= stats.counters["matched_pairs"]
+
+    def test_layers_are_loaded_once(self):
+        stats = TransferStats()
+        translation_transfer = TranslationAlignmentTransfer(
+            projection=DiffProjection(), stats=stats
+        )
+        translation_transfer.get_serialized_translation(
+            self.root_pecha, self.root_display_pecha, self.translation_pecha
+        )
+        translation_transfer.get_serialized_translation_display(
+            self.root_pecha,
+            self.root_display_pecha,
+            self.translation_pecha,
+            self.translation_display_pecha,
+        )
+        translation_transfer.get_aligned_translation(
+            self.root_pecha, self.root_display_pecha, self.translation_pecha
+        )
+
+        assert stats.calls["load_layer"] == 4
+
     def test_get_serialized_translation(self):
         translation_transfer = TranslationAlignmentTransfer()
         serialized_json = translation_transfer.get_serialized_translation(
@@ -61,6 +192,17 @@ class TestTranslationAlignmentTransfer(TestCase):
         expected_aligned_translation = read_json(DATA_DIR / "aligned_translation.json")
         assert aligned_translation == expected_aligned_translation
 
+    def test_streamed_outputs_do_not_cache_texts(self):
+        translation_transfer = TranslationAlignmentTransfer()
+        segments = translation_transfer.iter_aligned_translation(
+            self.root_pecha, self.root_display_pecha, self.translation_pecha
+        )
+        first_segment = next(segments)
+
+        assert "anns" not in {name for name, _ in translation_transfer.cache.entries}
+        expected_aligned_translation = read_json(DATA_DIR / "aligned_translation.json")
+        assert [first_segment, *segments] == expected_aligned_translation
+
 
 work = TestTranslationAlignmentTransfer()
 work.setUp()